@@ -0,0 +1,16 @@
+# coding: utf-8
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+import os
+
+# When run from the command line via "python -m package_coverage", the
+# process already has the user's shell environment
+
+
+def get_env(for_subprocess=False):
+    """
+    :return:
+        A 2-element tuple of (shell path, dict of environment variables)
+    """
+
+    return (os.environ.get('SHELL'), dict(os.environ))
@@ -0,0 +1,296 @@
+# coding: utf-8
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+# A minimal stand-in for the Sublime Text API, used when Package Coverage is
+# run from the command line via "python -m package_coverage". Output panels
+# write to stdout, and the quick and input panels are answered from a list of
+# scripted responses instead of prompting the user.
+
+import sys
+import os
+import re
+import json
+
+if sys.version_info >= (3,):
+    str_cls = str
+else:
+    str_cls = unicode  # noqa
+
+
+# The number of times error_message() has been called, used to determine the
+# exit code of the command line runner
+error_count = 0
+
+
+def version():
+    return '3000'
+
+
+def platform():
+    return {
+        'win32': 'windows',
+        'darwin': 'osx'
+    }.get(sys.platform, 'linux')
+
+
+def packages_path():
+    """
+    :return:
+        A unicode string of the Packages folder - defaults to the folder that
+        contains Package Coverage, but may be overridden by setting the
+        PACKAGE_COVERAGE_PACKAGES_PATH environment variable
+    """
+
+    default = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return os.environ.get('PACKAGE_COVERAGE_PACKAGES_PATH', default)
+
+
+def cache_path():
+    return os.path.join(os.path.dirname(packages_path()), 'Cache')
+
+
+def load_binary_resource(name):
+    """
+    Loads a file from the Packages folder
+
+    :param name:
+        A unicode string in the form "Packages/{package}/{path}"
+
+    :return:
+        A byte string of the file contents
+    """
+
+    parts = name.split('/')
+    if parts[0] != 'Packages' or len(parts) < 3:
+        raise IOError('Resource not found: %s' % name)
+
+    # The Package Coverage directory may have been cloned under another name
+    if parts[1] == 'Package Coverage':
+        package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    else:
+        package_dir = os.path.join(packages_path(), parts[1])
+
+    with open(os.path.join(package_dir, *parts[2:]), 'rb') as f:
+        return f.read()
+
+
+_settings = {}
+
+
+def load_settings(name):
+    """
+    Loads a settings file from Packages/User/
+
+    :param name:
+        A unicode string of the settings file name
+
+    :return:
+        A Settings object
+    """
+
+    if name not in _settings:
+        values = {}
+        path = os.path.join(packages_path(), 'User', name)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                source = f.read().decode('utf-8')
+            # Sublime Text allows comments in settings files
+            source = re.sub('(?m)^\\s*//.*$', '', source)
+            try:
+                values = json.loads(source)
+            except (ValueError):
+                pass
+        _settings[name] = Settings(values)
+    return _settings[name]
+
+
+def save_settings(name):
+    pass
+
+
+def set_timeout(callback, delay):
+    """
+    Runs the callback immediately, in the calling thread, since there is no
+    UI thread to schedule it on
+    """
+
+    callback()
+
+
+set_timeout_async = set_timeout
+
+
+def error_message(string):
+    global error_count
+    error_count += 1
+    sys.stderr.write(string + '\n')
+
+
+def message_dialog(string):
+    sys.stderr.write(string + '\n')
+
+
+def status_message(string):
+    sys.stderr.write(string + '\n')
+
+
+class Settings():
+
+    def __init__(self, values=None):
+        self.values = values or {}
+
+    def get(self, name, default=None):
+        return self.values.get(name, default)
+
+    def set(self, name, value):
+        self.values[name] = value
+
+    def has(self, name):
+        return name in self.values
+
+    def erase(self, name):
+        self.values.pop(name, None)
+
+    def add_on_change(self, key, callback):
+        pass
+
+    def clear_on_change(self, key):
+        pass
+
+
+class View():
+
+    """
+    A view that writes everything inserted into it to stdout
+    """
+
+    def __init__(self, name=None, settings=None):
+        self.name = name
+        self._settings = Settings(settings)
+        self._size = 0
+
+    def id(self):
+        return id(self)
+
+    def settings(self):
+        return self._settings
+
+    def file_name(self):
+        return None
+
+    def size(self):
+        return self._size
+
+    def run_command(self, command, args=None):
+        if command in set(['insert', 'append']):
+            self.insert(None, self._size, args['characters'])
+
+    def begin_edit(self, *args):
+        return None
+
+    def end_edit(self, edit):
+        pass
+
+    def insert(self, edit, point, string):
+        self._size += len(string)
+        sys.stdout.write(string)
+        sys.stdout.flush()
+
+    def erase_regions(self, key):
+        pass
+
+    def erase_status(self, key):
+        pass
+
+
+class Window():
+
+    """
+    A window where the quick and input panels are answered from a list of
+    scripted responses
+
+    :param answers:
+        A list of unicode strings. Quick panels select the item equal to the
+        next answer, or else the first item that starts with it. Input panels
+        submit the next answer.
+
+    :param project_settings:
+        A dict of settings, as would be set in a project file
+    """
+
+    def __init__(self, answers=None, project_settings=None):
+        self.answers = list(answers or [])
+        self.view = View(settings=project_settings)
+        self.panels = {}
+
+    def id(self):
+        return id(self)
+
+    def active_view(self):
+        return self.view
+
+    def views(self):
+        return [self.view]
+
+    def folders(self):
+        return []
+
+    def project_file_name(self):
+        return ''
+
+    def project_data(self):
+        return {}
+
+    def set_project_data(self, data):
+        pass
+
+    def get_output_panel(self, name):
+        if name not in self.panels:
+            self.panels[name] = View(name)
+        return self.panels[name]
+
+    create_output_panel = get_output_panel
+
+    def run_command(self, command, args=None):
+        pass
+
+    def show_quick_panel(self, items, on_done, flags=0, selected_index=-1, on_highlight=None):
+        if not self.answers:
+            error_message('No answer provided for quick panel')
+            on_done(-1)
+            return
+        answer = self.answers.pop(0)
+        captions = []
+        for item in items:
+            if not isinstance(item, str_cls):
+                item = item[0]
+            captions.append(item)
+        if answer in captions:
+            on_done(captions.index(answer))
+            return
+        for index, caption in enumerate(captions):
+            if caption.startswith(answer):
+                on_done(index)
+                return
+        error_message('No quick panel item matched "%s"' % answer)
+        on_done(-1)
+
+    def show_input_panel(self, caption, initial_text, on_done, on_change, on_cancel):
+        if not self.answers:
+            error_message('No answer provided for input panel "%s"' % caption)
+            if on_cancel:
+                on_cancel()
+            return self.view
+        on_done(self.answers.pop(0))
+        return self.view
+
+
+_window = Window()
+
+
+def active_window():
+    return _window
+
+
+def windows():
+    return [_window]
@@ -0,0 +1,27 @@
+# coding: utf-8
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+# A minimal stand-in for the sublime_plugin module, used when Package Coverage
+# is run from the command line via "python -m package_coverage"
+
+
+class ApplicationCommand():
+
+    def __init__(self):
+        pass
+
+
+class WindowCommand():
+
+    def __init__(self, window):
+        self.window = window
+
+
+class TextCommand():
+
+    def __init__(self, view):
+        self.view = view
+
+
+class EventListener():
+    pass
@@ -0,0 +1,14 @@
+CREATE TABLE memory_results (
+    id integer PRIMARY KEY AUTOINCREMENT,
+    project varchar NOT NULL,
+    commit_hash varchar NOT NULL,
+    commit_date timestamp NOT NULL,
+    platform varchar NOT NULL,
+    python_version varchar NOT NULL,
+    run_date timestamp NOT NULL,
+    test_id varchar NOT NULL,
+    outcome varchar NOT NULL,
+    peak integer NOT NULL,
+    retained integer NOT NULL,
+    sites varchar NOT NULL
+);
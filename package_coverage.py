@@ -8,16 +8,23 @@ import threading
 import imp
 import time
 import unittest
+
+# When run from the command line via "python -m package_coverage", a minimal
+# stand-in for the Sublime Text API is used so the commands work outside of
+# the editor
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'headless'))
+
 import sublime
 import sublime_plugin
-import coverage
-import coverage.files
-import shellenv
-import sqlite3
-import subprocess
-import webbrowser
-import shutil
-import inspect
+import json
+import hashlib
+import codecs
+import zlib
+import heapq
+import traceback
+import gc
+import math
 from datetime import datetime
 from textwrap import dedent
 
@@ -27,13 +34,41 @@ if sys.platform == 'win32':
 if sys.version_info >= (3,):
     from io import StringIO
     from imp import reload
+    from time import monotonic
+    str_cls = str
 else:
     from cStringIO import StringIO
+    from time import time as monotonic
+    str_cls = unicode  # noqa
 
 
 __version__ = '1.1.1'
 __version_info__ = (1, 1, 1)
 
+HEADLESS = __name__ == '__main__'
+
+# The first item of the quick panel for running tests by name
+REGEX_CAPTION = 'Enter a regular expression'
+
+# Modules that are slow to import, so they are only imported by the functions
+# that use them, rather than each time Sublime Text loads the plugin. Newer
+# versions of Python import inspect as part of unittest, which must be
+# imported when the plugin loads, so the startup check ignores any of these
+# that unittest imports itself.
+DEFERRED_MODULES = [
+    'coverage',
+    'gzip',
+    'inspect',
+    'random',
+    'shellenv',
+    'shutil',
+    'sqlite3',
+    'subprocess',
+    'tempfile',
+    'tracemalloc',
+    'webbrowser'
+]
+
 
 class PackageCoverageExecCommand(sublime_plugin.WindowCommand):
 
@@ -41,7 +76,17 @@ class PackageCoverageExecCommand(sublime_plugin.WindowCommand):
     Runs the tests for a package and displays the output in an output panel
     """
 
-    def run(self, do_coverage=False, ui_thread=False, html_report=False, by_name=False):
+    # None or a callback to execute once the output has been displayed, if
+    # the run was abandoned because a test would not stop after timing out
+    on_hang = None
+
+    # The number of characters of output that may be waiting to be displayed
+    # before the tests are paused
+    max_queued_output = 1024 * 1024
+
+    def run(self, do_coverage=False, ui_thread=False, html_report=False, by_name=False, full_run=False,
+            parallel=False, class_names=None, save_history=True, measure_memory=False, repeat=False, seed=None,
+            minimize=False, smoke_suite=False, test_names=None):
         testable_packages = find_testable_packages()
 
         if not testable_packages:
@@ -52,14 +97,50 @@ class PackageCoverageExecCommand(sublime_plugin.WindowCommand):
             '''))
             return
 
+        # The tracemalloc module was added in Python 3.4
+        if measure_memory and sys.version_info < (3, 4):
+            sublime.error_message(format_message('''
+                Package Coverage
+
+                Measuring memory requires Python 3.4 or newer, such as the
+                Python 3.8 plugin host of Sublime Text 4
+            '''))
+            return
+
         settings = sublime.load_settings('Package Coverage.sublime-settings')
         self.coverage_database = get_setting(self.window, settings, 'coverage_database')
-        self.do_coverage = do_coverage
+        self.cache_test_results = get_setting(self.window, settings, 'cache_test_results', False)
+        self.python_executable = get_setting(self.window, settings, 'python_executable')
+        self.max_workers = get_setting(self.window, settings, 'max_workers') or default_max_workers()
+        self.test_timeout = get_setting(self.window, settings, 'test_timeout')
+        self.run_timeout = get_setting(self.window, settings, 'run_timeout')
+        self.warm_worker = get_setting(self.window, settings, 'warm_worker', False)
+        # Coverage measurement allocates memory while tests run, and tests
+        # run slower while tracing allocations, so memory runs neither
+        # measure coverage nor record test durations
+        self.measure_memory = measure_memory
+        # Minimizing needs the lines executed by each test, which are only
+        # recorded when the tests run here, one after another
+        self.minimize = minimize and not measure_memory
+        self.do_coverage = do_coverage and not measure_memory and not self.minimize
+        self.full_run = full_run or self.minimize
+        self.parallel = parallel and not self.minimize
+        self.repeat = repeat and not self.minimize
+        self.seed = seed
+        self.class_names = class_names
+        self.smoke_suite = smoke_suite
+        self.test_names = test_names
+        self.save_history = save_history and not measure_memory
+        self.history = None
+        self.test_cache = None
         self.ui_thread = ui_thread
         self.html_report = html_report
         self.packages = testable_packages
         self.by_name = by_name
         self.name_pattern = None
+        self.result = None
+        self.coverage_record = None
+        self.memory_results = None
         self.window.show_quick_panel(testable_packages, self.on_done)
 
     def on_done(self, index):
@@ -76,10 +157,88 @@ class PackageCoverageExecCommand(sublime_plugin.WindowCommand):
 
         self.package_name = self.packages[index]
 
+        # The worker is started now so it can load the package while a test
+        # is being chosen
+        package_dir = os.path.join(sublime.packages_path(), self.package_name)
+        if self.uses_warm_worker(package_dir):
+            threading.Thread(target=get_warm_worker, args=(self.python_executable, self.package_name)).start()
+
         if not self.by_name:
             return self.run_tests()
 
-        self.prompt_name_pattern()
+        self.prompt_test()
+
+    def uses_warm_worker(self, package_dir):
+        """
+        :param package_dir:
+            A unicode string of the filesystem path to the folder containing
+            the package
+
+        :return:
+            A boolean - if the tests should be run in the warm worker
+        """
+
+        # The HTML report, memory measurement and tests using the sublime API
+        # need to run here. The worker does not cache test results, so runs
+        # with caching enabled also stay here.
+        if not self.warm_worker or self.ui_thread or self.html_report:
+            return False
+        if self.measure_memory or self.minimize or self.cache_test_results:
+            return False
+        return can_run_isolated(self.python_executable) and not requires_ui_thread(package_dir)
+
+    def prompt_test(self):
+        """
+        Displays a quick panel of the test classes and tests in the package,
+        along with an option to enter a regular expression instead
+        """
+
+        package_dir = os.path.join(sublime.packages_path(), self.package_name)
+
+        test_names = TestIndex(self.package_name, package_dir).names()
+        if test_names is None:
+            try:
+                test_names = discover_test_names(load_tests_module(self.package_name, package_dir))
+            except (Exception):
+                # The error will be displayed when the tests are run
+                test_names = []
+
+        self.choices = [(None, None)]
+        captions = [REGEX_CAPTION]
+        last_class_name = None
+        for test_name in test_names:
+            class_name, name = test_name.rsplit('.', 1)
+            if class_name != last_class_name:
+                self.choices.append((class_name, None))
+                captions.append(class_name)
+                last_class_name = class_name
+            self.choices.append((class_name, name))
+            captions.append(test_name)
+
+        self.window.show_quick_panel(captions, self.selected_test)
+
+    def selected_test(self, index):
+        """
+        User input handler for selecting a test class or test to run
+
+        :param index:
+            An integer - will be -1 if user cancelled selection, otherwise will
+            be the index of the choice in self.choices
+        """
+
+        if index == -1:
+            return
+
+        class_name, name = self.choices[index]
+        if class_name is None:
+            # Allows the input panel to be shown after the quick panel closes
+            sublime.set_timeout(self.prompt_name_pattern, 10)
+            return
+
+        self.class_names = [class_name]
+        if name is not None:
+            self.name_pattern = re.compile('^%s$' % re.escape(name))
+        self.run_tests()
 
     def prompt_name_pattern(self, initial=''):
         def handle_pattern(pattern):
@@ -106,208 +265,786 @@ class PackageCoverageExecCommand(sublime_plugin.WindowCommand):
         package_name = self.package_name
         package_dir = os.path.join(sublime.packages_path(), package_name)
 
-        db_results_file = None
+        if self.smoke_suite and self.test_names is None:
+            self.test_names = SmokeSuite(package_name).names()
+            if self.test_names is None:
+                sublime.error_message(format_message('''
+                    Package Coverage
+
+                    No smoke suite has been saved for %s. Run the Minimize
+                    Suite command to create one.
+                ''', package_name))
+                return
+
+        if self.repeat:
+            return self.run_repeat()
+
+        # Coverage is not measured in parallel runs, since the data from the
+        # worker processes could not be combined into a single report
+        use_parallel = self.parallel and not self.do_coverage and not self.measure_memory
+        if use_parallel and can_run_isolated(self.python_executable):
+            return self.run_parallel()
+
+        if self.uses_warm_worker(package_dir):
+            return self.run_warm()
+
+        capture = OutputCapture()
+        cov = None
         if self.do_coverage:
-            include_dir = os.path.join(package_dir, '*.py')
-            omit_dir = os.path.join(package_dir, 'dev', '*.py')
-            if sys.platform == 'win32':
-                short_include_dir = create_short_path(os.path.dirname(include_dir))
-                if short_include_dir:
-                    include_dir = [include_dir, os.path.join(short_include_dir, '*.py')]
-                short_omit_dir = create_short_path(os.path.dirname(omit_dir))
-                if short_omit_dir:
-                    omit_dir = [omit_dir, os.path.join(short_omit_dir, '*.py')]
-            # Depending on the folder launched from with ST2 on Linux, the current
-            # folder seems to have a big impact on how coverage selects code to
-            # measure, and can even lead to measuring stdlib code, but then producing
-            # errors when it can not find the source to said stdlib files. To work
-            # around this, we explicitly enumerate every .py file in the package and
-            # pass then all via include_dir.
-            elif sys.platform not in set(['win32', 'darwin']) and sys.version_info < (3,):
-                include_dir = []
-                for root, dir_names, file_names in os.walk(package_dir):
-                    for file_name in file_names:
-                        if not file_name.endswith('.py'):
-                            continue
-                        include_dir.append(os.path.join(root, file_name))
-            cov = coverage.Coverage(include=include_dir, omit=omit_dir)
-            cov.start()
-            db_results_file = StringIO()
+            timer = PhaseTimer('measure_coverage', package_name)
+            timer.phase('start coverage')
+            cov = start_coverage(package_dir)
             title = 'Measuring %s Coverage' % package_name
+        elif self.measure_memory:
+            timer = PhaseTimer('measure_memory', package_name)
+            title = 'Measuring %s Memory' % package_name
+        elif self.minimize:
+            timer = PhaseTimer('minimize_suite', package_name)
+            title = 'Minimizing %s Test Suite' % package_name
+        elif self.smoke_suite:
+            timer = PhaseTimer('run_smoke_suite', package_name)
+            title = 'Running %s Smoke Suite' % package_name
         else:
+            timer = PhaseTimer('run_tests', package_name)
             title = 'Running %s Tests' % package_name
 
+        timer.phase('load tests')
         tests_module, panel = create_resources(self.window, package_name, package_dir)
-        panel_queue = StringQueue()
+        # Tests writing output faster than it can be displayed are paused,
+        # unless they run in the UI thread, which displays the output
+        panel_queue = StringQueue(None if self.ui_thread else self.max_queued_output)
+
+        # When caching is enabled, the lines executed by each test are always
+        # recorded, but cached tests are only skipped when not measuring
+        # coverage, since the coverage results would then be incomplete
+        test_cache = None
+        tracker = None
+        test_filter = None
+        self.history = TestHistory(package_name)
+        observers = []
+        profiler = None
+        if self.measure_memory:
+            profiler = MemoryProfiler(package_dir)
+            observers.append(profiler)
+        elif self.cache_test_results:
+            test_cache = TestResultCache(package_name, package_dir)
+            test_cache.load_support_hash()
+            self.test_cache = test_cache
+            tracker = TestCoverageTracker(package_dir, os.path.join(cache_dir(), '.coverage'))
+            observers.extend([tracker, test_cache])
+            if not self.full_run and not self.do_coverage:
+                test_filter = test_cache.is_changed
+
+        if self.minimize and tracker is None:
+            tracker = TestCoverageTracker(package_dir, os.path.join(cache_dir(), '.coverage'))
+            observers.append(tracker)
+
+        # The history and the watchdog are the last observers so only the
+        # test itself is timed, not the per-test coverage measurement
+        observers.append(self.history)
+        watchdog = None
+        if self.test_timeout or self.run_timeout:
+            def abandon_run(test):
+                if profiler:
+                    profiler.stop()
+                self.history.stop_test(test, 'timeout')
+                if self.save_history:
+                    self.history.save()
+                panel_queue.write('\x04')
+
+            watchdog = Watchdog(panel_queue, self.test_timeout, self.run_timeout, abandon_run)
+            observers.append(watchdog)
+
+        history = self.history
 
         def show_output_panel():
             self.window.run_command('show_panel', {'panel': 'output.%s_tests' % package_name})
 
         show_output_panel()
 
-        # Variables shared between the two threads. There is no locking here
-        # since the two threads strictly run one after the other. Would use
-        # nonlocal here if we didn't have to support Python 2.6.
-        thread_vars = {
-            'all_short': None,
-            'short_package_dir': None,
-            'cov_data': None
-        }
+        # Background report generation is held off while tests run so it does
+        # not compete with them for the interpreter
+        report_scheduler.suspend()
+
+        # The work after the tests is split into stages that each start once
+        # the stages they need are done. The git info is fetched while the
+        # tests run, and the report is formatted while output is displayed.
+        pipeline = Pipeline(timer)
+        persist = bool(self.coverage_database) and (self.do_coverage or self.measure_memory)
+        if persist:
+            pipeline.add('git', lambda: git_info(package_dir))
+        pipeline.add('tests')
+        pipeline.add('display output', depends=['tests'])
+
+        def coverage_report(result):
+            # The end-of-output marker is always written so the display
+            # thread exits, even if the coverage report fails
+            try:
+                panel_queue.write('\n')
+                cov_data = cov.get_data()
+                if tracker:
+                    cov_data.update(tracker.combined)
+                output, path_prefix = format_coverage_report(cov, package_name, package_dir)
+                panel_queue.write(output + '\n')
+
+                if self.html_report:
+                    coverage_reports_dir = os.path.join(package_dir, 'dev', 'coverage_reports')
+                    if not os.path.exists(coverage_reports_dir):
+                        os.mkdir(coverage_reports_dir)
+
+                    report_dir = os.path.join(coverage_reports_dir, 'temp')
+                    if not os.path.exists(report_dir):
+                        os.mkdir(report_dir)
+
+                    title = '%s coverage report' % package_name
+                    cov.html_report(directory=report_dir, title=title)
+
+                    open_report(os.path.join(report_dir, 'index.html'))
+
+            finally:
+                panel_queue.write('\x04')
+
+            return (cov_data, path_prefix)
+
+        def record_results(report, _):
+            cov_data, path_prefix = report
+            self.coverage_record = coverage_record(package_name, cov_data, path_prefix, capture.getvalue())
+            coverage_overlay.record_run(package_name, package_dir, cov_data)
+            return self.coverage_record
+
+        def save_results(record, commit_info):
+            if commit_info is None:
+                return
+            record.update(commit_info)
+            save_coverage_results(self.coverage_database, [record])
+
+            print('Package Coverage: saved results to coverage database')
+            report_scheduler.watch(self.coverage_database)
+
+        def memory_report(result):
+            try:
+                self.memory_results = profiler.results
+                previous = None
+                if self.coverage_database and os.path.exists(self.coverage_database):
+                    previous = previous_memory_results(self.coverage_database, package_name)
+                panel_queue.write('\n' + format_memory_report(profiler.results, previous) + '\n')
+            finally:
+                panel_queue.write('\x04')
+
+        def save_memory(_, __, commit_info):
+            if commit_info is None:
+                return
+            save_memory_results(self.coverage_database, memory_records(package_name, profiler.results, commit_info))
+            print('Package Coverage: saved memory results to coverage database')
+
+        def minimize_report(result):
+            try:
+                panel_queue.write('\n' + save_smoke_suite(package_name, tracker, history, result) + '\n')
+            finally:
+                panel_queue.write('\x04')
+
+        if self.do_coverage:
+            pipeline.add('coverage report', coverage_report, ['tests'])
+            pipeline.add('coverage record', record_results, ['coverage report', 'display output'])
+            if persist:
+                pipeline.add('database', save_results, ['coverage record', 'git'])
+        elif self.measure_memory:
+            pipeline.add('memory report', memory_report, ['tests'])
+            if persist:
+                pipeline.add('database', save_memory, ['memory report', 'display output', 'git'])
+        elif self.minimize:
+            pipeline.add('minimize', minimize_report, ['tests'])
 
         def done_displaying_results():
             sublime.set_timeout(show_output_panel, 10)
+            report_scheduler.resume()
 
-            if self.do_coverage and self.coverage_database:
-                try:
-                    is_clean = is_git_clean(package_dir)
-                except (OSError) as e:
-                    print(format_message('''
-                        Package Coverage: not saving results to coverage database
-                        since an error occurred fetching the git status: %s
-                    ''', e.args[0]))
-                    return
+            if watchdog and watchdog.hung:
+                pipeline.cancel()
+                if self.on_hang:
+                    self.on_hang()
+                return
+
+            pipeline.finish('display output')
 
-                if not is_clean:
-                    print(format_message('''
-                        Package Coverage: not saving results to coverage database
-                        since git repository has modified files
-                    '''))
+        def done_running_tests(result):
+            if watchdog:
+                watchdog.stop()
+                # The output was already ended when the run was abandoned
+                if watchdog.hung:
                     return
 
-                commit_hash, commit_date, summary = git_commit_info(package_dir)
+            self.result = result
+            if test_cache:
+                test_cache.record(tracker)
+            # Worker processes return the history and cache entries to the
+            # parent, which merges and saves the results of all workers
+            if self.save_history:
+                history.save()
+                if test_cache:
+                    test_cache.save()
+            if profiler:
+                profiler.stop()
+            if cov is not None:
+                cov.stop()
+            if not self.do_coverage and not self.measure_memory and not self.minimize:
+                panel_queue.write('\x04')
 
-                data_file = StringIO()
-                thread_vars['cov_data'].write_fileobj(data_file)
-                data_bytes = data_file.getvalue()
+            pipeline.finish('tests', result)
 
-                platform = {
-                    'win32': 'windows',
-                    'darwin': 'osx'
-                }.get(sys.platform, 'linux')
+        def done_with_stages():
+            if pipeline.cancelled:
+                return
+            timer.stop()
+            write_to_panel(panel, timer.summary() + '\n')
+            timer.log()
 
-                python_version = '%s.%s' % sys.version_info[0:2]
-                if thread_vars['all_short']:
-                    path_prefix = thread_vars['short_package_dir'] + os.sep
-                else:
-                    path_prefix = package_dir + os.sep
-                output = db_results_file.getvalue()
-
-                connection = open_database(self.coverage_database)
-                cursor = connection.cursor()
-                cursor.execute("""
-                    INSERT INTO coverage_results (
-                        project,
-                        commit_hash,
-                        commit_summary,
-                        commit_date,
-                        data,
-                        platform,
-                        python_version,
-                        path_prefix,
-                        output
-                    ) VALUES (
-                        ?,
-                        ?,
-                        ?,
-                        ?,
-                        ?,
-                        ?,
-                        ?,
-                        ?,
-                        ?
-                    )
-                """, (
-                    package_name,
-                    commit_hash,
-                    summary,
-                    commit_date,
-                    data_bytes,
-                    platform,
-                    python_version,
-                    path_prefix,
-                    output
-                ))
-                connection.commit()
-                cursor.close()
+        threading.Thread(
+            target=display_results,
+            args=(title, panel, panel_queue, capture, done_displaying_results)
+        ).start()
 
-                print('Package Coverage: saved results to coverage database')
+        # Tests that failed last time are run first for fast feedback, unless
+        # a seed was given to run the tests in a random order
+        arrange = history.arrange
+        if self.seed is not None:
+            arrange = shuffled_order(self.seed)
+        args = (
+            tests_module,
+            panel_queue,
+            self.name_pattern,
+            done_running_tests,
+            test_filter,
+            observers,
+            arrange,
+            self.class_names,
+            self.test_names
+        )
+        timer.phase(None)
+        pipeline.start(done_with_stages)
+        if profiler:
+            profiler.start()
+        if self.ui_thread:
+            run_tests(*args)
 
-        def done_running_tests():
-            if self.do_coverage:
-                panel_queue.write('\n')
-                cov.stop()
-                thread_vars['cov_data'] = cov.get_data()
-                buffer = StringIO()
-                cov.report(show_missing=False, file=buffer)
-
-                old_length = len(package_dir)
-                new_length = len(package_name) + 2
-
-                output = buffer.getvalue()
-
-                thread_vars['all_short'] = False
-                thread_vars['short_package_dir'] = None
-                if sys.platform == 'win32':
-                    thread_vars['short_package_dir'] = create_short_path(package_dir)
-                    thread_vars['all_short'] = True
-                new_root = '.' + os.sep + package_name
-                new_output = []
-                for line in output.splitlines():
-                    if re.search('\\s+\\d+\\s+\\d+\\s+\\d+%$', line):
-                        if not thread_vars['short_package_dir']:
-                            line = line.replace(package_dir, new_root)
-                        else:
-                            for possible_prefix in [package_dir, thread_vars['short_package_dir']]:
-                                if line.startswith(possible_prefix):
-                                    line = line.replace(possible_prefix, new_root)
-                                    if possible_prefix == package_dir:
-                                        thread_vars['all_short'] = False
-                                    break
-                    new_output.append(line)
-                output = '\n'.join(new_output)
-
-                if thread_vars['all_short']:
-                    old_length = len(thread_vars['short_package_dir'])
-
-                # Shorten the file paths to be relative to the Packages dir
-                output = output.replace('\n' + ('-' * old_length), '\n' + ('-' * new_length))
-                output = output.replace('Name' + (' ' * (old_length - 4)), 'Name' + (' ' * (new_length - 4)))
-                output = output.replace('TOTAL' + (' ' * (old_length - 5)), 'TOTAL' + (' ' * (new_length - 5)))
-
-                panel_queue.write(output)
+        else:
+            threading.Thread(target=run_tests, args=args).start()
 
-                if self.html_report:
-                    coverage_reports_dir = os.path.join(package_dir, 'dev', 'coverage_reports')
-                    if not os.path.exists(coverage_reports_dir):
-                        os.mkdir(coverage_reports_dir)
+    def run_warm(self):
+        """
+        Runs the tests for the package in the package's warm worker process
+        """
 
-                    report_dir = os.path.join(coverage_reports_dir, 'temp')
-                    if not os.path.exists(report_dir):
-                        os.mkdir(report_dir)
+        package_name = self.package_name
+        panel = create_output_panel(self.window, '%s_tests' % package_name)
 
-                    title = '%s coverage report' % package_name
-                    cov.html_report(directory=report_dir, title=title)
+        if self.do_coverage:
+            title = 'Measuring %s Coverage' % package_name
+        else:
+            title = 'Running %s Tests' % package_name
+
+        panel_queue = self.display_worker_output(title, panel)
+        threading.Thread(target=self.run_in_worker, args=(panel_queue,)).start()
+
+    def display_worker_output(self, title, panel):
+        """
+        Shows the tests output panel and starts a thread displaying the output
+        of worker processes in it. Background report generation is held off
+        until the output is done being displayed.
+
+        :param title:
+            A unicode string of the title to display above the output
+
+        :param panel:
+            The sublime.View object of the output panel
+
+        :return:
+            A StringQueue object to write the output to, followed by the
+            end-of-output marker
+        """
+
+        package_name = self.package_name
+        panel_queue = StringQueue()
+
+        def show_output_panel():
+            self.window.run_command('show_panel', {'panel': 'output.%s_tests' % package_name})
 
-                    html_path = os.path.join(report_dir, 'index.html')
-                    if sys.platform != 'win32':
-                        html_path = 'file://' + html_path
-                    webbrowser.open_new(html_path)
+        show_output_panel()
+        report_scheduler.suspend()
 
-            panel_queue.write('\x04')
+        def done_displaying_results():
+            sublime.set_timeout(show_output_panel, 10)
+            report_scheduler.resume()
 
         threading.Thread(
             target=display_results,
-            args=(title, panel, panel_queue, db_results_file, done_displaying_results)
+            args=(title, panel, panel_queue, None, done_displaying_results)
         ).start()
 
-        if self.ui_thread:
-            run_tests(tests_module, panel_queue, self.name_pattern, done_running_tests)
+        return panel_queue
+
+    def run_in_worker(self, panel_queue):
+        """
+        Sends the run to the warm worker and saves the coverage results
+
+        RUNS IN A THREAD
 
+        :param panel_queue:
+            The StringQueue object for the output panel
+        """
+
+        import coverage
+
+        package_name = self.package_name
+        package_dir = os.path.join(sublime.packages_path(), package_name)
+
+        request = {
+            'do_coverage': self.do_coverage,
+            'name_pattern': self.name_pattern.pattern if self.name_pattern else None,
+            'class_names': self.class_names,
+            'test_names': self.test_names,
+            'test_timeout': self.test_timeout,
+            'run_timeout': self.run_timeout
+        }
+        try:
+            worker = get_warm_worker(self.python_executable, package_name)
+            results = worker.run(request, panel_queue.write, worker_timeout(self.run_timeout))
+        except (OSError) as e:
+            panel_queue.write('Error starting worker process: %s\n' % e)
+            results = None
+
+        if results is None:
+            panel_queue.write('\nThe worker process exited unexpectedly\x04')
+            return
+
+        record = results['record']
+        if record:
+            cov_data = coverage.CoverageData()
+            cov_data.read_fileobj(StringIO(record['data']))
+            coverage_overlay.record_run(package_name, package_dir, cov_data)
+
+            if self.coverage_database and add_git_info(package_dir, record):
+                save_coverage_results(self.coverage_database, [record])
+                print('Package Coverage: saved results to coverage database')
+                report_scheduler.watch(self.coverage_database)
+
+        panel_queue.write('\x04')
+
+    def run_parallel(self):
+        """
+        Runs the tests for the package in a pool of worker processes. Test
+        classes are assigned to workers by their historical duration, so all
+        of the workers finish at about the same time.
+        """
+
+        package_name = self.package_name
+        package_dir = os.path.join(sublime.packages_path(), package_name)
+
+        tests_module, panel = create_resources(self.window, package_name, package_dir)
+
+        self.history = TestHistory(package_name)
+        if self.cache_test_results:
+            self.test_cache = TestResultCache(package_name, package_dir)
+        class_durations = {}
+        class_tests = {}
+        for test in discover_tests(tests_module, self.name_pattern, self.class_names, self.test_names):
+            class_name = test.__class__.__name__
+            class_durations[class_name] = class_durations.get(class_name, 0) + self.history.duration(test.id())
+            class_tests.setdefault(class_name, []).append('.'.join(test.id().split('.')[-2:]))
+        bins = lpt_bins(class_durations, self.max_workers)
+
+        title = 'Running %s Tests in %d Processes' % (package_name, len(bins))
+        panel_queue = self.display_worker_output(title, panel)
+        threading.Thread(target=self.run_bins, args=(bins, class_tests, panel_queue)).start()
+
+    def run_bins(self, bins, class_tests, panel_queue):
+        """
+        Runs each group of test classes in a worker process, writing the
+        output of each to the panel once it completes
+
+        RUNS IN A THREAD
+
+        :param bins:
+            A list of lists of unicode strings of test class names
+
+        :param class_tests:
+            A dict with unicode string test class name keys and values that
+            are lists of unicode strings in the form "ClassName.test_name" of
+            the tests to run in the class
+
+        :param panel_queue:
+            The StringQueue object for the output panel
+        """
+
+        lock = threading.Lock()
+        results = []
+
+        def worker(class_names, test_names=None):
+            args = ['--classes', ','.join(class_names)]
+            if test_names is None and self.test_names is not None:
+                test_names = [name for class_name in class_names for name in class_tests[class_name]]
+            if test_names is not None:
+                args.extend(['--tests', ','.join(test_names)])
+            if self.name_pattern:
+                args.extend(['--name', self.name_pattern.pattern])
+            if self.full_run:
+                args.append('--full-run')
+            start = time.time()
+            success, output, worker_results = run_package_isolated(
+                self.python_executable,
+                self.package_name,
+                False,
+                args,
+                worker_timeout(self.run_timeout)
+            )
+            self.history.update(worker_results.get('history', {}))
+            if self.test_cache:
+                self.test_cache.update(worker_results.get('test_cache', {}))
+            title = ', '.join(class_names)
+            lock.acquire()
+            results.append(success)
+            panel_queue.write(format_result_block(title, success, time.time() - start, output))
+            lock.release()
+
+            # When a worker abandons a hung test, the tests it had not started
+            # are run by a replacement worker. The hung test always has a
+            # result, so each replacement runs fewer tests.
+            if worker_results.get('hung'):
+                if test_names is None:
+                    test_names = [name for class_name in class_names for name in class_tests[class_name]]
+                started = set(['.'.join(test_id.split('.')[-2:]) for test_id in worker_results.get('history', {})])
+                remaining = [name for name in test_names if name not in started]
+                if remaining and len(remaining) < len(test_names):
+                    remaining_classes = []
+                    for test_name in remaining:
+                        class_name = test_name.rsplit('.', 1)[0]
+                        if class_name not in remaining_classes:
+                            remaining_classes.append(class_name)
+                    worker(remaining_classes, remaining)
+                elif remaining:
+                    panel_queue.write('Tests not run since the worker hung before starting them: %s\n\n' % (
+                        ', '.join(remaining)
+                    ))
+
+        threads = []
+        for class_names in bins:
+            thread = threading.Thread(target=worker, args=(class_names,))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        self.history.save()
+        if self.test_cache:
+            self.test_cache.save()
+
+        failed = len([success for success in results if not success])
+        panel_queue.write('%d of %d processes had failures\x04' % (failed, len(results)))
+
+    def run_repeat(self):
+        """
+        Runs the tests for the package repeatedly in a pool of worker
+        processes, in a random order each time, to find flaky tests
+        """
+
+        package_name = self.package_name
+        package_dir = os.path.join(sublime.packages_path(), package_name)
+
+        if not can_run_isolated(self.python_executable) or requires_ui_thread(package_dir):
+            sublime.error_message(format_message('''
+                Package Coverage
+
+                Repeating tests requires the python_executable setting, and
+                tests that do not use the sublime API
+            '''))
+            return
+
+        settings = sublime.load_settings('Package Coverage.sublime-settings')
+        table = FlakinessTable(
+            get_setting(self.window, settings, 'repeat_confidence', 0.9),
+            get_setting(self.window, settings, 'repeat_failure_rate', 0.1)
+        )
+        max_runs = get_setting(self.window, settings, 'repeat_count', 50)
+
+        panel = create_output_panel(self.window, '%s_tests' % package_name)
+        title = 'Repeating %s Tests up to %d Times' % (package_name, max_runs)
+        panel_queue = self.display_worker_output(title, panel)
+        threading.Thread(target=self.repeat_runs, args=(table, max_runs, panel_queue)).start()
+
+    def repeat_runs(self, table, max_runs, panel_queue):
+        """
+        Starts worker processes until max_runs have been started, or every
+        test has been found to be flaky or to have a consistent outcome.
+        Every run includes all of the selected tests, even those already
+        decided, since leaving tests out could change the outcome of others.
+
+        RUNS IN A THREAD
+
+        :param table:
+            The FlakinessTable object to record the outcomes in
+
+        :param max_runs:
+            An integer of the most runs to start
+
+        :param panel_queue:
+            The StringQueue object for the output panel
+        """
+
+        import random
+
+        lock = threading.Lock()
+        state = {'started': 0, 'stopped': False}
+        seeds = random.Random()
+
+        def next_args():
+            if state['stopped'] or state['started'] >= max_runs or table.is_complete():
+                return None
+            state['started'] += 1
+            seed = seeds.randrange(1, 1000000)
+            args = ['--full-run', '--seed', str(seed)]
+            if self.class_names:
+                args.extend(['--classes', ','.join(self.class_names)])
+            if self.test_names is not None:
+                args.extend(['--tests', ','.join(self.test_names)])
+            if self.name_pattern:
+                args.extend(['--name', self.name_pattern.pattern])
+            return (state['started'], seed, args)
+
+        def worker():
+            while True:
+                lock.acquire()
+                run = next_args()
+                lock.release()
+                if run is None:
+                    return
+
+                run_number, seed, args = run
+                start = time.time()
+                success, output, worker_results = run_package_isolated(
+                    self.python_executable,
+                    self.package_name,
+                    False,
+                    args,
+                    worker_timeout(self.run_timeout)
+                )
+
+                lock.acquire()
+                if not worker_results:
+                    # The worker could not run the tests at all, so further
+                    # runs would fail the same way
+                    state['stopped'] = True
+                    title = 'Run %d, seed %d' % (run_number, seed)
+                    panel_queue.write(format_result_block(title, False, time.time() - start, output))
+                else:
+                    passed, failed = table.add_run(seed, worker_results.get('history', {}))
+                    panel_queue.write('Run %d, seed %d: %d passed, %d failed (%.2fs)\n' % (
+                        run_number,
+                        seed,
+                        passed,
+                        failed,
+                        time.time() - start
+                    ))
+                lock.release()
+
+        threads = []
+        for _ in range(min(self.max_workers, max_runs)):
+            thread = threading.Thread(target=worker)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        panel_queue.write('\n%s\x04' % table.format())
+
+
+class PackageCoverageRunAllCommand(sublime_plugin.WindowCommand):
+
+    """
+    Runs the tests for every testable package and displays the results,
+    grouped by package, in an output panel. If the "python_executable"
+    setting is set, packages whose tests do not use the sublime API are run
+    first, in a pool of isolated worker processes. The remaining packages are
+    then run one at a time in the UI thread.
+    """
+
+    def run(self, do_coverage=False):
+        testable_packages = find_testable_packages()
+
+        if not testable_packages:
+            sublime.error_message(format_message('''
+                Package Coverage
+
+                No testable packages could be found
+            '''))
+            return
+
+        settings = sublime.load_settings('Package Coverage.sublime-settings')
+        self.coverage_database = get_setting(self.window, settings, 'coverage_database')
+        self.python_executable = get_setting(self.window, settings, 'python_executable')
+        self.max_workers = get_setting(self.window, settings, 'max_workers') or default_max_workers()
+        self.test_timeout = get_setting(self.window, settings, 'test_timeout')
+        self.run_timeout = get_setting(self.window, settings, 'run_timeout')
+        self.do_coverage = do_coverage
+        self.records = []
+        self.summary = []
+        self.lock = threading.Lock()
+
+        packages_path = sublime.packages_path()
+        self.isolated = []
+        self.in_process = []
+        for package_name in testable_packages:
+            package_dir = os.path.join(packages_path, package_name)
+            if can_run_isolated(self.python_executable) and not requires_ui_thread(package_dir):
+                self.isolated.append(package_name)
+            else:
+                self.in_process.append(package_name)
+
+        panel = create_output_panel(self.window, 'all_packages_tests')
+        self.window.run_command('show_panel', {'panel': 'output.all_packages_tests'})
+        self.panel_queue = StringQueue()
+
+        if self.do_coverage:
+            title = 'Measuring Coverage of %d Packages' % len(testable_packages)
         else:
-            threading.Thread(
-                target=run_tests,
-                args=(tests_module, panel_queue, self.name_pattern, done_running_tests)
-            ).start()
+            title = 'Running Tests of %d Packages' % len(testable_packages)
+
+        report_scheduler.suspend()
+
+        threading.Thread(
+            target=display_results,
+            args=(title, panel, self.panel_queue, None, lambda: None)
+        ).start()
+
+        threading.Thread(target=self.run_isolated).start()
+
+    def add_result(self, package_name, success, elapsed, output, record):
+        """
+        Writes the output of a package's tests to the panel as a single block
+        and records the result
+
+        :param package_name:
+            A unicode string of the package name
+
+        :param success:
+            A boolean - if all of the tests passed
+
+        :param elapsed:
+            A float of the number of seconds the tests took
+
+        :param output:
+            A unicode string of the output of the tests
+
+        :param record:
+            None or a dict from coverage_record()
+        """
+
+        status = 'OK' if success else 'FAILED'
+        self.lock.acquire()
+        self.panel_queue.write(format_result_block(package_name, success, elapsed, output))
+        self.summary.append((package_name, status, elapsed))
+        if record is not None:
+            self.records.append((package_name, record))
+        self.lock.release()
+
+    def run_isolated(self):
+        """
+        Runs the isolated packages using a pool of worker processes, and then
+        schedules the rest to run in the UI thread
+
+        RUNS IN A THREAD
+        """
+
+        # Packages are started longest first, based on the duration of their
+        # tests last time, so a slow package does not start last and leave
+        # the other workers idle
+        durations = {}
+        for package_name in self.isolated:
+            durations[package_name] = TestHistory(package_name).total_duration()
+        pending = sorted(self.isolated, key=lambda package_name: durations[package_name], reverse=True)
+
+        def worker():
+            while True:
+                self.lock.acquire()
+                package_name = pending.pop(0) if pending else None
+                self.lock.release()
+                if package_name is None:
+                    return
+                start = time.time()
+                success, output, results = run_package_isolated(
+                    self.python_executable,
+                    package_name,
+                    self.do_coverage,
+                    timeout=worker_timeout(self.run_timeout)
+                )
+                history = TestHistory(package_name)
+                history.update(results.get('history', {}))
+                history.save()
+                if results.get('test_cache'):
+                    package_dir = os.path.join(sublime.packages_path(), package_name)
+                    test_cache = TestResultCache(package_name, package_dir)
+                    test_cache.update(results['test_cache'])
+                    test_cache.save()
+                self.add_result(package_name, success, time.time() - start, output, results.get('record'))
+
+        threads = []
+        for _ in range(min(self.max_workers, len(pending))):
+            thread = threading.Thread(target=worker)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        sublime.set_timeout(self.run_next_in_process, 10)
+
+    def run_next_in_process(self):
+        """
+        Runs the tests for the next package that can not be run isolated,
+        in the UI thread
+        """
+
+        if not self.in_process:
+            threading.Thread(target=self.finish).start()
+            return
+
+        package_name = self.in_process.pop(0)
+        start = time.time()
+        success, output, record = run_package_in_process(
+            package_name,
+            self.do_coverage,
+            self.test_timeout,
+            self.run_timeout
+        )
+        self.add_result(package_name, success, time.time() - start, output, record)
+
+        # Yield to the UI between packages
+        sublime.set_timeout(self.run_next_in_process, 10)
+
+    def finish(self):
+        """
+        Saves all of the coverage results in a single transaction and writes
+        the summary to the panel
+
+        RUNS IN A THREAD
+        """
+
+        report_scheduler.resume()
+
+        if self.do_coverage and self.coverage_database:
+            packages_path = sublime.packages_path()
+            records = []
+            for package_name, record in self.records:
+                if add_git_info(os.path.join(packages_path, package_name), record):
+                    records.append(record)
+            if records:
+                save_coverage_results(self.coverage_database, records)
+                print('Package Coverage: saved results for %d packages to coverage database' % len(records))
+                report_scheduler.watch(self.coverage_database)
+
+        name_width = max([len(row[0]) for row in self.summary] + [7])
+        lines = ['%s  Result  Time' % 'Package'.ljust(name_width)]
+        for package_name, status, elapsed in sorted(self.summary):
+            lines.append('%s  %-6s  %.1fs' % (package_name.ljust(name_width), status, elapsed))
+        self.panel_queue.write('\n'.join(lines) + '\n\x04')
 
 
 class PackageCoverageSetDatabasePathCommand(sublime_plugin.WindowCommand):
@@ -366,8 +1103,15 @@ class PackageCoverageSetDatabasePathCommand(sublime_plugin.WindowCommand):
             A string containing the path the user entered for the coverage db
         """
 
-        requested_dirname = os.path.dirname(requested_path)
-        requested_basename = os.path.basename(requested_path)
+        # A path ending in a slash is a folder of per-machine shards, which
+        # is created when results are first saved
+        if requested_path.endswith(('/', os.sep)):
+            requested_path = os.path.join(requested_path.rstrip('/' + os.sep), '')
+            requested_dirname = os.path.dirname(os.path.dirname(requested_path))
+            requested_basename = os.path.basename(os.path.dirname(requested_path))
+        else:
+            requested_dirname = os.path.dirname(requested_path)
+            requested_basename = os.path.basename(requested_path)
 
         if requested_basename == '':
             sublime.error_message(format_message('''
@@ -450,6 +1194,7 @@ class PackageCoverageDisplayReportCommand(sublime_plugin.WindowCommand):
 
         self.package_name = package_name
         self.coverage_database = coverage_database
+        report_scheduler.watch(coverage_database)
 
         thread = threading.Thread(target=self.find_commits, args=(package_name, coverage_database))
         thread.start()
@@ -468,7 +1213,7 @@ class PackageCoverageDisplayReportCommand(sublime_plugin.WindowCommand):
             The filename of the coverage database
         """
 
-        connection = open_database(coverage_database)
+        connection = open_database(readable_database(coverage_database))
 
         cursor = connection.cursor()
         cursor.execute("""
@@ -572,108 +1317,179 @@ class PackageCoverageDisplayReportCommand(sublime_plugin.WindowCommand):
             the results for
         """
 
-        connection = open_database(coverage_database)
+        timer = PhaseTimer('display_report', package_name)
+        timer.phase('open database')
+        connection = open_database(readable_database(coverage_database))
+        try:
+            html_path = build_report(connection, package_name, package_dir, commit_hash, timer=timer)
+        finally:
+            connection.close()
 
-        cursor = connection.cursor()
-        cursor.execute("""
-            SELECT
-                path_prefix,
-                data,
-                commit_summary
-            FROM
-                coverage_results
-            WHERE
-                project = ?
-                AND commit_hash = ?
-            ORDER BY
-                commit_date ASC
-        """, (package_name, commit_hash))
+        timer.phase('open browser')
+        open_report(html_path)
 
-        commit_summary = None
-        data = coverage.CoverageData()
-        for row in cursor:
-            if commit_summary is None:
-                commit_summary = row['commit_summary']
-            byte_string = StringIO()
-            byte_string.write(row['data'])
-            byte_string.seek(0)
-            temp_data = coverage.CoverageData()
-            temp_data.read_fileobj(byte_string)
-            aliases = coverage.files.PathAliases()
-            aliases.add(row['path_prefix'], package_dir + os.sep)
-            data.update(temp_data, aliases)
+        timer.stop()
+        print('Package Coverage: %s' % timer.summary())
+        timer.log()
 
-        cursor.close()
-        connection.close()
 
-        coverage_reports_dir = os.path.join(package_dir, 'dev', 'coverage_reports')
-        if not os.path.exists(coverage_reports_dir):
-            os.mkdir(coverage_reports_dir)
+class PackageCoverageDisplayMatrixCommand(PackageCoverageDisplayReportCommand):
 
-        report_dir = os.path.join(coverage_reports_dir, commit_hash)
-        if not os.path.exists(report_dir):
-            os.mkdir(report_dir)
+    """
+    Allows the user to pick a commit and show which platforms and Python
+    versions covered each line, highlighting lines that were only covered on
+    some of them
+    """
 
-        data_file_path = os.path.join(report_dir, '.coverage')
-        data.write_file(data_file_path)
+    def generate_report(self, package_name, package_dir, coverage_database, commit_hash):
+        """
+        Computes the platform matrix for the commit specified and generates an
+        HTML page of it, opening it in the user's web browser
 
-        cov = coverage.Coverage(data_file=data_file_path)
-        cov.load()
-        title = '%s (%s %s) coverage report' % (package_name, commit_hash, commit_summary)
-        cov.html_report(directory=report_dir, title=title)
+        RUNS IN A THREAD
 
-        html_path = os.path.join(report_dir, 'index.html')
-        if sys.platform != 'win32':
-            html_path = 'file://' + html_path
-        webbrowser.open_new(html_path)
+        :param package_name:
+            A unicode string of the package to generate the report for
 
+        :param package_dir:
+            A unicode string of the path to the package's directory
 
-class PackageCoverageCleanupReportsCommand(sublime_plugin.WindowCommand):
+        :param coverage_database:
+            A unicode string of the path to the SQLite coverage database
+
+        :param commit_hash:
+            A unicode string of the git SHA1 hash of the commit to display
+            the results for
+        """
+
+        connection = open_database(readable_database(coverage_database))
+        try:
+            combinations, matrix = build_platform_matrix(connection, package_name, package_dir, commit_hash)
+        finally:
+            connection.close()
+
+        report_dir = os.path.join(package_dir, 'dev', 'coverage_reports', commit_hash)
+        if not os.path.exists(report_dir):
+            os.makedirs(report_dir)
+
+        title = '%s (%s) platform coverage matrix' % (package_name, commit_hash)
+        open_report(write_matrix_report(report_dir, title, package_dir, combinations, matrix))
+
+
+class PackageCoverageDiffCoverageCommand(PackageCoverageDisplayReportCommand):
 
     """
-    Deletes all HTML coverage reports currently on disk
+    Allows the user to pick two commits and shows the coverage of the lines
+    that were added or changed between them
     """
 
-    def run(self):
-        testable_packages = find_testable_packages()
+    def show_commits(self, commit_hashes, commit_titles):
+        """
+        Displays a list of commits with coverage results for the specified
+        package, to pick the newer commit from
 
-        if not testable_packages:
-            sublime.error_message(format_message('''
-                Package Coverage
+        :param commit_hashes:
+            A list of unicode strings of git SHA1 hashes
 
-                No cleanable packages could be found
-            '''))
-            return
+        :param commit_titles:
+            A list of unicode strings of commit titles for the user to pick from
+        """
 
-        self.packages_path = sublime.packages_path()
+        self.new_commit = None
+        PackageCoverageDisplayReportCommand.show_commits(self, commit_hashes, commit_titles)
 
-        cleanable_packages = []
-        for testable_package in testable_packages:
-            coverage_reports_dir = os.path.join(self.packages_path, testable_package, 'dev', 'coverage_reports')
-            if not os.path.exists(coverage_reports_dir):
-                continue
-            has_dir = False
-            for entry in os.listdir(coverage_reports_dir):
-                if entry in set(['.', '..']):
-                    continue
-                if not os.path.isdir(os.path.join(coverage_reports_dir, entry)):
-                    continue
-                has_dir = True
-                break
+    def selected_commit(self, index):
+        """
+        User input handler for quick panel selection of the newer commit,
+        and then the base commit
 
-            if has_dir:
-                cleanable_packages.append(testable_package)
+        :param index:
+            An integer of the commit chosen from self.hashes - -1 indicates that
+            the user cancelled the operation
+        """
 
-        if not cleanable_packages:
-            sublime.error_message(format_message('''
-                Package Coverage
+        if index == -1:
+            return
 
-                No cleanable packages could be found
-            '''))
+        if self.new_commit is None:
+            # Commits are ordered newest first, so only the ones after the
+            # selection can be the base
+            self.new_commit = self.hashes[index]
+            self.hashes = self.hashes[index + 1:]
+            self.titles = self.titles[index + 1:]
+            if not self.hashes:
+                sublime.error_message(format_message(
+                    '''
+                    Package Coverage
+
+                    No older commits with coverage results exist for %s
+                    ''',
+                    [self.package_name]
+                ))
+                return
+            sublime.status_message('Package Coverage: select the base commit to compare against')
+            sublime.set_timeout(lambda: self.window.show_quick_panel(self.titles, self.selected_commit), 10)
             return
 
-        self.packages = cleanable_packages
-        self.window.show_quick_panel(cleanable_packages, self.selected_package)
+        old_commit = self.hashes[index]
+        package_dir = os.path.join(sublime.packages_path(), self.package_name)
+        panel = create_output_panel(self.window, '%s_diff_coverage' % self.package_name)
+        self.window.run_command('show_panel', {'panel': 'output.%s_diff_coverage' % self.package_name})
+
+        args = (self.package_name, package_dir, self.coverage_database, old_commit, self.new_commit, panel)
+        thread = threading.Thread(target=self.generate_diff_report, args=args)
+        thread.start()
+
+    def generate_diff_report(self, package_name, package_dir, coverage_database, old_commit, new_commit, panel):
+        """
+        Runs git diff between two commits and writes the coverage of the
+        changed lines to an output panel
+
+        RUNS IN A THREAD
+
+        :param package_name:
+            A unicode string of the package to generate the report for
+
+        :param package_dir:
+            A unicode string of the path to the package's directory
+
+        :param coverage_database:
+            A unicode string of the path to the SQLite coverage database
+
+        :param old_commit:
+            A unicode string of the git SHA1 hash of the base commit
+
+        :param new_commit:
+            A unicode string of the git SHA1 hash of the newer commit
+
+        :param panel:
+            A sublime.View to write the results to
+        """
+
+        panel_queue = StringQueue()
+        title = 'Diff Coverage of %s %s..%s' % (package_name, old_commit, new_commit)
+        threading.Thread(
+            target=display_results,
+            args=(title, panel, panel_queue, None, lambda: None)
+        ).start()
+
+        connection = open_database(readable_database(coverage_database))
+        try:
+            output = diff_coverage_report(connection, package_name, package_dir, old_commit, new_commit)
+        except (OSError) as e:
+            output = 'Error running git: %s\n' % e.args[0]
+        finally:
+            connection.close()
+
+        panel_queue.write(output + '\x04')
+
+
+class PackageCoverageShowCoverageCommand(PackageCoverageDisplayReportCommand):
+
+    """
+    Allows the user to pick the last test run or a commit and marks the
+    covered and missed lines of the package's files in the gutter
+    """
 
     def selected_package(self, index):
         """
@@ -687,363 +1503,5388 @@ class PackageCoverageCleanupReportsCommand(sublime_plugin.WindowCommand):
         if index == -1:
             return
 
-        package_name = self.packages[index]
+        if self.coverage_database:
+            PackageCoverageDisplayReportCommand.selected_package(self, index)
+            return
 
-        coverage_reports_dir = os.path.join(self.packages_path, package_name, 'dev', 'coverage_reports')
-        thread = threading.Thread(target=self.clean_dirs, args=(package_name, coverage_reports_dir))
-        thread.start()
+        # Without a database, only the last test run may be shown
+        self.package_name = self.packages[index]
+        self.show_commits([], [])
 
-    def clean_dirs(self, package_name, coverage_reports_dir):
+    def show_commits(self, commit_hashes, commit_titles):
         """
-        Deletes old coverage report dirs from a package's dev/coverage_reports/
-        directory.
+        Displays a list of commits with coverage results for the specified
+        package, preceded by the last test run if coverage was measured
+
+        :param commit_hashes:
+            A list of unicode strings of git SHA1 hashes
+
+        :param commit_titles:
+            A list of unicode strings of commit titles for the user to pick from
+        """
+
+        if coverage_overlay.has_last_run(self.package_name):
+            commit_hashes = [None] + commit_hashes
+            commit_titles = ['Last test run'] + commit_titles
+        PackageCoverageDisplayReportCommand.show_commits(self, commit_hashes, commit_titles)
+
+    def generate_report(self, package_name, package_dir, coverage_database, commit_hash):
+        """
+        Indexes the covered and missed lines of each file and shows them in
+        the open views
 
         RUNS IN A THREAD
 
         :param package_name:
-            A unicode string of the package name
+            A unicode string of the package to show the coverage of
 
-        :param coverage_reports_dir:
-            A unicode string of the path to the directory to clean out
+        :param package_dir:
+            A unicode string of the path to the package's directory
+
+        :param coverage_database:
+            A unicode string of the path to the SQLite coverage database
 
+        :param commit_hash:
+            None for the last test run, otherwise a unicode string of the git
+            SHA1 hash of the commit to show the results for
         """
 
-        for entry in os.listdir(coverage_reports_dir):
-            if entry in set(['.', '..']):
-                continue
-            entry_path = os.path.join(coverage_reports_dir, entry)
-            if not os.path.isdir(entry_path):
-                continue
-            if not re.match('^[a-f0-9]{6,}$', entry):
-                continue
-            shutil.rmtree(entry_path)
+        if commit_hash is None:
+            coverage_overlay.show_last_run(package_name)
+            return
 
-        # Since this method is running in a thread, we schedule the result
-        # notice to be run from the main UI thread
-        def show_completed():
-            message = 'Package Coverage: coverage reports successfully cleaned for %s' % package_name
-            sublime.status_message(message)
+        connection = open_database(readable_database(coverage_database))
+        try:
+            data, _ = merge_commit_data(connection, package_name, package_dir, commit_hash)
+        finally:
+            connection.close()
 
-        sublime.set_timeout(show_completed, 10)
+        coverage_overlay.show(package_name, commit_hash, build_line_index(package_dir, data))
 
 
-def get_setting(window, settings, name, default=None):
+class PackageCoverageHideCoverageCommand(sublime_plugin.WindowCommand):
+
+    """
+    Removes the coverage marks added by the Show Coverage command
     """
-    Retrieves a setting from the current project, of the editor-wide Package Coverage
-    settings file.
 
-    :param window:
-        The current sublime.Window object
+    def run(self):
+        coverage_overlay.hide()
 
-    :param settings:
-        The sublime.Settings object for Package Coverage.sublime-settings
+    def is_enabled(self):
+        return coverage_overlay.package_name is not None
 
-    :param name:
-        A unicode string of the name of the setting to retrieve
 
-    :param default:
-        A the value to use if the setting is not currently set
+class PackageCoverageOverlayListener(sublime_plugin.EventListener):
 
-    :return:
-        The setting value, or the default value
+    """
+    Marks the coverage of views as they are opened. Marks move with the text
+    as a view is edited, so views only need to be re-marked when the file is
+    reloaded from disk.
     """
 
-    window_settings = window.active_view().settings().get('Package Coverage', {})
-    if name in window_settings:
-        return window_settings[name]
-    return settings.get(name, default)
+    def on_load(self, view):
+        coverage_overlay.reset(view)
+        coverage_overlay.apply(view)
 
+    def on_activated(self, view):
+        coverage_overlay.apply(view)
 
-class StringQueue():
+    def on_close(self, view):
+        coverage_overlay.reset(view)
+
+
+class PackageCoverageMaintainDatabaseCommand(sublime_plugin.WindowCommand):
 
     """
-    An output data sink for unittest that is used to fetch output to display
-    in an output panel
+    Removes duplicate and old results from the coverage database and compacts
+    it
     """
 
-    def __init__(self):
-        self.lock = threading.Lock()
-        self.queue = ''
+    def run(self):
+        settings = sublime.load_settings('Package Coverage.sublime-settings')
+        coverage_database = get_setting(self.window, settings, 'coverage_database')
+        if not coverage_database or not os.path.exists(coverage_database):
+            sublime.error_message(format_message('''
+                Package Coverage
 
-    def write(self, data):
-        self.lock.acquire()
-        self.queue += data
-        self.lock.release()
+                No coverage database has been created
+            '''))
+            return
 
-    def get(self):
-        self.lock.acquire()
-        output = self.queue
-        self.queue = ''
-        self.lock.release()
-        return output
+        retention_days = get_setting(self.window, settings, 'retention_days')
+        retention_commits = get_setting(self.window, settings, 'retention_commits')
 
-    def flush(self):
-        pass
+        if retention_days or retention_commits:
+            limits = []
+            if retention_days:
+                limits.append('older than %s days' % retention_days)
+            if retention_commits:
+                limits.append('not from the last %s commits of each package' % retention_commits)
+            confirmed = sublime.ok_cancel_dialog(format_message(
+                '''
+                Package Coverage
 
+                All coverage results %s will be permanently deleted
+                ''',
+                ' or '.join(limits)
+            ), 'Delete')
+            if not confirmed:
+                return
 
-def create_resources(window, package_name, package_dir):
-    """
-    Prepares resources to run tests, including:
+        panel = create_output_panel(self.window, 'package_coverage_maintenance')
+        panel_queue = StringQueue()
+        self.window.run_command('show_panel', {'panel': 'output.package_coverage_maintenance'})
 
-     1. Loading the dev/tests.py module from a package
-     2. Creating a sublime.View output panel to display the results
+        # Background report generation would compete for the database
+        report_scheduler.suspend()
 
-    :param window:
-        A sublime.Window object that the output panel will be created within
+        threading.Thread(
+            target=display_results,
+            args=('Maintaining Coverage Database', panel, panel_queue, None, report_scheduler.resume)
+        ).start()
 
-    :param package_name:
-        A unicode string of the name of the package to test
+        args = (coverage_database, retention_days, retention_commits, panel_queue)
+        threading.Thread(target=maintain_database, args=args).start()
 
-    :param package_dir:
-        A unicode string of the filesystem path to the folder containing the
-        package
 
-    :return:
-        A 2-element tuple of: (tests module, sublime.View object)
+class PackageCoverageExportResultsCommand(sublime_plugin.WindowCommand):
+
+    """
+    Appends the results in the coverage database to an archive file that can
+    be imported on another machine
     """
 
-    panel = window.get_output_panel('%s_tests' % package_name)
-    panel.settings().set('word_wrap', True)
-    panel.settings().set("auto_indent", False)
-    panel.settings().set("tab_width", 2)
+    def run(self):
+        settings = sublime.load_settings('Package Coverage.sublime-settings')
+        self.coverage_database = get_setting(self.window, settings, 'coverage_database')
+        if not self.coverage_database or not os.path.exists(self.coverage_database):
+            sublime.error_message(format_message('''
+                Package Coverage
+
+                No coverage database has been created
+            '''))
+            return
+
+        connection = open_database(readable_database(self.coverage_database))
+        try:
+            cursor = connection.cursor()
+            cursor.execute('SELECT DISTINCT project FROM coverage_results ORDER BY project')
+            projects = [row['project'] for row in cursor]
+            cursor.close()
+        finally:
+            connection.close()
+
+        self.packages = [None] + projects
+        self.window.show_quick_panel(['All packages'] + projects, self.selected_package)
+
+    def selected_package(self, index):
+        """
+        User input handler for user selecting package
+
+        :param index:
+            An integer index of the package name in self.packages - -1 indicates
+            user cancelled operation
+        """
+
+        if index == -1:
+            return
+
+        package_name = self.packages[index]
+        default_path = os.path.join(os.path.expanduser('~'), 'package_coverage_results.jsonl.gz')
+
+        def start_export(archive_path):
+            archive_path = os.path.abspath(os.path.expanduser(archive_path))
+            args = (self.coverage_database, archive_path, package_name)
+            run_archive_task(self.window, 'Exporting Coverage Results', export_archive, args)
+
+        # Allows the input panel to be shown after the quick panel closes
+        sublime.set_timeout(
+            lambda: self.window.show_input_panel('Archive Path', default_path, start_export, None, None),
+            10
+        )
+
+
+class PackageCoverageImportResultsCommand(sublime_plugin.WindowCommand):
+
+    """
+    Adds the results from an archive file to the coverage database
+    """
+
+    def run(self):
+        settings = sublime.load_settings('Package Coverage.sublime-settings')
+        coverage_database = get_setting(self.window, settings, 'coverage_database')
+        if not coverage_database:
+            sublime.error_message(format_message('''
+                Package Coverage
+
+                Please set the path to the coverage database first
+            '''))
+            return
+
+        def start_import(archive_path):
+            archive_path = os.path.abspath(os.path.expanduser(archive_path))
+            if not os.path.exists(archive_path):
+                sublime.error_message(format_message(
+                    '''
+                    Package Coverage
+
+                    The archive %s does not exist
+                    ''',
+                    archive_path
+                ))
+                return
+            args = (coverage_database, archive_path)
+            run_archive_task(self.window, 'Importing Coverage Results', import_archive, args)
+
+        self.window.show_input_panel('Archive Path', '', start_import, None, None)
+
+
+def run_archive_task(window, title, target, args):
+    """
+    Runs an export or import in a thread, displaying the result in an output
+    panel
+
+    :param window:
+        The sublime.Window object to display the output panel in
+
+    :param title:
+        A unicode string of the title for the output panel
+
+    :param target:
+        The function to run, which is passed args and a StringQueue object
+
+    :param args:
+        A tuple of arguments for target
+    """
+
+    panel = create_output_panel(window, 'package_coverage_archive')
+    panel_queue = StringQueue()
+    window.run_command('show_panel', {'panel': 'output.package_coverage_archive'})
+
+    threading.Thread(target=display_results, args=(title, panel, panel_queue, None, lambda: None)).start()
+    threading.Thread(target=target, args=args + (panel_queue,)).start()
+
+
+class PackageCoverageCleanupReportsCommand(sublime_plugin.WindowCommand):
+
+    """
+    Deletes all HTML coverage reports currently on disk
+    """
+
+    def run(self):
+        testable_packages = find_testable_packages()
+
+        if not testable_packages:
+            sublime.error_message(format_message('''
+                Package Coverage
+
+                No cleanable packages could be found
+            '''))
+            return
+
+        self.packages_path = sublime.packages_path()
+
+        cleanable_packages = []
+        for testable_package in testable_packages:
+            coverage_reports_dir = os.path.join(self.packages_path, testable_package, 'dev', 'coverage_reports')
+            if not os.path.exists(coverage_reports_dir):
+                continue
+            has_dir = False
+            for entry in os.listdir(coverage_reports_dir):
+                if entry in set(['.', '..']):
+                    continue
+                if not os.path.isdir(os.path.join(coverage_reports_dir, entry)):
+                    continue
+                has_dir = True
+                break
+
+            if has_dir:
+                cleanable_packages.append(testable_package)
+
+        if not cleanable_packages:
+            sublime.error_message(format_message('''
+                Package Coverage
+
+                No cleanable packages could be found
+            '''))
+            return
+
+        self.packages = cleanable_packages
+        self.window.show_quick_panel(cleanable_packages, self.selected_package)
+
+    def selected_package(self, index):
+        """
+        User input handler for user selecting package
+
+        :param index:
+            An integer index of the package name in self.packages - -1 indicates
+            user cancelled operation
+        """
+
+        if index == -1:
+            return
+
+        package_name = self.packages[index]
+
+        coverage_reports_dir = os.path.join(self.packages_path, package_name, 'dev', 'coverage_reports')
+        thread = threading.Thread(target=self.clean_dirs, args=(package_name, coverage_reports_dir))
+        thread.start()
+
+    def clean_dirs(self, package_name, coverage_reports_dir):
+        """
+        Deletes old coverage report dirs from a package's dev/coverage_reports/
+        directory.
+
+        RUNS IN A THREAD
+
+        :param package_name:
+            A unicode string of the package name
+
+        :param coverage_reports_dir:
+            A unicode string of the path to the directory to clean out
+
+        """
+
+        import shutil
+
+        for entry in os.listdir(coverage_reports_dir):
+            if entry in set(['.', '..']):
+                continue
+            entry_path = os.path.join(coverage_reports_dir, entry)
+            if not os.path.isdir(entry_path):
+                continue
+            if not re.match('^[a-f0-9]{6,}$', entry):
+                continue
+            shutil.rmtree(entry_path)
+
+        # Since this method is running in a thread, we schedule the result
+        # notice to be run from the main UI thread
+        def show_completed():
+            message = 'Package Coverage: coverage reports successfully cleaned for %s' % package_name
+            sublime.status_message(message)
+
+        sublime.set_timeout(show_completed, 10)
+
+
+def get_setting(window, settings, name, default=None):
+    """
+    Retrieves a setting from the current project, of the editor-wide Package Coverage
+    settings file.
+
+    :param window:
+        The current sublime.Window object
+
+    :param settings:
+        The sublime.Settings object for Package Coverage.sublime-settings
+
+    :param name:
+        A unicode string of the name of the setting to retrieve
+
+    :param default:
+        A the value to use if the setting is not currently set
+
+    :return:
+        The setting value, or the default value
+    """
+
+    window_settings = window.active_view().settings().get('Package Coverage', {})
+    if name in window_settings:
+        return window_settings[name]
+    return settings.get(name, default)
+
+
+def cache_dir():
+    """
+    Returns the folder to store Package Coverage cache files in, creating it
+    if necessary
+
+    :return:
+        A unicode string of the folder path
+    """
+
+    # Sublime Text 2 does not have a cache folder, so one is created next to
+    # the Packages folder, as Sublime Text 3 does
+    if hasattr(sublime, 'cache_path'):
+        base_dir = sublime.cache_path()
+    else:
+        base_dir = os.path.join(os.path.dirname(sublime.packages_path()), 'Cache')
+    path = os.path.join(base_dir, 'Package Coverage')
+    if not os.path.exists(path):
+        os.makedirs(path)
+    return path
+
+
+class StringQueue():
+
+    """
+    An output data sink for unittest that is used to fetch output to display
+    in an output panel. When a maximum size is set, writers wait while that
+    much output is waiting to be read, so output is never buffered faster
+    than it is displayed.
+    """
+
+    def __init__(self, max_size=None):
+        """
+        :param max_size:
+            None or an integer of the number of characters that may be
+            waiting to be read before write() blocks
+        """
+
+        self.lock = threading.Condition()
+        self.queue = ''
+        self.max_size = max_size
+        self.closed = False
+
+    def write(self, data):
+        self.lock.acquire()
+        while self.max_size is not None and not self.closed and len(self.queue) >= self.max_size:
+            self.lock.wait(0.5)
+        self.queue += data
+        self.lock.release()
+
+    def get(self):
+        self.lock.acquire()
+        output = self.queue
+        self.queue = ''
+        self.lock.notify_all()
+        self.lock.release()
+        return output
+
+    def close(self):
+        """
+        Stops write() from blocking, once nothing more will be read
+        """
+
+        self.lock.acquire()
+        self.closed = True
+        self.lock.notify_all()
+        self.lock.release()
+
+    def flush(self):
+        pass
+
+
+class OutputCapture():
+
+    """
+    Collects the output of a test run using a bounded amount of memory. The
+    start and end of the output are kept in memory, while anything past the
+    start is also written to a log file in the cache folder, so that a test
+    printing a large amount of text does not exhaust the memory of Sublime
+    Text. Only the most recent max_logs log files are kept.
+    """
+
+    # The number of characters from the start of the output to keep in memory
+    head_size = 50000
+
+    # The number of characters from the end of the output to keep in memory
+    tail_size = 50000
+
+    # The number of log files to keep in the cache folder
+    max_logs = 20
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.head = ''
+        self.tail = ''
+        self.length = 0
+        self.log_path = None
+        self.log_file = None
+
+    def write(self, data):
+        """
+        Adds output to the capture
+
+        :param data:
+            A unicode string of output
+
+        :return:
+            A unicode string of the output that should be displayed now. Once
+            the output has grown past head_size, a note with the path to the
+            full log is returned, followed by empty strings.
+        """
+
+        self.lock.acquire()
+        try:
+            self.length += len(data)
+
+            if self.log_file is None:
+                if len(self.head) + len(data) <= self.head_size:
+                    self.head += data
+                    return data
+
+                fits = data[0:self.head_size - len(self.head)]
+                self.log_file = self.open_log()
+                self.log_file.write(self.head.encode('utf-8'))
+                self.log_file.write(data.encode('utf-8'))
+                self.head += fits
+                self.tail = data[len(fits):][-self.tail_size:]
+                return '%s\n\nOutput truncated, full log: %s\n' % (fits, self.log_path)
+
+            self.log_file.write(data.encode('utf-8'))
+            self.tail = (self.tail + data)[-self.tail_size:]
+            return ''
+
+        finally:
+            self.lock.release()
+
+    def open_log(self):
+        """
+        Creates a new log file in the cache folder, removing the oldest log
+        files so that no more than max_logs are kept
+
+        :return:
+            A file object opened for writing in binary mode
+        """
+
+        import tempfile
+
+        log_dir = os.path.join(cache_dir(), 'logs')
+        if not os.path.exists(log_dir):
+            try:
+                os.makedirs(log_dir)
+            except (OSError):
+                # Another worker process may have created the folder
+                pass
+
+        logs = []
+        for name in os.listdir(log_dir):
+            path = os.path.join(log_dir, name)
+            try:
+                logs.append((os.path.getmtime(path), path))
+            except (OSError):
+                pass
+        logs.sort()
+        for _, path in logs[0:max(0, len(logs) - self.max_logs + 1)]:
+            try:
+                os.remove(path)
+            except (OSError):
+                # The log may be open or removed by another worker process
+                pass
+
+        fd, self.log_path = tempfile.mkstemp(prefix='output-', suffix='.log', dir=log_dir)
+        return os.fdopen(fd, 'wb')
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """
+        Closes the log file, if one was opened
+
+        :return:
+            A unicode string of the remaining output to display, which is the
+            end of the output if it was truncated
+        """
+
+        self.lock.acquire()
+        try:
+            if self.log_file is None:
+                return ''
+            self.log_file.close()
+            return self.truncated_tail()
+
+        finally:
+            self.lock.release()
+
+    def truncated_tail(self):
+        omitted = self.length - len(self.head) - len(self.tail)
+        return '\n... %d characters omitted ...\n\n%s' % (omitted, self.tail)
+
+    def getvalue(self):
+        """
+        :return:
+            A unicode string of the output, with the middle replaced with a
+            note if it was truncated
+        """
+
+        self.lock.acquire()
+        try:
+            if self.log_file is None:
+                return self.head
+            return '%s\n\nOutput truncated, full log: %s\n%s' % (
+                self.head,
+                self.log_path,
+                self.truncated_tail()
+            )
+
+        finally:
+            self.lock.release()
+
+
+class PhaseTimer():
+
+    """
+    Measures how long each phase of a command takes, so that the cause of a
+    slow run can be found. The timings are written as JSON lines to a log in
+    the cache folder, so they can be compared across versions.
+    """
+
+    # The size, in bytes, at which the log is rotated
+    max_log_size = 1024 * 1024
+
+    def __init__(self, command, package_name):
+        """
+        :param command:
+            A unicode string of the name of the command being timed
+
+        :param package_name:
+            A unicode string of the package name
+        """
+
+        self.command = command
+        self.package_name = package_name
+        self.lock = threading.Lock()
+        self.phases = []
+        self.current = None
+        self.current_start = None
+        self.start = monotonic()
+        self.total = None
+
+    def phase(self, name):
+        """
+        Ends the current phase, if any, and starts a new one
+
+        :param name:
+            None to only end the current phase, otherwise a unicode string of
+            the name of the new phase
+        """
+
+        self.lock.acquire()
+        now = monotonic()
+        if self.current is not None:
+            self.phases.append((self.current, now - self.current_start))
+        self.current = name
+        self.current_start = now
+        self.lock.release()
+
+    def record(self, name, seconds):
+        """
+        Adds the time taken by work that overlaps other phases
+
+        :param name:
+            A unicode string of the name of the work
+
+        :param seconds:
+            A float of the number of seconds the work took
+        """
+
+        self.lock.acquire()
+        self.phases.append((name, seconds))
+        self.lock.release()
+
+    def stop(self):
+        """
+        Ends the current phase and the total time
+        """
+
+        self.phase(None)
+        self.total = monotonic() - self.start
+
+    def summary(self):
+        """
+        :return:
+            A unicode string of the time taken by each phase
+        """
+
+        parts = ['%s %.2fs' % (name, seconds) for name, seconds in self.phases]
+        return 'Timing: %s (total %.2fs)' % (', '.join(parts), self.total)
+
+    def log(self):
+        """
+        Appends the timings to the log file
+        """
+
+        log_path = os.path.join(cache_dir(), 'timings.log')
+        if os.path.exists(log_path) and os.path.getsize(log_path) > self.max_log_size:
+            old_log_path = log_path + '.1'
+            if os.path.exists(old_log_path):
+                os.remove(old_log_path)
+            os.rename(log_path, old_log_path)
+
+        entry = {
+            'time': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'version': __version__,
+            'sublime_version': sublime.version(),
+            'python_version': '%s.%s' % sys.version_info[0:2],
+            'platform': sys.platform,
+            'command': self.command,
+            'package': self.package_name,
+            'phases': [[name, round(seconds, 4)] for name, seconds in self.phases],
+            'total': round(self.total, 4)
+        }
+        with open(log_path, 'ab') as f:
+            f.write((json.dumps(entry) + '\n').encode('utf-8'))
+
+
+class Pipeline():
+
+    """
+    Runs the stages of a command, each in its own thread once the stages it
+    depends on are done, so that work that does not depend on other work
+    overlaps. Each stage's target is passed the results of the stages it
+    depends on. A stage without a target is done when finish() is called,
+    for work driven by other code, such as running the tests. If a stage
+    fails, or the pipeline is cancelled, the stages waiting on it are
+    skipped.
+    """
+
+    def __init__(self, timer=None):
+        """
+        :param timer:
+            None or a PhaseTimer object to record the time taken by each
+            stage in
+        """
+
+        self.timer = timer
+        self.lock = threading.Lock()
+        self.cancelled = False
+        self.stages = {}
+        self.order = []
+        self.start_time = monotonic()
+
+    def add(self, name, target=None, depends=None):
+        """
+        :param name:
+            A unicode string of the name of the stage
+
+        :param target:
+            None if the stage is done by calling finish(), otherwise a
+            callable to run in a thread
+
+        :param depends:
+            None or a list of unicode strings of the names of stages that
+            must be done before the stage starts
+        """
+
+        self.stages[name] = {
+            'target': target,
+            'depends': depends or [],
+            'event': threading.Event(),
+            'state': 'pending',
+            'result': None,
+            'start': None,
+            'end': None
+        }
+        self.order.append(name)
+
+    def start(self, on_done=None):
+        """
+        Starts a thread for each stage with a target
+
+        :param on_done:
+            None or a callback to execute once every stage is done, failed or
+            skipped
+        """
+
+        self.start_time = monotonic()
+        for name in self.order:
+            if self.stages[name]['target'] is not None:
+                threading.Thread(target=self.run_stage, args=(name,)).start()
+        if on_done:
+            threading.Thread(target=self.wait_all, args=(on_done,)).start()
+
+    def run_stage(self, name):
+        """
+        Waits for the stages a stage depends on, then runs it
+
+        RUNS IN A THREAD
+
+        :param name:
+            A unicode string of the name of the stage
+        """
+
+        stage = self.stages[name]
+        results = []
+        for depend in stage['depends']:
+            results.append(self.wait(depend))
+            if self.stages[depend]['state'] != 'done' or self.cancelled:
+                self.complete(name, 'skipped', None)
+                return
+
+        stage['start'] = monotonic()
+        try:
+            result = stage['target'](*results)
+        except (Exception):
+            print(format_message(
+                '''
+                Package Coverage: error in %s stage
+
+                %s
+                ''',
+                (name, traceback.format_exc())
+            ))
+            self.complete(name, 'failed', None)
+            return
+        self.complete(name, 'done', result)
+
+    def wait_all(self, on_done):
+        """
+        RUNS IN A THREAD
+
+        :param on_done:
+            A callback to execute once every stage is done, failed or skipped
+        """
+
+        for name in self.order:
+            self.stages[name]['event'].wait()
+        on_done()
+
+    def wait(self, name):
+        """
+        Blocks until a stage is done, failed or skipped
+
+        :param name:
+            A unicode string of the name of the stage
+
+        :return:
+            The result of the stage, or None if it did not complete
+        """
+
+        stage = self.stages[name]
+        stage['event'].wait()
+        return stage['result']
+
+    def finish(self, name, result=None):
+        """
+        Marks a stage without a target as done
+
+        :param name:
+            A unicode string of the name of the stage
+
+        :param result:
+            The result to pass to stages that depend on it
+        """
+
+        self.complete(name, 'done', result)
+
+    def cancel(self):
+        """
+        Skips every stage that has not completed. Stages that are running are
+        left to finish, but their results are not used.
+        """
+
+        self.lock.acquire()
+        self.cancelled = True
+        self.lock.release()
+        for name in self.order:
+            self.complete(name, 'skipped', None)
+
+    def complete(self, name, state, result):
+        """
+        :param name:
+            A unicode string of the name of the stage
+
+        :param state:
+            A unicode string of "done", "failed" or "skipped"
+
+        :param result:
+            The result of the stage
+        """
+
+        self.lock.acquire()
+        stage = self.stages[name]
+        if stage['event'].is_set():
+            self.lock.release()
+            return
+        stage['state'] = state
+        stage['result'] = result
+        stage['end'] = monotonic()
+        start = stage['start']
+        if start is None:
+            # A stage without a target starts once the stages it depends on
+            # are done
+            ends = [self.stages[depend]['end'] for depend in stage['depends']]
+            ends = [end for end in ends if end is not None]
+            start = max(ends) if ends else self.start_time
+        stage['event'].set()
+        self.lock.release()
+
+        if state == 'done' and self.timer:
+            self.timer.record(name, stage['end'] - start)
+
+
+class ReportScheduler():
+
+    """
+    Pre-generates HTML reports for the most recent commits of each package in
+    a background thread, so that Display Report can open them immediately.
+
+    The coverage databases being watched are polled for modifications. Once a
+    database has been quiet for a few seconds and no tests are running, any
+    stale reports for the newest commits of each package are rebuilt, one at
+    a time.
+    """
+
+    # Seconds between checking the databases for modifications
+    poll_interval = 5.0
+
+    # Seconds a database must be unmodified before reports are built
+    idle_delay = 3.0
+
+    # Seconds to pause between building reports
+    build_delay = 1.0
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.databases = {}
+        self.num_commits = 0
+        self.packages_path = None
+        self.suspended = 0
+        self.cancel_event = threading.Event()
+        self.thread = None
+
+    def start(self, num_commits, packages_path):
+        """
+        Starts the background thread
+
+        :param num_commits:
+            An integer of the number of recent commits per package to
+            pre-generate reports for. 0 disables pre-generation.
+
+        :param packages_path:
+            A unicode string of the path to the Sublime Text Packages folder
+        """
+
+        self.lock.acquire()
+        self.num_commits = num_commits
+        self.packages_path = packages_path
+        should_start = num_commits > 0 and self.thread is None
+        if should_start:
+            self.thread = threading.Thread(target=self.loop)
+            self.thread.daemon = True
+        self.lock.release()
+
+        if should_start:
+            self.thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread, abandoning any report being built
+        """
+
+        self.cancel_event.set()
+
+    def watch(self, coverage_database):
+        """
+        Adds a coverage database to the list being watched for new results
+
+        :param coverage_database:
+            None or a unicode string of the path to the SQLite coverage database
+        """
+
+        if not coverage_database:
+            return
+        self.lock.acquire()
+        if coverage_database not in self.databases:
+            self.databases[coverage_database] = None
+        self.lock.release()
+
+    def suspend(self):
+        """
+        Pauses building reports, such as while tests are being run
+        """
+
+        self.lock.acquire()
+        self.suspended += 1
+        self.lock.release()
+
+    def resume(self):
+        """
+        Undoes a call to suspend()
+        """
+
+        self.lock.acquire()
+        self.suspended = max(0, self.suspended - 1)
+        self.lock.release()
+
+    def is_idle(self):
+        """
+        :return:
+            A boolean - if reports may be built
+        """
+
+        return self.suspended == 0 and not self.cancel_event.is_set()
+
+    def loop(self):
+        """
+        Checks the watched databases for modifications until stopped
+
+        RUNS IN A THREAD
+        """
+
+        while True:
+            # Event.wait() only returns a value on Python 2.7+
+            self.cancel_event.wait(self.poll_interval)
+            if self.cancel_event.is_set():
+                break
+            if not self.is_idle():
+                continue
+
+            self.lock.acquire()
+            databases = list(self.databases.items())
+            self.lock.release()
+
+            for coverage_database, last_mtime in databases:
+                try:
+                    mtime = database_mtime(coverage_database)
+                except (OSError):
+                    continue
+                if mtime == last_mtime or time.time() - mtime < self.idle_delay:
+                    continue
+                try:
+                    completed = self.build_reports(coverage_database)
+                except (Exception) as e:
+                    print(format_message(
+                        '''
+                        Package Coverage: error pre-generating coverage reports
+                        from %s - %s
+                        ''',
+                        (coverage_database, e)
+                    ))
+                    completed = True
+                if completed:
+                    self.lock.acquire()
+                    self.databases[coverage_database] = mtime
+                    self.lock.release()
+
+    def build_reports(self, coverage_database):
+        """
+        Builds any stale reports for the newest commits of each package in a
+        coverage database
+
+        RUNS IN A THREAD
+
+        :param coverage_database:
+            A unicode string of the path to the SQLite coverage database
+
+        :return:
+            A boolean - if all reports were built, False if interrupted
+        """
+
+        connection = open_database(readable_database(coverage_database))
+        try:
+            cursor = connection.cursor()
+            cursor.execute("""
+                SELECT
+                    project,
+                    commit_hash
+                FROM
+                    coverage_results
+                GROUP BY
+                    project,
+                    commit_hash
+                ORDER BY
+                    project ASC,
+                    MAX(commit_date) DESC
+            """)
+            recent = []
+            counts = {}
+            for row in cursor:
+                project = row['project']
+                counts[project] = counts.get(project, 0) + 1
+                if counts[project] <= self.num_commits:
+                    recent.append((project, row['commit_hash']))
+            cursor.close()
+
+            for package_name, commit_hash in recent:
+                package_dir = os.path.join(self.packages_path, package_name)
+                if not os.path.isdir(os.path.join(package_dir, 'dev')):
+                    continue
+                if not self.is_idle():
+                    return False
+                html_path = build_report(
+                    connection,
+                    package_name,
+                    package_dir,
+                    commit_hash,
+                    self.cancel_event
+                )
+                if html_path is None:
+                    return False
+                self.cancel_event.wait(self.build_delay)
+
+        finally:
+            connection.close()
+
+        return True
+
+
+class CoverageOverlay():
+
+    """
+    Marks the covered and missed lines of files in the gutter of open views.
+    The lines are indexed by file when the coverage data is loaded, so that
+    marking a view only requires a dict lookup.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.package_name = None
+        self.commit_hash = None
+        self.index = {}
+        self.generation = 0
+        self.applied = {}
+        self.last_runs = {}
+
+    def record_run(self, package_name, package_dir, cov_data):
+        """
+        Keeps the coverage data from a test run so it may be shown, and
+        refreshes the marks if the last run of the package is being shown
+
+        RUNS IN A THREAD
+
+        :param package_name:
+            A unicode string of the package name
+
+        :param package_dir:
+            A unicode string of the path to the package's directory
+
+        :param cov_data:
+            The coverage.CoverageData object from the run
+        """
+
+        self.lock.acquire()
+        self.last_runs[package_name] = (package_dir, cov_data)
+        refresh = self.package_name == package_name and self.commit_hash is None
+        self.lock.release()
+
+        if refresh:
+            self.show_last_run(package_name)
+
+    def has_last_run(self, package_name):
+        """
+        :param package_name:
+            A unicode string of the package name
+
+        :return:
+            A boolean - if coverage has been measured for the package since
+            Sublime Text was started
+        """
+
+        return package_name in self.last_runs
+
+    def show_last_run(self, package_name):
+        """
+        Shows the coverage from the last test run of a package
+
+        RUNS IN A THREAD
+
+        :param package_name:
+            A unicode string of the package name
+        """
+
+        package_dir, cov_data = self.last_runs[package_name]
+        self.show(package_name, None, build_line_index(package_dir, cov_data))
+
+    def show(self, package_name, commit_hash, index):
+        """
+        Replaces the marks in all views
+
+        :param package_name:
+            A unicode string of the package name
+
+        :param commit_hash:
+            None if the index is from the last test run, otherwise a unicode
+            string of the git SHA1 hash of the commit
+
+        :param index:
+            A dict from build_line_index()
+        """
+
+        self.lock.acquire()
+        self.package_name = package_name
+        self.commit_hash = commit_hash
+        self.index = index
+        self.generation += 1
+        self.lock.release()
+
+        sublime.set_timeout(self.apply_all, 10)
+
+    def hide(self):
+        """
+        Removes the marks from all views
+        """
+
+        self.show(None, None, {})
+
+    def reset(self, view):
+        """
+        Forces a view to be marked again the next time apply() is called
+
+        :param view:
+            A sublime.View object
+        """
+
+        self.applied.pop(view.id(), None)
+
+    def apply_all(self):
+        for window in sublime.windows():
+            for view in window.views():
+                self.apply(view)
+
+    def apply(self, view):
+        """
+        Marks the lines of a view, if the index has changed since the view was
+        last marked
+
+        :param view:
+            A sublime.View object
+        """
+
+        if self.applied.get(view.id()) == self.generation:
+            return
+        self.applied[view.id()] = self.generation
+
+        file_name = view.file_name()
+        entry = self.index.get(line_index_key(file_name)) if file_name else None
+        if entry is None:
+            view.erase_regions('package_coverage_covered')
+            view.erase_regions('package_coverage_missed')
+            view.erase_status('package_coverage')
+            return
+
+        if sys.version_info >= (3,):
+            flags = sublime.DRAW_NO_FILL | sublime.DRAW_NO_OUTLINE
+        else:
+            flags = sublime.DRAW_OUTLINED
+
+        covered, missed = entry
+        for key, lines, scope in [('covered', covered, 'markup.inserted'), ('missed', missed, 'markup.deleted')]:
+            regions = [view.line(view.text_point(line - 1, 0)) for line in lines]
+            view.add_regions('package_coverage_' + key, regions, scope, 'dot', flags)
+
+        total = len(covered) + len(missed)
+        percent = 100 * len(covered) // total if total else 100
+        view.set_status('package_coverage', 'Coverage: %d%%' % percent)
+
+
+def line_index_key(path):
+    """
+    :param path:
+        A unicode string of a file path
+
+    :return:
+        A unicode string of the path normalized for looking up in an index
+        from build_line_index()
+    """
+
+    return os.path.normcase(os.path.realpath(path))
+
+
+def build_line_index(package_dir, cov_data):
+    """
+    Determines the covered and missed lines of each file in a package, using
+    the current source of the files
+
+    :param package_dir:
+        A unicode string of the path to the package's directory
+
+    :param cov_data:
+        A coverage.CoverageData object
+
+    :return:
+        A dict with unicode string keys from line_index_key() and values that
+        are 2-element tuples of (covered line list, missed line list)
+    """
+
+    import coverage
+    import coverage.parser
+
+    exclude_list = coverage.Coverage(config_file=False).get_exclude_list()
+    exclude = '|'.join(['(?:%s)' % regex for regex in exclude_list])
+
+    package_prefix = line_index_key(package_dir) + os.sep
+    index = {}
+    for file_path in cov_data.measured_files():
+        key = line_index_key(file_path)
+        if not key.startswith(package_prefix) or not os.path.exists(file_path):
+            continue
+
+        with open(file_path, 'rb') as f:
+            source = f.read().decode('utf-8', 'replace')
+        try:
+            parser = coverage.parser.PythonParser(text=source, exclude=exclude)
+            parser.parse_source()
+        except (coverage.CoverageException):
+            continue
+
+        executed = set(cov_data.lines(file_path) or [])
+        index[key] = (sorted(parser.statements & executed), sorted(parser.statements - executed))
+    return index
+
+
+def create_output_panel(window, name):
+    """
+    Creates a sublime.View output panel to display results in
+
+    :param window:
+        A sublime.Window object that the output panel will be created within
+
+    :param name:
+        A unicode string of the name of the panel, without the "output." prefix
+
+    :return:
+        A sublime.View object
+    """
+
+    panel = window.get_output_panel(name)
+    panel.settings().set('word_wrap', True)
+    panel.settings().set("auto_indent", False)
+    panel.settings().set("tab_width", 2)
+    # Allows double-clicking the path of a truncated log to open it
+    panel.settings().set('result_file_regex', '^\\s*Output truncated, full log: (.+)$')
+    return panel
+
+
+def create_resources(window, package_name, package_dir):
+    """
+    Prepares resources to run tests, including:
+
+     1. Loading the dev/tests.py module from a package
+     2. Creating a sublime.View output panel to display the results
+
+    :param window:
+        A sublime.Window object that the output panel will be created within
+
+    :param package_name:
+        A unicode string of the name of the package to test
+
+    :param package_dir:
+        A unicode string of the filesystem path to the folder containing the
+        package
+
+    :return:
+        A 2-element tuple of: (tests module, sublime.View object)
+    """
+
+    panel = create_output_panel(window, '%s_tests' % package_name)
+    tests_module = load_tests_module(package_name, package_dir)
+    return (tests_module, panel)
+
+
+def load_tests_module(package_name, package_dir):
+    """
+    Loads, or reloads, the dev/tests.py module from a package, running
+    dev/reloader.py first if it exists
+
+    :param package_name:
+        A unicode string of the name of the package to test
+
+    :param package_dir:
+        A unicode string of the filesystem path to the folder containing the
+        package
+
+    :return:
+        The tests module
+    """
+
+    if sys.version_info >= (3,):
+        old_path = os.getcwd()
+    else:
+        old_path = os.getcwdu()
+
+    reloader_path = os.path.join(package_dir, 'dev', 'reloader.py')
+    os.chdir(package_dir)
+
+    dev_module_name = '%s.dev' % package_name
+    tests_module_name = '%s.dev.tests' % package_name
+    reloader_module_name = '%s.dev.reloader' % package_name
+
+    if os.path.exists(reloader_path):
+        if reloader_module_name in sys.modules:
+            reload(sys.modules[reloader_module_name])
+        else:
+            reloader_module_info = imp.find_module('reloader', [os.path.join(package_dir, 'dev')])
+            imp.load_module(reloader_module_name, *reloader_module_info)
+
+    if tests_module_name in sys.modules:
+        tests_module = sys.modules[tests_module_name]
+        reload(tests_module)
+
+    else:
+        dev_module_info = imp.find_module('dev', [package_dir])
+        imp.load_module(dev_module_name, *dev_module_info)
+
+        tests_module_info = imp.find_module('tests', [os.path.join(package_dir, 'dev')])
+        tests_module = imp.load_module(tests_module_name, *tests_module_info)
+
+    os.chdir(old_path)
+
+    return tests_module
+
+
+def display_results(headline, panel, panel_queue, capture, on_done):
+    """
+    Displays the results of a test run
+
+    :param headline:
+        A unicode string title to display in the output panel
+
+    :param panel:
+        A sublime.View to write the results to
+
+    :param panel_queue:
+        The StringQueue object to fetch test results from
+
+    :param capture:
+        None or an OutputCapture object so output can be saved in the coverage
+        database. Only the start and end of long output is written to the
+        panel, along with the path to the full log.
+
+    :param on_done:
+        A callback to execute when the results are done being printed
+    """
+
+    if capture is None:
+        capture = OutputCapture()
+
+    write_to_panel(panel, '%s\n\n  ' % headline)
+
+    while True:
+        chars = panel_queue.get()
+
+        if chars == '':
+            time.sleep(0.05)
+            continue
+
+        finished = chars[-1] == '\x04'
+        if finished:
+            chars = chars[0:-1]
+
+        chars = capture.write(chars)
+        if finished:
+            chars += capture.close()
+
+        if chars:
+            write_to_panel(panel, chars.replace('\n', '\n  '))
+        if finished:
+            break
+
+    panel_queue.close()
+    on_done()
+
+
+def write_to_panel(panel, chars):
+    """
+    Appends text to an output panel from any thread
+
+    :param panel:
+        A sublime.View to write to
+
+    :param chars:
+        A unicode string to append
+    """
+
+    if sys.version_info >= (3,):
+        sublime.set_timeout(lambda: panel.run_command('insert', {'characters': chars}), 10)
+        return
+
+    def do_write():
+        edit = panel.begin_edit('package_coverage_insert', [])
+        panel.insert(edit, panel.size(), chars)
+        panel.end_edit(edit)
+
+    sublime.set_timeout(do_write, 10)
+
+
+def run_tests(tests_module, queue, name_pattern, on_done, test_filter=None, observers=None, arrange=None,
+              class_names=None, test_names=None):
+    """
+    Executes the tests within a module and sends the output through the queue
+    for display via another thread
+
+    :param tests_module:
+        The module that contains unittest.TestCase classes to execute
+
+    :param queue:
+        A StringQueue object to send the results to
+
+    :param name_pattern:
+        None or a re._pattern_type object for matching test names against
+
+    :param on_done:
+        A callback to execute when the tests are done being run - will be
+        passed the unittest.TestResult object
+
+    :param test_filter:
+        None or a callable that is passed each unittest.TestCase object and
+        returns False if the test should be skipped as cached
+
+    :param observers:
+        None or a list of objects with start_test(test) and
+        stop_test(test, outcome) methods to call around each test, and
+        optionally an attach_result(result) method
+
+    :param arrange:
+        None or a callable that is passed the list of unittest.TestCase
+        objects to run, and returns the list of tests in the order they
+        should be run
+
+    :param class_names:
+        None or a list of unicode strings of the names of the test classes to
+        run
+
+    :param test_names:
+        None or a list of unicode strings in the form "ClassName.test_name"
+        of the tests to run
+    """
+
+    tests = discover_tests(tests_module, name_pattern, class_names, test_names)
+
+    cached = []
+    if test_filter:
+        changed = []
+        for test in tests:
+            if test_filter(test):
+                changed.append(test)
+            else:
+                cached.append(test)
+        tests = changed
+
+    if arrange:
+        tests = arrange(tests)
+
+    suite = unittest.TestSuite()
+    suite.addTests(tests)
+    verbosity = 2 if name_pattern else 1
+
+    if cached:
+        if verbosity > 1:
+            for test in cached:
+                queue.write('%s ... cached\n' % test)
+        queue.write('Skipped %d unchanged tests that passed previously\n' % len(cached))
+
+    runner = ObservedTestRunner(queue, verbosity, observers or [])
+    result = runner.run(suite)
+
+    on_done(result)
+
+
+def discover_tests(tests_module, name_pattern=None, class_names=None, test_names=None):
+    """
+    Finds the tests in the unittest.TestCase classes within a module
+
+    :param tests_module:
+        The module that contains unittest.TestCase classes
+
+    :param name_pattern:
+        None or a re._pattern_type object for matching test names against
+
+    :param class_names:
+        None or a list of unicode strings of the names of the test classes to
+        include
+
+    :param test_names:
+        None or a list of unicode strings in the form "ClassName.test_name"
+        of the tests to include
+
+    :return:
+        A list of unittest.TestCase objects, grouped by class
+    """
+
+    if test_names is not None:
+        test_names = set(test_names)
+
+    tests = []
+    for test_name in discover_test_names(tests_module):
+        class_name, name = test_name.rsplit('.', 1)
+        if class_names is not None and class_name not in class_names:
+            continue
+        if test_names is not None and test_name not in test_names:
+            continue
+        if name_pattern and not name_pattern.search(name):
+            continue
+        tests.append(getattr(tests_module, class_name)(name))
+    return tests
+
+
+def discover_test_names(tests_module):
+    """
+    Lists the tests within a module, using the TestIndex for the package when
+    the files in dev/ have not changed since the tests were last discovered
+
+    :param tests_module:
+        The module that contains unittest.TestCase classes
+
+    :return:
+        A list of unicode strings in the form "ClassName.test_name"
+    """
+
+    import inspect
+
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(tests_module.__file__)))
+    package_name = tests_module.__name__[0:-len('.dev.tests')]
+    index = TestIndex(package_name, package_dir)
+
+    test_names = index.names()
+    if test_names is not None:
+        # The index may be out of date if a class is defined dynamically
+        class_names = set([test_name.rsplit('.', 1)[0] for test_name in test_names])
+        if all([hasattr(tests_module, class_name) for class_name in class_names]):
+            return test_names
+
+    test_names = []
+    loader = unittest.TestLoader()
+    for class_name, obj in inspect.getmembers(tests_module):
+        if not inspect.isclass(obj) or not issubclass(obj, unittest.TestCase):
+            continue
+        names = loader.getTestCaseNames(obj)
+        if not names and hasattr(obj, 'runTest'):
+            names = ['runTest']
+        for name in names:
+            test_names.append('%s.%s' % (class_name, name))
+
+    index.save(test_names)
+    return test_names
+
+
+class TestIndex():
+
+    """
+    Caches the names of the tests in a package, keyed by a hash of the files
+    in dev/, so that tests can be listed without loading and inspecting the
+    tests module
+    """
+
+    def __init__(self, package_name, package_dir):
+        """
+        :param package_name:
+            A unicode string of the package name
+
+        :param package_dir:
+            A unicode string of the filesystem path to the folder containing
+            the package
+        """
+
+        self.package_dir = package_dir
+        self.path = os.path.join(cache_dir(), '%s.test_index.json' % package_name)
+        self.key = None
+
+    def source_key(self):
+        """
+        :return:
+            A unicode string of the SHA1 of the paths and contents of the
+            Python files in dev/
+        """
+
+        if self.key is None:
+            dev_dir = os.path.join(self.package_dir, 'dev')
+            paths = []
+            for root, dir_names, file_names in os.walk(dev_dir):
+                for file_name in file_names:
+                    if file_name.endswith('.py'):
+                        paths.append(os.path.join(root, file_name))
+
+            hasher = hashlib.sha1()
+            for path in sorted(paths):
+                with open(path, 'rb') as f:
+                    contents = f.read()
+                relative_path = os.path.relpath(path, dev_dir).replace(os.sep, '/')
+                hasher.update(('%s:%s\n' % (relative_path, hashlib.sha1(contents).hexdigest())).encode('utf-8'))
+            self.key = hasher.hexdigest()
+        return self.key
+
+    def names(self):
+        """
+        :return:
+            None if the index is missing or out of date, otherwise a list of
+            unicode strings in the form "ClassName.test_name"
+        """
+
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                entry = json.loads(f.read().decode('utf-8'))
+        except (ValueError):
+            return None
+        if entry.get('key') != self.source_key():
+            return None
+        return entry['names']
+
+    def save(self, names):
+        """
+        :param names:
+            A list of unicode strings in the form "ClassName.test_name"
+        """
+
+        with open(self.path, 'wb') as f:
+            f.write(json.dumps({'key': self.source_key(), 'names': names}).encode('utf-8'))
+
+
+if sys.version_info >= (2, 7):
+    _TextTestResult = unittest.TextTestResult
+else:
+    _TextTestResult = unittest._TextTestResult
+
+
+class ObservedTestResult(_TextTestResult):
+
+    """
+    A unittest result that notifies observers as each test starts and stops,
+    and of the outcome of the test: "success", "failure", "error", "skip" or
+    "timeout"
+    """
+
+    observers = []
+
+    def startTest(self, test):
+        self.outcome = 'success'
+        _TextTestResult.startTest(self, test)
+        for observer in self.observers:
+            observer.start_test(test)
+
+    def stopTest(self, test):
+        for observer in reversed(self.observers):
+            observer.stop_test(test, self.outcome)
+        _TextTestResult.stopTest(self, test)
+
+    def addError(self, test, err):
+        self.outcome = 'timeout' if issubclass(err[0], TestTimeout) else 'error'
+        _TextTestResult.addError(self, test, err)
+
+    def addFailure(self, test, err):
+        self.outcome = 'failure'
+        _TextTestResult.addFailure(self, test, err)
+
+    def addSkip(self, test, reason):
+        self.outcome = 'skip'
+        _TextTestResult.addSkip(self, test, reason)
+
+
+class ObservedTestRunner(unittest.TextTestRunner):
+
+    """
+    A unittest runner that uses ObservedTestResult
+    """
+
+    def __init__(self, stream, verbosity, observers):
+        unittest.TextTestRunner.__init__(self, stream=stream, verbosity=verbosity)
+        self.observers = observers
+
+    def _makeResult(self):
+        result = ObservedTestResult(self.stream, self.descriptions, self.verbosity)
+        result.observers = self.observers
+        for observer in self.observers:
+            if hasattr(observer, 'attach_result'):
+                observer.attach_result(result)
+        return result
+
+
+class TestTimeout(Exception):
+
+    """
+    Raised inside of a test that has run for longer than allowed
+    """
+
+    pass
+
+
+class Watchdog():
+
+    """
+    A run_tests() observer that enforces the "test_timeout" and "run_timeout"
+    settings. When a limit is exceeded, the stacks of all threads are written
+    to the output and a TestTimeout exception is raised inside of the running
+    test. If the test does not stop within grace_period, such as when it is
+    blocked in a lock, the run is abandoned and on_hang is called.
+    """
+
+    # Seconds between checks of the running test
+    poll_interval = 0.25
+
+    # Seconds to wait for an interrupted test to stop before abandoning it
+    grace_period = 5.0
+
+    def __init__(self, queue, test_timeout, run_timeout, on_hang=None):
+        """
+        :param queue:
+            A StringQueue object to write the thread stacks to
+
+        :param test_timeout:
+            None or a number of seconds a single test may run for
+
+        :param run_timeout:
+            None or a number of seconds all of the tests may run for
+
+        :param on_hang:
+            None or a callback to execute, in the watchdog thread, if a test
+            does not stop after being interrupted - will be passed the
+            unittest.TestCase object
+        """
+
+        self.queue = queue
+        self.test_timeout = test_timeout
+        self.run_timeout = run_timeout
+        self.on_hang = on_hang
+        self.lock = threading.Lock()
+        self.result = None
+        self.test = None
+        self.thread_id = None
+        self.test_start = None
+        self.interrupted_at = None
+        self.run_start = time.time()
+        self.timed_out = []
+        self.hung = False
+        self.finished = threading.Event()
+
+        thread = threading.Thread(target=self.loop)
+        thread.daemon = True
+        thread.start()
+
+    def attach_result(self, result):
+        self.result = result
+
+    def start_test(self, test):
+        self.lock.acquire()
+        self.test = test
+        self.thread_id = threading.current_thread().ident
+        self.test_start = time.time()
+        self.interrupted_at = None
+        self.lock.release()
+
+    def stop_test(self, test, outcome):
+        self.lock.acquire()
+        if self.interrupted_at is not None:
+            # Cancels the exception if the test finished before it was raised
+            raise_in_thread(self.thread_id, None)
+        self.test = None
+        self.lock.release()
+
+    def stop(self):
+        """
+        Stops the watchdog thread once the tests are done
+        """
+
+        self.finished.set()
+
+    def loop(self):
+        """
+        Checks the running test against the timeouts
+
+        RUNS IN A THREAD
+        """
+
+        while True:
+            self.finished.wait(self.poll_interval)
+            if self.finished.is_set():
+                return
+
+            self.lock.acquire()
+            try:
+                test = self.test
+                if test is None:
+                    continue
+
+                now = time.time()
+                if self.interrupted_at is not None:
+                    if now - self.interrupted_at < self.grace_period:
+                        continue
+                    self.hung = True
+                    self.finished.set()
+
+                elif self.test_timeout and now - self.test_start > self.test_timeout:
+                    self.interrupt(test, 'the test timeout of %s seconds' % self.test_timeout)
+                    continue
+
+                elif self.run_timeout and now - self.run_start > self.run_timeout:
+                    if self.result is not None:
+                        self.result.shouldStop = True
+                    self.interrupt(test, 'the run timeout of %s seconds' % self.run_timeout)
+                    continue
+
+                else:
+                    continue
+
+            finally:
+                self.lock.release()
+
+            self.queue.write('\n%s did not stop after being interrupted, abandoning the run\n' % test.id())
+            if self.on_hang:
+                self.on_hang(test)
+            return
+
+    def interrupt(self, test, reason):
+        """
+        Writes the stacks of all threads to the output and raises TestTimeout
+        in the thread running the test. Must be called with the lock held.
+
+        :param test:
+            The unittest.TestCase object that is running
+
+        :param reason:
+            A unicode string describing the limit that was exceeded
+        """
+
+        self.timed_out.append(test.id())
+        self.interrupted_at = time.time()
+        self.queue.write('\n\n%s exceeded %s\n\n%s\n' % (test.id(), reason, format_thread_stacks()))
+        if not raise_in_thread(self.thread_id, TestTimeout):
+            # Without a way to interrupt the test, it is abandoned right away
+            self.interrupted_at -= self.grace_period
+
+
+def format_thread_stacks():
+    """
+    :return:
+        A unicode string of the current stack of every thread, other than the
+        current one
+    """
+
+    names = {}
+    for thread in threading.enumerate():
+        names[thread.ident] = thread.name
+
+    current_id = threading.current_thread().ident
+    output = []
+    for thread_id, frame in sys._current_frames().items():
+        if thread_id == current_id:
+            continue
+        output.append('Thread %s (%s):\n' % (thread_id, names.get(thread_id, 'unknown')))
+        output.append(''.join(traceback.format_stack(frame)))
+    return '\n'.join(output)
+
+
+def raise_in_thread(thread_id, exception_class):
+    """
+    Raises an exception asynchronously in another thread. The exception is
+    only raised once the thread executes Python code, so a thread blocked in
+    a system call is not interrupted.
+
+    :param thread_id:
+        An integer of the thread's ident
+
+    :param exception_class:
+        The class of the exception to raise, or None to cancel an exception
+        that has not been raised yet
+
+    :return:
+        A boolean - if the exception was scheduled
+    """
+
+    try:
+        import ctypes
+    except (ImportError):
+        return False
+
+    set_async_exc = ctypes.pythonapi.PyThreadState_SetAsyncExc
+    exception = ctypes.py_object(exception_class) if exception_class else None
+    num_threads = set_async_exc(ctypes.c_long(thread_id), exception)
+    if num_threads > 1:
+        set_async_exc(ctypes.c_long(thread_id), None)
+        return False
+    return num_threads == 1
+
+
+class TestCoverageTracker():
+
+    """
+    A run_tests() observer that measures the lines of package code executed
+    by each individual test. Since measuring a test pauses any coverage
+    measurement of the whole run, the lines are also collected into a
+    coverage.CoverageData object to be merged back into the run's data.
+    """
+
+    def __init__(self, package_dir, data_file):
+        """
+        :param package_dir:
+            A unicode string of the filesystem path to the folder containing
+            the package
+
+        :param data_file:
+            A unicode string of a path the coverage.Coverage object may use as
+            its data file - it is erased between tests
+        """
+
+        import coverage
+
+        self.package_dir = package_dir
+        self.lines = {}
+        self.combined = coverage.CoverageData()
+        self.cov = create_coverage(package_dir, data_file)
+        # Most tests do not execute every module, and some execute none
+        self.cov.set_option('run:disable_warnings', ['no-data-collected'])
+
+    def start_test(self, test):
+        self.cov.erase()
+        self.cov.start()
+
+    def stop_test(self, test, outcome):
+        self.cov.stop()
+        data = self.cov.get_data()
+        test_lines = {}
+        for measured_file in data.measured_files():
+            lines = data.lines(measured_file)
+            if lines:
+                test_lines[measured_file] = set(lines)
+                self.combined.add_lines({measured_file: dict.fromkeys(lines)})
+        self.lines[test.id()] = test_lines
+
+
+class MemoryProfiler():
+
+    """
+    A run_tests() observer that uses tracemalloc to measure the memory
+    allocated by each test. The traces are cleared as each test starts, so
+    the peak is the most memory allocated at once while the test ran. The
+    peak can not be filtered, so it is process-wide and also includes the
+    test code, the captured output and any other threads, such as the one
+    displaying the output. The retained memory is what package code outside
+    of dev/ still held after a garbage collection, grouped by the line that
+    allocated it.
+    """
+
+    # The number of allocation sites to record per test
+    max_sites = 10
+
+    def __init__(self, package_dir):
+        """
+        :param package_dir:
+            A unicode string of the filesystem path to the folder containing
+            the package
+        """
+
+        import tracemalloc
+
+        self.package_dir = package_dir
+        self.results = {}
+        self.started = False
+        # Allocations made by the tests themselves are not of interest
+        self.filters = [
+            tracemalloc.Filter(True, os.path.join(package_dir, '*')),
+            tracemalloc.Filter(False, os.path.join(package_dir, 'dev', '*'))
+        ]
+
+    def start(self):
+        import tracemalloc
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started = True
+
+    def stop(self):
+        import tracemalloc
+
+        if self.started:
+            tracemalloc.stop()
+            self.started = False
+
+    def start_test(self, test):
+        import tracemalloc
+
+        gc.collect()
+        tracemalloc.clear_traces()
+
+    def stop_test(self, test, outcome):
+        import tracemalloc
+
+        _, peak = tracemalloc.get_traced_memory()
+        gc.collect()
+
+        # Only the allocations made by package code are counted as retained
+        snapshot = tracemalloc.take_snapshot().filter_traces(self.filters)
+        stats = snapshot.statistics('lineno')
+        retained = sum([stat.size for stat in stats])
+        sites = []
+        for stat in stats[0:self.max_sites]:
+            frame = stat.traceback[0]
+            sites.append({
+                'path': os.path.relpath(frame.filename, self.package_dir).replace(os.sep, '/'),
+                'line': frame.lineno,
+                'size': stat.size,
+                'count': stat.count
+            })
+
+        self.results[test.id()] = {
+            'outcome': outcome,
+            'peak': peak,
+            'retained': retained,
+            'sites': sites
+        }
+
+
+class TestResultCache():
+
+    """
+    Tracks which tests passed, keyed by a hash of the source files each test
+    executed plus the test code in dev/ and the top-level statements of the
+    other package modules imported by the tests, so that tests whose key is
+    unchanged can be skipped on the next run.
+    """
+
+    def __init__(self, package_name, package_dir):
+        """
+        :param package_name:
+            A unicode string of the package name
+
+        :param package_dir:
+            A unicode string of the filesystem path to the folder containing
+            the package
+        """
+
+        self.package_dir = package_dir
+        self.path = os.path.join(cache_dir(), '%s.test_cache.json' % package_name)
+        self.lock = threading.Lock()
+        self.file_hashes = {}
+        self.outcomes = {}
+        self.run = {}
+        self.support_hash = None
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'rb') as f:
+                    self.entries = json.loads(f.read().decode('utf-8'))
+            except (ValueError):
+                self.entries = {}
+
+    def load_support_hash(self):
+        """
+        Hashes the package modules that have been imported, so that any
+        changes to the test code in dev/ invalidate the cache. For other
+        package modules only the top-level statements are hashed, since a
+        test may use a module-level value without executing any lines of the
+        module, while edits to function bodies are already covered by the
+        files each test executed. Must be called after the tests module has
+        been loaded.
+        """
+
+        package_prefix = os.path.abspath(self.package_dir) + os.sep
+        dev_prefix = os.path.join(package_prefix, 'dev') + os.sep
+        paths = set()
+        for module in list(sys.modules.values()):
+            module_file = getattr(module, '__file__', None)
+            if not module_file:
+                continue
+            module_file = os.path.abspath(module_file)
+            if not module_file.startswith(package_prefix):
+                continue
+            if module_file.endswith(('.pyc', '.pyo')):
+                module_file = module_file[:-1]
+            paths.add(module_file)
+
+        hasher = hashlib.sha1()
+        for path in sorted(paths):
+            if path.startswith(dev_prefix):
+                file_hash = self.hash_file(path)
+            else:
+                file_hash = self.hash_top_level(path)
+            relative_path = os.path.relpath(path, self.package_dir).replace(os.sep, '/')
+            hasher.update(('%s:%s\n' % (relative_path, file_hash)).encode('utf-8'))
+        self.support_hash = hasher.hexdigest()
+
+    def hash_top_level(self, path):
+        """
+        :param path:
+            A unicode string of an absolute file path to a Python module
+
+        :return:
+            A unicode string of the SHA1 of the module's syntax tree with the
+            bodies of functions and methods removed, or "missing". Comments
+            and line numbers are not included. If the module can not be
+            parsed, the SHA1 of the file contents is returned.
+        """
+
+        import ast
+
+        if not os.path.exists(path):
+            return 'missing'
+        with open(path, 'rb') as f:
+            source = f.read()
+        try:
+            tree = ast.parse(source, path)
+        except (SyntaxError, TypeError, ValueError):
+            return hashlib.sha1(source).hexdigest()
+
+        function_types = tuple([
+            getattr(ast, name) for name in ['FunctionDef', 'AsyncFunctionDef'] if hasattr(ast, name)
+        ])
+        for node in ast.walk(tree):
+            if isinstance(node, function_types):
+                node.body = []
+        return hashlib.sha1(ast.dump(tree).encode('utf-8')).hexdigest()
+
+    def hash_file(self, path):
+        """
+        :param path:
+            A unicode string of an absolute file path
+
+        :return:
+            A unicode string of the SHA1 of the file contents, or "missing"
+        """
+
+        if path not in self.file_hashes:
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    self.file_hashes[path] = hashlib.sha1(f.read()).hexdigest()
+            else:
+                self.file_hashes[path] = 'missing'
+        return self.file_hashes[path]
+
+    def hash_files(self, paths):
+        """
+        :param paths:
+            An iterable of unicode strings of absolute file paths
+
+        :return:
+            A unicode string of the SHA1 of the paths and their contents
+        """
+
+        hasher = hashlib.sha1()
+        for path in sorted(set(paths)):
+            relative_path = os.path.relpath(path, self.package_dir).replace(os.sep, '/')
+            hasher.update(('%s:%s\n' % (relative_path, self.hash_file(path))).encode('utf-8'))
+        return hasher.hexdigest()
+
+    def test_key(self, relative_paths):
+        """
+        :param relative_paths:
+            A list of unicode strings of package-relative file paths executed
+            by a test
+
+        :return:
+            A unicode string of the cache key for the test
+        """
+
+        paths = [os.path.join(self.package_dir, os.path.normpath(path)) for path in relative_paths]
+        return '%s-%s' % (self.support_hash, self.hash_files(paths))
+
+    def is_changed(self, test):
+        """
+        A test_filter for run_tests()
+
+        :param test:
+            A unittest.TestCase object
+
+        :return:
+            A boolean - False if the test passed previously and nothing it
+            depends on has changed
+        """
+
+        entry = self.entries.get(test.id())
+        if entry is None:
+            return True
+        return entry['key'] != self.test_key(entry['lines'].keys())
+
+    def start_test(self, test):
+        pass
+
+    def stop_test(self, test, outcome):
+        self.outcomes[test.id()] = outcome
+
+    def record(self, tracker):
+        """
+        Creates the cache entries for the tests that were run
+
+        :param tracker:
+            The TestCoverageTracker that observed the tests
+        """
+
+        run = {}
+        for test_id, outcome in self.outcomes.items():
+            test_lines = tracker.lines.get(test_id)
+            if outcome != 'success' or test_lines is None:
+                run[test_id] = None
+                continue
+            lines = {}
+            for path, line_numbers in test_lines.items():
+                relative_path = os.path.relpath(path, self.package_dir).replace(os.sep, '/')
+                lines[relative_path] = sorted(line_numbers)
+            run[test_id] = {
+                'key': self.test_key(lines.keys()),
+                'lines': lines
+            }
+        self.update(run)
+
+    def update(self, run):
+        """
+        Adds the cache entries of tests run elsewhere, such as in a worker
+        process
+
+        :param run:
+            A dict with unicode string test id keys and values that are None
+            if the test should not be cached, otherwise a dict with the keys
+            "key" and "lines"
+        """
+
+        self.lock.acquire()
+        self.run.update(run)
+        self.lock.release()
+
+    def save(self):
+        """
+        Merges the entries of the current run into the cache and writes it to
+        disk
+        """
+
+        self.lock.acquire()
+        for test_id, entry in self.run.items():
+            if entry is None:
+                self.entries.pop(test_id, None)
+            else:
+                self.entries[test_id] = entry
+        self.run = {}
+        self.lock.release()
+
+        with open(self.path, 'wb') as f:
+            f.write(json.dumps(self.entries).encode('utf-8'))
+
+
+class TestHistory():
+
+    """
+    A run_tests() observer that records the outcome and duration of each test,
+    and uses the history from previous runs to schedule tests. Durations are
+    machine-specific, so the history is kept in the local cache folder rather
+    than the shared coverage database.
+    """
+
+    # The number of durations to keep per test for the average
+    max_durations = 5
+
+    # The duration, in seconds, assumed for tests without a history
+    default_duration = 0.1
+
+    def __init__(self, package_name):
+        """
+        :param package_name:
+            A unicode string of the package name
+        """
+
+        self.path = os.path.join(cache_dir(), '%s.history.json' % package_name)
+        self.lock = threading.Lock()
+        self.start_times = {}
+        self.run = {}
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'rb') as f:
+                    self.entries = json.loads(f.read().decode('utf-8'))
+            except (ValueError):
+                self.entries = {}
+
+    def start_test(self, test):
+        self.start_times[test.id()] = time.time()
+
+    def stop_test(self, test, outcome):
+        test_id = test.id()
+        duration = time.time() - self.start_times.pop(test_id, time.time())
+        self.run[test_id] = {'outcome': outcome, 'duration': duration}
+
+    def update(self, run):
+        """
+        Adds the results of tests run elsewhere, such as in a worker process
+
+        :param run:
+            A dict with unicode string test id keys and dict values with the
+            keys "outcome" and "duration"
+        """
+
+        self.lock.acquire()
+        self.run.update(run)
+        self.lock.release()
+
+    def failed(self, test_id):
+        """
+        :param test_id:
+            A unicode string of a test id
+
+        :return:
+            A boolean - if the test failed or errored the last time it was run
+        """
+
+        entry = self.entries.get(test_id)
+        return entry is not None and entry['outcome'] in set(['failure', 'error', 'timeout'])
+
+    def duration(self, test_id):
+        """
+        :param test_id:
+            A unicode string of a test id
+
+        :return:
+            A float of the average duration of the test, in seconds
+        """
+
+        entry = self.entries.get(test_id)
+        if not entry or not entry['durations']:
+            return self.default_duration
+        return sum(entry['durations']) / len(entry['durations'])
+
+    def total_duration(self):
+        """
+        :return:
+            A float of the sum of the average durations of all known tests
+        """
+
+        return sum([self.duration(test_id) for test_id in self.entries])
+
+    def arrange(self, tests):
+        """
+        An arrange callable for run_tests() that moves tests that failed last
+        time to the front, otherwise keeping the tests grouped by class
+
+        :param tests:
+            A list of unittest.TestCase objects
+
+        :return:
+            A list of unittest.TestCase objects
+        """
+
+        failed = []
+        others = []
+        for test in tests:
+            if self.failed(test.id()):
+                failed.append(test)
+            else:
+                others.append(test)
+        return failed + others
+
+    def save(self):
+        """
+        Merges the results of the current run into the history and writes it
+        to disk
+        """
+
+        self.lock.acquire()
+        for test_id, result in self.run.items():
+            entry = self.entries.setdefault(test_id, {'outcome': None, 'durations': []})
+            entry['outcome'] = result['outcome']
+            # Skipped tests do not have a meaningful duration
+            if result['outcome'] != 'skip':
+                entry['durations'] = (entry['durations'] + [result['duration']])[-self.max_durations:]
+        self.run = {}
+        self.lock.release()
+
+        with open(self.path, 'wb') as f:
+            f.write(json.dumps(self.entries).encode('utf-8'))
+
+
+def lpt_bins(weights, num_bins):
+    """
+    Distributes items into bins so the largest total weight of any bin is
+    small, using the longest-processing-time-first heuristic: items are
+    assigned, heaviest first, to the bin with the smallest total so far
+
+    :param weights:
+        A dict with item keys and numeric weight values
+
+    :param num_bins:
+        An integer of the number of bins
+
+    :return:
+        A list of lists of items, with empty bins omitted
+    """
+
+    heap = [(0, index, []) for index in range(max(1, num_bins))]
+    for item in sorted(weights.keys(), key=lambda item: weights[item], reverse=True):
+        total, index, items = heapq.heappop(heap)
+        items.append(item)
+        heapq.heappush(heap, (total + weights[item], index, items))
+    return [entry[2] for entry in sorted(heap, key=lambda entry: entry[1]) if entry[2]]
+
+
+def shuffled_order(seed):
+    """
+    Creates an arrange callable for run_tests() that shuffles the order of the
+    test classes, and of the tests within each class. Tests stay grouped by
+    class so class fixtures are only set up once.
+
+    :param seed:
+        An integer to seed the random order with, so it can be repeated
+
+    :return:
+        A callable that is passed a list of unittest.TestCase objects, and
+        returns a shuffled list
+    """
+
+    import random
+
+    def arrange(tests):
+        order = random.Random(seed)
+        classes = {}
+        for test in tests:
+            classes.setdefault(test.__class__.__name__, []).append(test)
+        class_names = sorted(classes.keys())
+        order.shuffle(class_names)
+        shuffled = []
+        for class_name in class_names:
+            class_tests = classes[class_name]
+            order.shuffle(class_tests)
+            shuffled.extend(class_tests)
+        return shuffled
+
+    return arrange
+
+
+class SmokeSuite():
+
+    """
+    The subset of a package's tests chosen by the Minimize Suite command,
+    which executes the same lines as the full suite. It is kept in the local
+    cache folder, since it is chosen using the test durations of this machine.
+    """
+
+    def __init__(self, package_name):
+        """
+        :param package_name:
+            A unicode string of the package name
+        """
+
+        self.path = os.path.join(cache_dir(), '%s.smoke_suite.json' % package_name)
+
+    def names(self):
+        """
+        :return:
+            None if no smoke suite has been saved, otherwise a list of unicode
+            strings in the form "ClassName.test_name"
+        """
+
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                entry = json.loads(f.read().decode('utf-8'))
+        except (ValueError):
+            return None
+        return entry['names']
+
+    def save(self, names):
+        """
+        :param names:
+            A list of unicode strings in the form "ClassName.test_name"
+        """
+
+        with open(self.path, 'wb') as f:
+            f.write(json.dumps({'names': names}).encode('utf-8'))
+
+
+def minimize_suite(test_lines, durations):
+    """
+    Chooses a subset of tests that executes every line executed by all of
+    them, using the greedy approximation for weighted set cover: the test
+    that executes the most lines not yet covered per second of duration is
+    chosen, until every line is covered. Tests that later choices made
+    redundant are then removed, slowest first.
+
+    :param test_lines:
+        A dict with unicode string test name keys and values that are dicts
+        of file paths to sets of the line numbers the test executed
+
+    :param durations:
+        A dict with unicode string test name keys and float values of the
+        duration of each test, in seconds
+
+    :return:
+        A sorted list of unicode strings of the chosen test names
+    """
+
+    lines = {}
+    uncovered = set()
+    for name, file_lines in test_lines.items():
+        lines[name] = set()
+        for path, line_numbers in file_lines.items():
+            lines[name].update([(path, line) for line in line_numbers])
+        uncovered.update(lines[name])
+
+    # Tests recorded as taking no time would otherwise have an infinite ratio
+    def cost(name):
+        return max(durations.get(name, 0), 0.001)
+
+    # Since the number of uncovered lines a test executes only ever shrinks,
+    # a test's ratio is only recalculated once it reaches the top of the heap
+    heap = [(-len(lines[name]) / cost(name), name) for name in lines if lines[name]]
+    heapq.heapify(heap)
+    chosen = []
+    while uncovered and heap:
+        ratio, name = heapq.heappop(heap)
+        gain = len(lines[name] & uncovered)
+        if not gain:
+            continue
+        ratio = -gain / cost(name)
+        if heap and ratio > heap[0][0]:
+            heapq.heappush(heap, (ratio, name))
+            continue
+        chosen.append(name)
+        uncovered -= lines[name]
+
+    counts = {}
+    for name in chosen:
+        for line in lines[name]:
+            counts[line] = counts.get(line, 0) + 1
+    for name in sorted(chosen, key=lambda name: (-cost(name), name)):
+        if all([counts[line] > 1 for line in lines[name]]):
+            chosen.remove(name)
+            for line in lines[name]:
+                counts[line] -= 1
+
+    return sorted(chosen)
+
+
+def save_smoke_suite(package_name, tracker, history, result):
+    """
+    Chooses and saves the smoke suite for a package, from a run of every test
+
+    :param package_name:
+        A unicode string of the package name
+
+    :param tracker:
+        The TestCoverageTracker that observed the tests
+
+    :param history:
+        The TestHistory with the durations of the tests
+
+    :param result:
+        The unittest.TestResult object from the run
+
+    :return:
+        A unicode string describing the smoke suite
+    """
+
+    # The lines executed by a failing test may not be executed once it is
+    # fixed, so only passing tests are chosen from
+    failed = set([test.id() for test, _ in result.failures + result.errors])
+    test_lines = {}
+    durations = {}
+    for test_id, file_lines in tracker.lines.items():
+        if test_id in failed:
+            continue
+        name = '.'.join(test_id.split('.')[-2:])
+        test_lines[name] = file_lines
+        durations[name] = history.duration(test_id)
+
+    names = minimize_suite(test_lines, durations)
+    SmokeSuite(package_name).save(names)
+
+    covered = set()
+    for file_lines in test_lines.values():
+        for path, line_numbers in file_lines.items():
+            covered.update([(path, line) for line in line_numbers])
+
+    output = 'Smoke suite of %d of %d tests, executing the same %d lines\n' % (
+        len(names),
+        len(test_lines),
+        len(covered)
+    )
+    output += 'Estimated duration %.2fs, compared to %.2fs for the full suite\n\n' % (
+        sum([durations[name] for name in names]),
+        sum(durations.values())
+    )
+    output += ''.join(['  %s\n' % name for name in names])
+    if failed:
+        output += '\n%d of the tests did not pass, so were left out\n' % len(failed)
+    return output
+
+
+class FlakinessTable():
+
+    """
+    Collects the outcome of each test over repeated runs. A test is flaky
+    once it has both passed and failed. A test that has had the same outcome
+    in every one of required_runs runs is taken to be consistent - if it
+    had a different outcome in at least failure_rate of runs, there would be
+    less than a 1 - confidence chance of not having seen it.
+    """
+
+    def __init__(self, confidence, failure_rate):
+        """
+        :param confidence:
+            A float between 0 and 1 of the confidence required to decide a
+            test is consistent
+
+        :param failure_rate:
+            A float between 0 and 1 of the smallest rate of different
+            outcomes that should be detected
+        """
+
+        confidence = min(max(confidence, 0.01), 0.9999)
+        failure_rate = min(max(failure_rate, 0.0001), 0.99)
+        self.required_runs = int(math.ceil(math.log(1 - confidence) / math.log(1 - failure_rate)))
+        self.results = {}
+
+    def add_run(self, seed, run):
+        """
+        :param seed:
+            An integer of the seed the tests were ordered with
+
+        :param run:
+            A dict with unicode string test id keys and dict values with the
+            key "outcome", from a TestHistory object
+
+        :return:
+            A 2-element tuple of integers of the number of tests that passed
+            and failed
+        """
+
+        passed = 0
+        failed = 0
+        for test_id, result in run.items():
+            # Skipped tests say nothing about flakiness
+            if result['outcome'] == 'skip':
+                continue
+            entry = self.results.setdefault(test_id, {'passed': 0, 'failed': 0, 'failed_seed': None})
+            if result['outcome'] == 'success':
+                entry['passed'] += 1
+                passed += 1
+            else:
+                entry['failed'] += 1
+                if entry['failed_seed'] is None:
+                    entry['failed_seed'] = seed
+                failed += 1
+        return (passed, failed)
+
+    def status(self, test_id):
+        """
+        :param test_id:
+            A unicode string of a test id
+
+        :return:
+            A unicode string of "flaky", "passing", "failing" or "undecided"
+        """
+
+        entry = self.results[test_id]
+        if entry['passed'] and entry['failed']:
+            return 'flaky'
+        if entry['passed'] + entry['failed'] < self.required_runs:
+            return 'undecided'
+        return 'passing' if entry['passed'] else 'failing'
+
+    def is_complete(self):
+        """
+        :return:
+            A boolean - if at least one run has completed and every test has
+            been decided
+        """
+
+        if not self.results:
+            return False
+        for test_id in self.results:
+            if self.status(test_id) == 'undecided':
+                return False
+        return True
+
+    def format(self):
+        """
+        :return:
+            A unicode string of a table of the tests, flaky tests first
+        """
+
+        if not self.results:
+            return 'No tests were run'
+
+        statuses = ['flaky', 'failing', 'undecided', 'passing']
+        test_ids = sorted(
+            self.results.keys(),
+            key=lambda test_id: (statuses.index(self.status(test_id)), test_id)
+        )
+        names = ['.'.join(test_id.split('.')[-2:]) for test_id in test_ids]
+        name_width = max(len('Test'), max([len(name) for name in names]))
+
+        header = '%s  %5s  %6s  %s' % ('Test'.ljust(name_width), 'Runs', 'Failed', 'Status')
+        lines = [header, '-' * len(header)]
+        for test_id, name in zip(test_ids, names):
+            entry = self.results[test_id]
+            status = self.status(test_id)
+            if status == 'flaky':
+                status += ', first failed with --seed %d' % entry['failed_seed']
+            lines.append('%s  %5d  %6d  %s' % (
+                name.ljust(name_width),
+                entry['passed'] + entry['failed'],
+                entry['failed'],
+                status
+            ))
+
+        flaky = len([test_id for test_id in test_ids if self.status(test_id) == 'flaky'])
+        lines.append('')
+        lines.append('%d of %d tests are flaky. Tests are decided after %d runs with the same outcome.' % (
+            flaky,
+            len(test_ids),
+            self.required_runs
+        ))
+        return '\n'.join(lines)
+
+
+def start_coverage(package_dir):
+    """
+    Starts measuring the coverage of the Python files in a package, excluding
+    the dev/ folder
+
+    :param package_dir:
+        A unicode string of the filesystem path to the folder containing the
+        package
+
+    :return:
+        A started coverage.Coverage object
+    """
+
+    cov = create_coverage(package_dir)
+    cov.start()
+    return cov
+
+
+def create_coverage(package_dir, data_file=None):
+    """
+    Creates an object to measure the coverage of the Python files in a
+    package, excluding the dev/ folder
+
+    :param package_dir:
+        A unicode string of the filesystem path to the folder containing the
+        package
+
+    :param data_file:
+        None or a unicode string of the path to use for the coverage data file
+
+    :return:
+        A coverage.Coverage object
+    """
+
+    import coverage
+
+    include_dir = os.path.join(package_dir, '*.py')
+    omit_dir = os.path.join(package_dir, 'dev', '*.py')
+    if sys.platform == 'win32':
+        short_include_dir = create_short_path(os.path.dirname(include_dir))
+        if short_include_dir:
+            include_dir = [include_dir, os.path.join(short_include_dir, '*.py')]
+        short_omit_dir = create_short_path(os.path.dirname(omit_dir))
+        if short_omit_dir:
+            omit_dir = [omit_dir, os.path.join(short_omit_dir, '*.py')]
+    # Depending on the folder launched from with ST2 on Linux, the current
+    # folder seems to have a big impact on how coverage selects code to
+    # measure, and can even lead to measuring stdlib code, but then producing
+    # errors when it can not find the source to said stdlib files. To work
+    # around this, we explicitly enumerate every .py file in the package and
+    # pass then all via include_dir.
+    elif sys.platform not in set(['win32', 'darwin']) and sys.version_info < (3,):
+        include_dir = []
+        for root, dir_names, file_names in os.walk(package_dir):
+            for file_name in file_names:
+                if not file_name.endswith('.py'):
+                    continue
+                include_dir.append(os.path.join(root, file_name))
+    return coverage.Coverage(data_file=data_file, include=include_dir, omit=omit_dir)
+
+
+def format_coverage_report(cov, package_name, package_dir):
+    """
+    Generates the text coverage report for a stopped coverage.Coverage object,
+    with file paths shortened to be relative to the Packages dir
+
+    :param cov:
+        The coverage.Coverage object that measured the package
+
+    :param package_name:
+        A unicode string of the package name
+
+    :param package_dir:
+        A unicode string of the filesystem path to the folder containing the
+        package
+
+    :return:
+        A 2-element tuple of:
+        [0] A unicode string of the report
+        [1] A unicode string of the path prefix the measured files were
+            recorded with, for saving in the coverage database
+    """
+
+    import coverage
+    import coverage.files
+
+    buffer = StringIO()
+    try:
+        cov.report(show_missing=False, file=buffer)
+    except (coverage.CoverageException) as e:
+        # Raised when the tests did not execute any code in the package
+        buffer = StringIO()
+        buffer.write('%s\n' % e)
+
+    output = buffer.getvalue()
+
+    # Coverage shows the files within the working directory relative to it,
+    # so the prefix to replace depends on where Sublime Text or the command
+    # line was started from
+    all_short = False
+    prefixes = [coverage.files.relative_filename(package_dir + os.sep)]
+    short_package_dir = None
+    if sys.platform == 'win32':
+        short_package_dir = create_short_path(package_dir)
+        if short_package_dir:
+            prefixes.append(coverage.files.relative_filename(short_package_dir + os.sep))
+            all_short = True
+    new_root = '.' + os.sep + package_name + os.sep
+    new_output = []
+    for line in output.splitlines():
+        if re.search('\\s+\\d+\\s+\\d+\\s+\\d+%$', line) and not line.startswith('TOTAL'):
+            for possible_prefix in prefixes:
+                if line.startswith(possible_prefix):
+                    line = new_root + line[len(possible_prefix):]
+                    if possible_prefix == prefixes[0]:
+                        all_short = False
+                    break
+        new_output.append(line)
+
+    # Resize the name column to fit the file paths relative to the Packages dir
+    old_length = len(prefixes[-1] if all_short else prefixes[0])
+    change = len(new_root) - old_length
+    for i, line in enumerate(new_output):
+        if line and line == '-' * len(line):
+            new_output[i] = '-' * (len(line) + change)
+            continue
+        match = re.match('(Name|TOTAL)( +)(.*)$', line)
+        if match:
+            spaces = max(2, len(match.group(2)) + change)
+            new_output[i] = match.group(1) + (' ' * spaces) + match.group(3)
+    output = '\n'.join(new_output)
+
+    if all_short:
+        path_prefix = short_package_dir + os.sep
+    else:
+        path_prefix = package_dir + os.sep
+
+    return (output, path_prefix)
+
+
+def result_platform():
+    """
+    :return:
+        A unicode string of the platform to record results for: "windows",
+        "osx" or "linux"
+    """
+
+    return {
+        'win32': 'windows',
+        'darwin': 'osx'
+    }.get(sys.platform, 'linux')
+
+
+def result_python_version():
+    """
+    :return:
+        A unicode string of the major and minor Python version to record
+        results for
+    """
+
+    return '%s.%s' % sys.version_info[0:2]
+
+
+def coverage_record(package_name, cov_data, path_prefix, output):
+    """
+    Creates a dict of the values to save in the coverage_results table for a
+    test run. The git commit info is added by add_git_info().
+
+    :param package_name:
+        A unicode string of the package name
+
+    :param cov_data:
+        The coverage.CoverageData object from the run
+
+    :param path_prefix:
+        A unicode string of the path prefix the measured files were recorded
+        with
+
+    :param output:
+        A unicode string of the output of the tests
+
+    :return:
+        A dict with keys matching the coverage_results columns
+    """
+
+    data_file = StringIO()
+    cov_data.write_fileobj(data_file)
+
+    return {
+        'project': package_name,
+        'commit_hash': None,
+        'commit_summary': None,
+        'commit_date': None,
+        'data': data_file.getvalue(),
+        'platform': result_platform(),
+        'python_version': result_python_version(),
+        'path_prefix': path_prefix,
+        'output': output
+    }
+
+
+def add_git_info(package_dir, record):
+    """
+    Adds the current git commit info to a record from coverage_record()
+
+    :param package_dir:
+        A unicode string of the filesystem path to the folder containing the
+        package
+
+    :param record:
+        A dict from coverage_record()
+
+    :return:
+        A boolean - if the record should be saved in the coverage database
+    """
+
+    commit_info = git_info(package_dir)
+    if commit_info is None:
+        return False
+    record.update(commit_info)
+    return True
+
+
+def git_info(package_dir):
+    """
+    Fetches the current git commit info for a package. Only results from a
+    clean git repository are saved, so if the status can not be fetched or
+    there are modified files, a notice is printed.
+
+    :param package_dir:
+        A unicode string of the filesystem path to the folder containing the
+        package
+
+    :return:
+        None if results should not be saved, otherwise a dict with the keys
+        "commit_hash", "commit_date" and "commit_summary"
+    """
+
+    try:
+        is_clean = is_git_clean(package_dir)
+    except (OSError) as e:
+        print(format_message('''
+            Package Coverage: not saving results to coverage database
+            since an error occurred fetching the git status: %s
+        ''', e.args[0]))
+        return None
+
+    if not is_clean:
+        print(format_message('''
+            Package Coverage: not saving results to coverage database
+            since git repository has modified files
+        '''))
+        return None
+
+    commit_hash, commit_date, summary = git_commit_info(package_dir)
+    return {
+        'commit_hash': commit_hash,
+        'commit_date': commit_date,
+        'commit_summary': summary
+    }
+
+
+COVERAGE_COLUMNS = [
+    'project',
+    'commit_hash',
+    'commit_summary',
+    'commit_date',
+    'data',
+    'platform',
+    'python_version',
+    'path_prefix',
+    'output'
+]
+
+
+def compress_output(output):
+    """
+    Compresses the output of a test run for storage in the coverage database
+
+    :param output:
+        A unicode string of the output
+
+    :return:
+        A sqlite3.Binary object of the zlib-compressed UTF-8 output
+    """
+
+    import sqlite3
+
+    return sqlite3.Binary(zlib.compress(output.encode('utf-8')))
+
+
+def decompress_output(value):
+    """
+    Reads the output column of the coverage database, which is plain text for
+    results saved by older versions
+
+    :param value:
+        A unicode string or byte string from the output column
+
+    :return:
+        A unicode string of the output
+    """
+
+    if isinstance(value, str_cls):
+        return value
+    return zlib.decompress(bytes(value)).decode('utf-8')
+
+
+def save_coverage_results(coverage_database, records):
+    """
+    Inserts test run results into the coverage database in a single
+    transaction
+
+    :param coverage_database:
+        A unicode string of the path to the SQLite coverage database
+
+    :param records:
+        A list of dicts from coverage_record(), with git info added
+    """
+
+    connection = open_database(local_database(coverage_database))
+    try:
+        insert_coverage_results(connection, records)
+    finally:
+        connection.close()
+
+
+def insert_coverage_results(connection, records):
+    """
+    Inserts test run results into the coverage database in a single
+    transaction
+
+    :param connection:
+        A sqlite3.Connection object for the coverage database
+
+    :param records:
+        A list of dicts with keys matching COVERAGE_COLUMNS, with the output
+        as a unicode string
+    """
+
+    sql = 'INSERT INTO coverage_results (%s) VALUES (%s)' % (
+        ', '.join(COVERAGE_COLUMNS),
+        ', '.join(['?'] * len(COVERAGE_COLUMNS))
+    )
+    rows = []
+    for record in records:
+        row = dict(record)
+        row['output'] = compress_output(record['output'])
+        rows.append(tuple([row[column] for column in COVERAGE_COLUMNS]))
+
+    cursor = connection.cursor()
+    cursor.executemany(sql, rows)
+    connection.commit()
+    cursor.close()
+
+
+def format_size(size):
+    """
+    :param size:
+        An integer number of bytes, which may be negative
+
+    :return:
+        A unicode string of the size in B, KB or MB
+    """
+
+    for unit, divisor in [('MB', 1024 * 1024), ('KB', 1024)]:
+        if abs(size) >= divisor:
+            return '%.1f%s' % (size / divisor, unit)
+    return '%dB' % size
+
+
+def format_memory_report(results, previous=None, sites_per_test=3, tests_with_sites=10):
+    """
+    Formats the results of a MemoryProfiler as a table of tests, largest
+    peak first, followed by the top allocation sites of the memory retained
+    by the largest tests
+
+    :param results:
+        A dict from MemoryProfiler.results
+
+    :param previous:
+        None or a 2-element tuple of:
+        [0] A unicode string of the commit hash of the previous run
+        [1] A dict with unicode string test id keys and integer peak values
+
+    :param sites_per_test:
+        The number of allocation sites to list for each test
+
+    :param tests_with_sites:
+        The number of tests, largest peak first, to list the sites for
+
+    :return:
+        A unicode string of the report
+    """
+
+    if not results:
+        return 'No tests were run, so no memory was measured'
+
+    test_ids = sorted(results.keys(), key=lambda test_id: results[test_id]['peak'], reverse=True)
+    names = ['.'.join(test_id.split('.')[-2:]) for test_id in test_ids]
+    name_width = max(len('Test'), max([len(name) for name in names]))
+
+    header = '%s  %10s  %10s' % ('Test'.ljust(name_width), 'Peak', 'Retained')
+    if previous:
+        header += '  %10s' % 'Change'
+    lines = [header, '-' * len(header)]
+
+    for test_id, name in zip(test_ids, names):
+        result = results[test_id]
+        line = '%s  %10s  %10s' % (name.ljust(name_width), format_size(result['peak']), format_size(result['retained']))
+        if previous:
+            previous_peak = previous[1].get(test_id)
+            if previous_peak is None:
+                change = 'new'
+            else:
+                change = format_size(result['peak'] - previous_peak)
+                if result['peak'] > previous_peak:
+                    change = '+' + change
+            line += '  %10s' % change
+        lines.append(line)
+
+    lines.append('')
+    lines.append('Peak includes all memory allocated by the process, retained only that of package code')
+    if previous:
+        lines.append('Change is the difference in peak from the run of commit %s' % previous[0][0:7])
+
+    site_lines = []
+    for test_id, name in zip(test_ids[0:tests_with_sites], names):
+        sites = results[test_id]['sites'][0:sites_per_test]
+        if not sites:
+            continue
+        site_lines.append(name)
+        for site in sites:
+            site_lines.append('  %s:%d  %s in %d blocks' % (
+                site['path'],
+                site['line'],
+                format_size(site['size']),
+                site['count']
+            ))
+
+    if site_lines:
+        lines.extend(['', 'Allocation sites in package code of the memory retained:', ''])
+        lines.extend(site_lines)
+
+    return '\n'.join(lines)
+
+
+def memory_records(package_name, results, git_info):
+    """
+    Creates a list of dicts of the values to save in the memory_results table
+    for a test run
+
+    :param package_name:
+        A unicode string of the package name
+
+    :param results:
+        A dict from MemoryProfiler.results
+
+    :param git_info:
+        A dict that add_git_info() has added the commit info to
+
+    :return:
+        A list of dicts with keys matching MEMORY_COLUMNS
+    """
+
+    run_date = datetime.utcnow()
+
+    records = []
+    for test_id in sorted(results.keys()):
+        result = results[test_id]
+        records.append({
+            'project': package_name,
+            'commit_hash': git_info['commit_hash'],
+            'commit_date': git_info['commit_date'],
+            'platform': result_platform(),
+            'python_version': result_python_version(),
+            'run_date': run_date,
+            'test_id': test_id,
+            'outcome': result['outcome'],
+            'peak': result['peak'],
+            'retained': result['retained'],
+            'sites': json.dumps(result['sites'])
+        })
+    return records
+
+
+MEMORY_COLUMNS = [
+    'project',
+    'commit_hash',
+    'commit_date',
+    'platform',
+    'python_version',
+    'run_date',
+    'test_id',
+    'outcome',
+    'peak',
+    'retained',
+    'sites'
+]
+
+
+def previous_memory_results(coverage_database, package_name):
+    """
+    Fetches the peaks of the most recent memory run of a package on this
+    platform and Python version
+
+    :param coverage_database:
+        A unicode string of the path to the SQLite coverage database
+
+    :param package_name:
+        A unicode string of the package name
+
+    :return:
+        None if there is no previous run, otherwise a 2-element tuple of:
+        [0] A unicode string of the commit hash of the run
+        [1] A dict with unicode string test id keys and integer peak values
+    """
+
+    connection = open_database(readable_database(coverage_database))
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+            SELECT
+                test_id,
+                commit_hash,
+                peak
+            FROM
+                memory_results
+            WHERE
+                project = ?
+                AND platform = ?
+                AND python_version = ?
+                AND run_date = (
+                    SELECT
+                        MAX(run_date)
+                    FROM
+                        memory_results
+                    WHERE
+                        project = ?
+                        AND platform = ?
+                        AND python_version = ?
+                )
+        """, [package_name, result_platform(), result_python_version()] * 2)
+        rows = cursor.fetchall()
+        cursor.close()
+    finally:
+        connection.close()
+
+    if not rows:
+        return None
+    return (rows[0]['commit_hash'], dict([(row['test_id'], row['peak']) for row in rows]))
+
+
+def save_memory_results(coverage_database, records):
+    """
+    Saves the results of a memory run in the coverage database in a single
+    transaction
+
+    :param coverage_database:
+        A unicode string of the path to the SQLite coverage database
+
+    :param records:
+        A list of dicts from memory_records()
+    """
+
+    sql = 'INSERT INTO memory_results (%s) VALUES (%s)' % (
+        ', '.join(MEMORY_COLUMNS),
+        ', '.join(['?'] * len(MEMORY_COLUMNS))
+    )
+    rows = [tuple([record[column] for column in MEMORY_COLUMNS]) for record in records]
+
+    connection = open_database(local_database(coverage_database))
+    try:
+        cursor = connection.cursor()
+        cursor.executemany(sql, rows)
+        connection.commit()
+        cursor.close()
+    finally:
+        connection.close()
+
+
+def run_git(package_dir, args):
+    """
+    Runs a git subcommand in a package directory
+
+    :param package_dir:
+        A unicode string of the filesystem path to the folder containing the
+        package
+
+    :param args:
+        A list of unicode strings of the arguments to pass to git
+
+    :raises:
+        OSError - when git writes anything to stderr
+
+    :return:
+        A unicode string of the output of the command
+    """
+
+    import shellenv
+    import subprocess
+
+    startupinfo = None
+    if sys.platform == 'win32':
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+
+    _, env = shellenv.get_env(for_subprocess=True)
+    proc = subprocess.Popen(
+        ['git'] + args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=env,
+        cwd=package_dir,
+        startupinfo=startupinfo
+    )
+    stdout, stderr = proc.communicate()
+    if stderr:
+        raise OSError(stderr.decode('utf-8').strip())
+    return stdout.decode('utf-8')
+
+
+def git_commit_info(package_dir):
+    """
+    Get the git SHA1 hash, commit date and summary for the current git commit
+
+    :param package_dir:
+        A unicode string of the filesystem path to the folder containing the
+        package
+
+    :return:
+        A tuple containing:
+        [0] A unicode string of the short commit hash
+        [1] A datetime.datetime object of the commit date
+        [2] A unicode string of the commit message summary
+    """
+
+    stdout = run_git(package_dir, ['log', '-n', '1', "--pretty=format:%h %at %s", 'HEAD'])
+    parts = stdout.strip().split(' ', 2)
+    return (parts[0], datetime.utcfromtimestamp(int(parts[1])), parts[2])
+
+
+def is_git_clean(package_dir):
+    """
+    Detects if the git repository is currently all committed
+
+    :param package_dir:
+        A unicode string of the filesystem path to the folder containing the
+        package
+
+    :return:
+        A boolean - if the repository is clean
+    """
+
+    return len(run_git(package_dir, ['status', '--porcelain']).strip()) == 0
+
+
+def format_result_block(title, success, elapsed, output):
+    """
+    Formats the output of a group of tests run in a batch for display as a
+    single block in an output panel
+
+    :param title:
+        A unicode string of the name of the group, such as a package name
+
+    :param success:
+        A boolean - if all of the tests passed
+
+    :param elapsed:
+        A float of the number of seconds the tests took
+
+    :param output:
+        A unicode string of the output of the tests
+
+    :return:
+        A unicode string
+    """
+
+    status = 'OK' if success else 'FAILED'
+    return '%s (%s, %.1fs)\n%s\n%s\n\n' % (
+        title,
+        status,
+        elapsed,
+        '=' * (len(title) + len(status) + 10),
+        output.rstrip()
+    )
+
+
+def worker_timeout(run_timeout):
+    """
+    :param run_timeout:
+        None or the value of the "run_timeout" setting
+
+    :return:
+        None or the number of seconds after which a worker process should be
+        killed. The worker's own watchdog is given time to interrupt or
+        abandon the run first.
+    """
+
+    if not run_timeout:
+        return None
+    return run_timeout + Watchdog.grace_period * 2
+
+
+def default_max_workers():
+    """
+    :return:
+        An integer of the number of worker processes to use when the
+        "max_workers" setting is not set
+    """
+
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 2
+
+
+def can_run_isolated(python_executable):
+    """
+    Determines if tests can be run in separate worker processes, which
+    requires a Python interpreter to run this file with from the command line
+
+    :param python_executable:
+        None or a unicode string of the path to the Python interpreter
+
+    :return:
+        A boolean
+    """
+
+    return bool(python_executable) and os.path.isfile(os.path.abspath(__file__))
+
+
+def requires_ui_thread(package_dir):
+    """
+    Detects if a package's tests use the sublime API, in which case they must
+    be run inside of Sublime Text rather than a worker process
+
+    :param package_dir:
+        A unicode string of the filesystem path to the folder containing the
+        package
+
+    :return:
+        A boolean
+    """
+
+    dev_dir = os.path.join(package_dir, 'dev')
+    for root, dir_names, file_names in os.walk(dev_dir):
+        for file_name in file_names:
+            if not file_name.endswith('.py'):
+                continue
+            with open(os.path.join(root, file_name), 'rb') as f:
+                source = f.read().decode('utf-8', 'replace')
+            if re.search('(?m)^\\s*(import|from)\\s+sublime(_plugin)?\\b', source):
+                return True
+    return False
+
+
+def run_package_isolated(python_executable, package_name, do_coverage, extra_args=None, timeout=None):
+    """
+    Runs the tests for a package in a new Python process, using the command
+    line interface of this file
+
+    :param python_executable:
+        A unicode string of the path to the Python interpreter
+
+    :param package_name:
+        A unicode string of the package name
+
+    :param do_coverage:
+        A boolean - if coverage should be measured
+
+    :param extra_args:
+        None or a list of unicode strings of additional arguments for the
+        "run" command
+
+    :param timeout:
+        None or a number of seconds after which the worker process is killed
+
+    :return:
+        A 3-element tuple of:
+        [0] A boolean - if all of the tests passed
+        [1] A unicode string of the output
+        [2] A dict of the results written by the worker, with the keys
+            "success", "record", "history", "test_cache" and "hung" - empty if
+            the worker failed
+    """
+
+    import shellenv
+    import subprocess
+    import shutil
+    import tempfile
+
+    temp_dir = tempfile.mkdtemp()
+    data_file_path = os.path.join(temp_dir, 'results.json')
+
+    args = [
+        python_executable,
+        os.path.abspath(__file__),
+        '--packages-path',
+        sublime.packages_path(),
+        'run',
+        package_name,
+        '--data-file',
+        data_file_path
+    ]
+    if do_coverage:
+        args.append('--coverage')
+    if extra_args:
+        args.extend(extra_args)
+
+    startupinfo = None
+    if sys.platform == 'win32':
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+
+    _, env = shellenv.get_env(for_subprocess=True)
+    try:
+        proc = subprocess.Popen(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=env,
+            cwd=temp_dir,
+            startupinfo=startupinfo
+        )
+        killed = []
+        timer = None
+        if timeout:
+            def kill():
+                killed.append(True)
+                proc.kill()
+
+            timer = threading.Timer(timeout, kill)
+            timer.daemon = True
+            timer.start()
+
+        # The output is read incrementally so a worker printing a large
+        # amount of text does not have it all held in memory
+        capture = OutputCapture()
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        while True:
+            chunk = proc.stdout.read(8192)
+            if not chunk:
+                break
+            capture.write(decoder.decode(chunk))
+        capture.write(decoder.decode(b'', True))
+        capture.close()
+        proc.wait()
+        if timer:
+            timer.cancel()
+        output = capture.getvalue()
+        if killed:
+            output += '\nThe worker process was killed after %s seconds\n' % timeout
+
+        if not os.path.exists(data_file_path):
+            return (False, output, {})
+        with open(data_file_path, 'rb') as f:
+            results = json.loads(f.read().decode('utf-8'))
+
+    except (OSError, ValueError) as e:
+        return (False, 'Error running worker process: %s' % e, {})
+
+    finally:
+        shutil.rmtree(temp_dir)
+
+    return (results['success'], output, results)
+
+
+def run_package_in_process(package_name, do_coverage, test_timeout=None, run_timeout=None, queue=None,
+                           name_pattern=None, on_hang=None, class_names=None, test_names=None):
+    """
+    Runs the tests for a package in the current thread
+
+    :param package_name:
+        A unicode string of the package name
+
+    :param do_coverage:
+        A boolean - if coverage should be measured
+
+    :param test_timeout:
+        None or a number of seconds after which a test is interrupted
+
+    :param run_timeout:
+        None or a number of seconds after which the run is interrupted
+
+    :param queue:
+        None or an OutputCapture object to write the output to as the tests
+        run
+
+    :param name_pattern:
+        None or a re._pattern_type object for matching test names against
+
+    :param on_hang:
+        None or a callback for the Watchdog if a test does not stop after
+        timing out
+
+    :param class_names:
+        None or a list of unicode strings of the names of the test classes to
+        run
+
+    :param test_names:
+        None or a list of unicode strings in the form "ClassName.test_name"
+        of the tests to run
+
+    :return:
+        A 3-element tuple of:
+        [0] A boolean - if all of the tests passed
+        [1] A unicode string of the output
+        [2] None or a dict from coverage_record()
+    """
+
+    package_dir = os.path.join(sublime.packages_path(), package_name)
+    if queue is None:
+        queue = OutputCapture()
+    results = []
+    history = TestHistory(package_name)
+    watchdog = None
+
+    cov = start_coverage(package_dir) if do_coverage else None
+    try:
+        tests_module = load_tests_module(package_name, package_dir)
+        observers = [history]
+        if test_timeout or run_timeout:
+            watchdog = Watchdog(queue, test_timeout, run_timeout, on_hang)
+            observers.append(watchdog)
+        run_tests(
+            tests_module,
+            queue,
+            name_pattern,
+            results.append,
+            observers=observers,
+            arrange=history.arrange,
+            class_names=class_names,
+            test_names=test_names
+        )
+        if watchdog:
+            watchdog.stop()
+        history.save()
+    except (Exception):
+        queue.write(traceback.format_exc())
+    finally:
+        if cov:
+            cov.stop()
+
+    path_prefix = None
+    if cov and results:
+        report, path_prefix = format_coverage_report(cov, package_name, package_dir)
+        queue.write('\n' + report)
+
+    queue.close()
+    output = queue.getvalue()
+    success = len(results) == 1 and results[0].wasSuccessful()
+
+    record = None
+    if path_prefix is not None:
+        record = coverage_record(package_name, cov.get_data(), path_prefix, output)
+
+    return (success, output, record)
+
+
+class WarmWorker():
+
+    """
+    A long-lived worker process that runs the tests for one package each time
+    it is sent a request, so that the cost of starting Python and importing
+    coverage is only paid once. Each request reloads the package the same way
+    a run inside of Sublime Text does.
+
+    Requests and responses are JSON objects, one per line. The worker sends
+    {"output": text} while the tests run, followed by {"done": results}.
+    """
+
+    def __init__(self, python_executable, package_name):
+        """
+        :param python_executable:
+            A unicode string of the path to the Python interpreter
+
+        :param package_name:
+            A unicode string of the package name
+        """
+
+        import shellenv
+        import subprocess
+        import tempfile
+
+        self.lock = threading.Lock()
+        self.temp_dir = tempfile.mkdtemp()
+
+        args = [
+            python_executable,
+            os.path.abspath(__file__),
+            '--packages-path',
+            sublime.packages_path(),
+            'serve',
+            package_name
+        ]
+
+        startupinfo = None
+        if sys.platform == 'win32':
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+
+        _, env = shellenv.get_env(for_subprocess=True)
+        self.proc = subprocess.Popen(
+            args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=env,
+            cwd=self.temp_dir,
+            startupinfo=startupinfo
+        )
+
+    def is_alive(self):
+        return self.proc.poll() is None
+
+    def run(self, request, on_output, timeout=None):
+        """
+        Sends a request to the worker and waits for the results
+
+        :param request:
+            A dict with the keys "do_coverage", "name_pattern", "class_names",
+            "test_names", "test_timeout" and "run_timeout"
+
+        :param on_output:
+            A callback that is passed each unicode string of output
+
+        :param timeout:
+            None or a number of seconds after which the worker is killed
+
+        :return:
+            None if the worker exited, otherwise a dict with the keys
+            "success", "record" and "hung"
+        """
+
+        self.lock.acquire()
+        timer = None
+        try:
+            self.proc.stdin.write((json.dumps(request) + '\n').encode('utf-8'))
+            self.proc.stdin.flush()
+
+            if timeout:
+                timer = threading.Timer(timeout, self.proc.kill)
+                timer.daemon = True
+                timer.start()
+
+            while True:
+                line = self.proc.stdout.readline()
+                if not line:
+                    return None
+                line = line.decode('utf-8', 'replace')
+                try:
+                    message = json.loads(line)
+                except (ValueError):
+                    # Anything written directly to the file descriptors, such
+                    # as by an extension module, is passed through as output
+                    on_output(line)
+                    continue
+                if 'done' in message:
+                    return message['done']
+                on_output(message['output'])
+
+        except (IOError, OSError):
+            return None
+
+        finally:
+            if timer:
+                timer.cancel()
+            self.lock.release()
+
+    def stop(self):
+        """
+        Ends the worker process
+        """
+
+        import shutil
+
+        if self.is_alive():
+            try:
+                self.proc.stdin.close()
+                self.proc.wait()
+            except (IOError, OSError):
+                self.proc.kill()
+        shutil.rmtree(self.temp_dir, True)
+
+
+def get_warm_worker(python_executable, package_name):
+    """
+    Returns the warm worker for a package, starting a new one if there is not
+    one running
+
+    :param python_executable:
+        A unicode string of the path to the Python interpreter
+
+    :param package_name:
+        A unicode string of the package name
+
+    :return:
+        A WarmWorker object
+    """
+
+    key = (python_executable, package_name)
+    warm_workers_lock.acquire()
+    try:
+        worker = warm_workers.get(key)
+        if worker is None or not worker.is_alive():
+            if worker is not None:
+                worker.stop()
+            worker = WarmWorker(python_executable, package_name)
+            warm_workers[key] = worker
+            save_warm_packages(package_name)
+        return worker
+    finally:
+        warm_workers_lock.release()
+
+
+def warm_packages_path():
+    """
+    :return:
+        A unicode string of the path to the list of packages that have had a
+        warm worker, which are started again when the plugin is loaded
+    """
+
+    return os.path.join(cache_dir(), 'warm_workers.json')
+
+
+def load_warm_packages():
+    """
+    :return:
+        A list of unicode strings of the names of packages that have had a
+        warm worker
+    """
+
+    path = warm_packages_path()
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'rb') as f:
+            return json.loads(f.read().decode('utf-8'))
+    except (ValueError):
+        return []
+
+
+def save_warm_packages(package_name):
+    """
+    Adds a package to the list of packages that have had a warm worker. Must
+    be called with warm_workers_lock held.
+
+    :param package_name:
+        A unicode string of the package name
+    """
+
+    package_names = load_warm_packages()
+    if package_name in package_names:
+        return
+    package_names.append(package_name)
+    with open(warm_packages_path(), 'wb') as f:
+        f.write(json.dumps(package_names).encode('utf-8'))
+
+
+def start_warm_workers():
+    """
+    Starts the warm workers for the packages that had one before Sublime Text
+    was restarted, if enabled via the "warm_worker" setting
+
+    RUNS IN A THREAD
+    """
+
+    settings = sublime.load_settings('Package Coverage.sublime-settings')
+    python_executable = settings.get('python_executable')
+    if not settings.get('warm_worker', False) or not can_run_isolated(python_executable):
+        return
+
+    for package_name in load_warm_packages():
+        package_dir = os.path.join(sublime.packages_path(), package_name)
+        if not os.path.isdir(package_dir) or requires_ui_thread(package_dir):
+            continue
+        try:
+            get_warm_worker(python_executable, package_name)
+        except (OSError) as e:
+            print('Package Coverage: error starting warm worker for %s: %s' % (package_name, e))
+
+
+def stop_warm_workers():
+    """
+    Ends all of the warm worker processes
+    """
+
+    warm_workers_lock.acquire()
+    try:
+        for worker in warm_workers.values():
+            worker.stop()
+        warm_workers.clear()
+    finally:
+        warm_workers_lock.release()
+
+
+class WorkerOutput(OutputCapture):
+
+    """
+    An OutputCapture that also sends each write to the parent process of a
+    warm worker
+    """
+
+    def __init__(self, pipe):
+        """
+        :param pipe:
+            A binary file object connected to the parent process
+        """
+
+        OutputCapture.__init__(self)
+        self.pipe = pipe
+
+    def write(self, data):
+        self.pipe.write((json.dumps({'output': data}) + '\n').encode('utf-8'))
+        self.pipe.flush()
+        return OutputCapture.write(self, data)
+
+
+def serve_package(package_name):
+    """
+    Runs the requests of a WarmWorker until stdin is closed. Output written to
+    sys.stdout and sys.stderr by tests is sent to the parent.
+
+    :param package_name:
+        A unicode string of the package name
+    """
+
+    pipe = getattr(sys.stdout, 'buffer', sys.stdout)
+    original_streams = (sys.stdout, sys.stderr)
+
+    # The package is loaded before the first request arrives, so the first
+    # run is as fast as later ones
+    sys.stdout = sys.stderr = StringIO()
+    try:
+        package_dir = os.path.join(sublime.packages_path(), package_name)
+        create_coverage(package_dir)
+        load_tests_module(package_name, package_dir)
+    except (Exception):
+        # The error will be displayed when the tests are run
+        pass
+    finally:
+        sys.stdout, sys.stderr = original_streams
+
+    def send_done(results):
+        pipe.write((json.dumps({'done': results}) + '\n').encode('utf-8'))
+        pipe.flush()
+
+    # The thread running the tests can not be stopped, so the worker exits and
+    # is replaced by the parent on the next run
+    def exit_hung(test):
+        send_done({'success': False, 'record': None, 'hung': True})
+        os._exit(1)
+
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        request = json.loads(line)
+
+        output = WorkerOutput(pipe)
+        sys.stdout = sys.stderr = output
+        try:
+            name_pattern = request['name_pattern']
+            success, _, record = run_package_in_process(
+                package_name,
+                request['do_coverage'],
+                request['test_timeout'],
+                request['run_timeout'],
+                queue=output,
+                name_pattern=re.compile(name_pattern) if name_pattern is not None else None,
+                on_hang=exit_hung,
+                class_names=request['class_names'],
+                test_names=request['test_names']
+            )
+        finally:
+            sys.stdout, sys.stderr = original_streams
+
+        send_done({'success': success, 'record': record, 'hung': False})
+
+
+def git_changed_lines(package_dir, old_commit, new_commit):
+    """
+    Finds the lines of Python source that were added or changed between two
+    commits
+
+    :param package_dir:
+        A unicode string of the filesystem path to the folder containing the
+        package
+
+    :param old_commit:
+        A unicode string of the git SHA1 hash of the base commit
+
+    :param new_commit:
+        A unicode string of the git SHA1 hash of the newer commit
+
+    :return:
+        A dict with unicode string keys of absolute file paths and values that
+        are sets of integer line numbers in the newer commit
+    """
+
+    stdout = run_git(
+        package_dir,
+        ['diff', '--no-color', '--no-ext-diff', '--relative', '-U0', old_commit, new_commit, '--', '*.py']
+    )
+
+    changed = {}
+    current_lines = None
+    for line in stdout.splitlines():
+        if line.startswith('+++ '):
+            current_lines = None
+            path = line[4:]
+            if path != '/dev/null':
+                # Strip the "b/" prefix git adds to the new file name
+                path = re.sub('^b/', '', path)
+                file_path = os.path.join(package_dir, os.path.normpath(path))
+                current_lines = changed.setdefault(file_path, set())
+            continue
+
+        match = re.match('^@@ -\\d+(?:,\\d+)? \\+(\\d+)(?:,(\\d+))? @@', line)
+        if match and current_lines is not None:
+            start = int(match.group(1))
+            count = int(match.group(2)) if match.group(2) is not None else 1
+            current_lines.update(range(start, start + count))
+
+    return changed
+
+
+def is_shard_directory(coverage_database):
+    """
+    Determines if the coverage database setting is a folder of per-machine
+    shards, rather than a single SQLite file. A path ending in a slash is a
+    folder, even before it has been created.
+
+    :param coverage_database:
+        A unicode string of the coverage_database setting
+
+    :return:
+        A boolean
+    """
+
+    return coverage_database.endswith(('/', os.sep)) or os.path.isdir(coverage_database)
+
+
+def local_database(coverage_database):
+    """
+    Returns the SQLite file that results from this machine are written to.
+    With a folder of shards, each machine only writes to its own file, so
+    machines syncing the folder never modify the same file.
+
+    :param coverage_database:
+        A unicode string of the coverage_database setting
+
+    :return:
+        A unicode string of the path to a SQLite file
+    """
+
+    if not is_shard_directory(coverage_database):
+        return coverage_database
+
+    import socket
+
+    if not os.path.exists(coverage_database):
+        os.makedirs(coverage_database)
+    machine_name = re.sub('[^A-Za-z0-9_.-]+', '_', socket.gethostname()) or 'machine'
+    return os.path.join(coverage_database, '%s.sqlite' % machine_name)
+
+
+def list_shards(coverage_database):
+    """
+    :param coverage_database:
+        A unicode string of the path to a folder of shards
+
+    :return:
+        A dict with unicode string shard file name keys and values of a
+        2-element tuple of the float mtime and integer size of the file
+    """
+
+    shards = {}
+    if not os.path.isdir(coverage_database):
+        return shards
+    for file_name in os.listdir(coverage_database):
+        if not file_name.endswith('.sqlite'):
+            continue
+        stat = os.stat(os.path.join(coverage_database, file_name))
+        shards[file_name] = (stat.st_mtime, stat.st_size)
+    return shards
+
+
+def database_mtime(coverage_database):
+    """
+    :param coverage_database:
+        A unicode string of the coverage_database setting
+
+    :return:
+        A float of the last time any results were written to the database
+    """
+
+    if not is_shard_directory(coverage_database):
+        return os.stat(coverage_database).st_mtime
+    return max([mtime for mtime, _ in list_shards(coverage_database).values()] or [0])
+
+
+def readable_database(coverage_database):
+    """
+    Returns the SQLite file to read results from. With a folder of shards,
+    the results of every shard are combined into a file in the cache folder.
+    Each shard is attached in turn and its new rows copied, but only when the
+    shard has been modified since it was last copied.
+
+    :param coverage_database:
+        A unicode string of the coverage_database setting
+
+    :return:
+        A unicode string of the path to a SQLite file
+    """
+
+    if not is_shard_directory(coverage_database):
+        return coverage_database
+
+    import sqlite3
+
+    key = hashlib.sha1(os.path.realpath(coverage_database).encode('utf-8')).hexdigest()[0:12]
+    merged_database = os.path.join(cache_dir(), 'shards-%s.sqlite' % key)
+
+    shard_lock.acquire()
+    connection = open_database(merged_database)
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS shards (
+                name varchar PRIMARY KEY,
+                mtime real NOT NULL,
+                size integer NOT NULL
+            )
+        """)
+        for table_name in ['coverage_results', 'memory_results']:
+            cursor.execute('PRAGMA table_info(%s)' % table_name)
+            column_names = [row['name'] for row in cursor.fetchall()]
+            for column_name, column_type in [('shard', 'varchar'), ('shard_id', 'integer')]:
+                if column_name not in column_names:
+                    cursor.execute('ALTER TABLE %s ADD COLUMN %s %s' % (table_name, column_name, column_type))
+        connection.commit()
+
+        cursor.execute('SELECT name, mtime, size FROM shards')
+        copied = dict([(row['name'], (row['mtime'], row['size'])) for row in cursor.fetchall()])
+        current = list_shards(coverage_database)
+
+        for name in set(copied) - set(current):
+            cursor.execute('DELETE FROM coverage_results WHERE shard = ?', (name,))
+            cursor.execute('DELETE FROM memory_results WHERE shard = ?', (name,))
+            cursor.execute('DELETE FROM shards WHERE name = ?', (name,))
+            connection.commit()
+
+        for name in sorted(current):
+            if copied.get(name) == current[name]:
+                continue
+            try:
+                copy_shard(connection, os.path.join(coverage_database, name), name, current[name])
+            except (sqlite3.DatabaseError) as e:
+                # A shard may be partially synced, so it is tried again later
+                connection.rollback()
+                print(format_message(
+                    '''
+                    Package Coverage: unable to read results from shard %s - %s
+                    ''',
+                    (name, e)
+                ))
+            finally:
+                cursor.execute('PRAGMA database_list')
+                if 'shard' in [row['name'] for row in cursor.fetchall()]:
+                    cursor.execute('DETACH DATABASE shard')
+        cursor.close()
+
+    finally:
+        connection.close()
+        shard_lock.release()
+
+    return merged_database
+
+
+def copy_shard(connection, shard_path, name, stat):
+    """
+    Updates the rows copied from a shard to match its current rows, in a
+    single transaction. Rows already copied are kept, so their ids in the
+    combined database do not change, which incremental exports and the
+    report fingerprints rely on. Each row records the id it has in the shard.
+
+    :param connection:
+        A sqlite3.Connection object for the combined database
+
+    :param shard_path:
+        A unicode string of the path to the shard
+
+    :param name:
+        A unicode string of the shard file name
+
+    :param stat:
+        A 2-element tuple of the float mtime and integer size of the shard
+    """
+
+    cursor = connection.cursor()
+    cursor.execute('ATTACH DATABASE ? AS shard', (shard_path,))
+    cursor.execute("SELECT name FROM shard.sqlite_master WHERE type = 'table'")
+    shard_tables = set([row['name'] for row in cursor.fetchall()])
+
+    for table_name, columns in [('coverage_results', COVERAGE_COLUMNS), ('memory_results', MEMORY_COLUMNS)]:
+        if table_name not in shard_tables:
+            cursor.execute('DELETE FROM main.%s WHERE shard = ?' % table_name, (name,))
+            continue
+
+        # Rows deleted from the shard, such as by Maintain Database, are
+        # deleted here too
+        cursor.execute(
+            """
+                DELETE FROM main.%s
+                WHERE shard = ? AND (shard_id IS NULL OR shard_id NOT IN (SELECT id FROM shard.%s))
+            """ % (table_name, table_name),
+            (name,)
+        )
+        cursor.execute('SELECT MAX(shard_id) AS last_id FROM main.%s WHERE shard = ?' % table_name, (name,))
+        last_id = cursor.fetchone()['last_id'] or 0
+        cursor.execute(
+            'INSERT INTO main.%s (%s, shard, shard_id) SELECT %s, ?, id FROM shard.%s WHERE id > ? ORDER BY id' % (
+                table_name,
+                ', '.join(columns),
+                ', '.join(columns),
+                table_name
+            ),
+            (name, last_id)
+        )
+    cursor.execute('INSERT OR REPLACE INTO shards (name, mtime, size) VALUES (?, ?, ?)', (name,) + tuple(stat))
+    connection.commit()
+    cursor.close()
+
+
+def open_database(coverage_database):
+    """
+    Opens and, if needed, initializes the coverage database for saving results
+
+    :param coverage_database:
+        A unicode string of the path to the sqlite file to use as the database
+
+    :return:
+        A Python sqlite3.Connection object
+    """
+
+    import sqlite3
+
+    connection = sqlite3.connect(coverage_database, detect_types=sqlite3.PARSE_DECLTYPES)
+    connection.row_factory = sqlite3.Row
+
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT
+            name
+        FROM
+            sqlite_master
+        WHERE
+            type = 'table'
+    """)
+    table_names = set([row['name'] for row in cursor.fetchall()])
+    # Tables added by later versions are created in existing databases too
+    for table_name, sql_file in [('coverage_results', 'coverage.sql'), ('memory_results', 'memory.sql')]:
+        if table_name in table_names:
+            continue
+        if sys.version_info >= (3,):
+            sql_bytes = sublime.load_binary_resource('Packages/Package Coverage/%s' % sql_file)
+        else:
+            dirname = os.path.dirname(__file__)
+            with open(os.path.join(dirname, sql_file), 'rb') as f:
+                sql_bytes = f.read()
+        sql = sql_bytes.decode('utf-8')
+        cursor.execute(sql)
+    cursor.close()
+
+    return connection
+
+
+def maintain_database(coverage_database, retention_days, retention_commits, queue):
+    """
+    Removes duplicate results, and results outside of the retention limits,
+    from the coverage database, then compacts it. Rows are deleted in small
+    transactions so that other machines syncing the database are not locked
+    out for long. With a folder of shards, only this machine's shard is
+    maintained.
+
+    RUNS IN A THREAD
+
+    :param coverage_database:
+        A unicode string of the path to the SQLite coverage database
+
+    :param retention_days:
+        None or an integer of the number of days of results to keep, based on
+        the commit date
+
+    :param retention_commits:
+        None or an integer of the number of most recent commits of each
+        package to keep results for
+
+    :param queue:
+        A StringQueue object to write progress to
+    """
+
+    import sqlite3
+
+    try:
+        database_path = local_database(coverage_database)
+        size_before = os.path.getsize(database_path) if os.path.exists(database_path) else 0
+        connection = open_database(database_path)
+        try:
+            ids = find_duplicate_results(connection)
+            queue.write('Removing %d duplicate results\n' % len(ids))
+            delete_results(connection, ids)
+
+            if retention_days:
+                ids = find_expired_results(connection, retention_days)
+                queue.write('Removing %d results older than %s days\n' % (len(ids), retention_days))
+                delete_results(connection, ids)
+
+            if retention_commits:
+                ids = find_old_commit_results(connection, retention_commits)
+                queue.write('Removing %d results not from the last %s commits\n' % (len(ids), retention_commits))
+                delete_results(connection, ids)
+
+            queue.write('Compacting and analyzing the database\n')
+            connection.execute("""
+                CREATE INDEX IF NOT EXISTS
+                    coverage_results_project_commit_hash
+                ON
+                    coverage_results (project, commit_hash)
+            """)
+            connection.commit()
+            connection.execute('VACUUM')
+            connection.execute('ANALYZE')
+        finally:
+            connection.close()
+
+        size_after = os.path.getsize(database_path)
+        queue.write('\nDatabase size reduced from %.1fMB to %.1fMB' % (
+            size_before / 1048576.0,
+            size_after / 1048576.0
+        ))
+
+    except (sqlite3.Error) as e:
+        queue.write('\nError maintaining the database: %s' % e)
+
+    finally:
+        queue.write('\x04')
+
+
+def find_duplicate_results(connection):
+    """
+    Finds results with the same data as an earlier result for the same commit,
+    platform and Python version. Only a hash of each row is kept in memory.
+
+    :param connection:
+        A sqlite3.Connection object for the coverage database
+
+    :return:
+        A list of integer ids of the newer copies
+    """
+
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT
+            id,
+            project,
+            commit_hash,
+            platform,
+            python_version,
+            data
+        FROM
+            coverage_results
+        ORDER BY
+            id
+    """)
+
+    seen = set()
+    ids = []
+    for row in cursor:
+        key = result_key(row['project'], row['commit_hash'], row['platform'], row['python_version'], row['data'])
+        if key in seen:
+            ids.append(row['id'])
+        else:
+            seen.add(key)
+    cursor.close()
+    return ids
+
+
+def find_expired_results(connection, retention_days):
+    """
+    :param connection:
+        A sqlite3.Connection object for the coverage database
+
+    :param retention_days:
+        An integer of the number of days of results to keep
+
+    :return:
+        A list of integer ids of results with a commit date before the
+        retention window
+    """
+
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT
+            id
+        FROM
+            coverage_results
+        WHERE
+            commit_date < datetime('now', ?)
+    """, ('-%d days' % int(retention_days),))
+    ids = [row['id'] for row in cursor]
+    cursor.close()
+    return ids
+
+
+def find_old_commit_results(connection, retention_commits):
+    """
+    :param connection:
+        A sqlite3.Connection object for the coverage database
+
+    :param retention_commits:
+        An integer of the number of most recent commits of each package to
+        keep results for
+
+    :return:
+        A list of integer ids of results for older commits
+    """
+
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT
+            project,
+            commit_hash
+        FROM
+            coverage_results
+        GROUP BY
+            project,
+            commit_hash
+        ORDER BY
+            project,
+            MAX(commit_date) DESC
+    """)
+    old_commits = []
+    counts = {}
+    for row in cursor:
+        project = row['project']
+        counts[project] = counts.get(project, 0) + 1
+        if counts[project] > retention_commits:
+            old_commits.append((project, row['commit_hash']))
+
+    ids = []
+    for project, commit_hash in old_commits:
+        cursor.execute("""
+            SELECT
+                id
+            FROM
+                coverage_results
+            WHERE
+                project = ?
+                AND commit_hash = ?
+        """, (project, commit_hash))
+        ids.extend([row['id'] for row in cursor])
+    cursor.close()
+    return ids
+
+
+def delete_results(connection, ids, chunk_size=500):
+    """
+    Deletes rows from the coverage_results table, committing after each chunk
+
+    :param connection:
+        A sqlite3.Connection object for the coverage database
+
+    :param ids:
+        A list of integer ids of the rows to delete
+
+    :param chunk_size:
+        The number of rows to delete per transaction - must be less than the
+        SQLite limit of 999 parameters
+    """
+
+    cursor = connection.cursor()
+    for offset in range(0, len(ids), chunk_size):
+        chunk = ids[offset:offset + chunk_size]
+        sql = 'DELETE FROM coverage_results WHERE id IN (%s)' % ', '.join(['?'] * len(chunk))
+        cursor.execute(sql, chunk)
+        connection.commit()
+    cursor.close()
+
+
+# The format identifier written at the start of each export to an archive
+ARCHIVE_FORMAT = 'package-coverage-results'
+
+
+def result_key(project, commit_hash, platform, python_version, data):
+    """
+    Creates a key that is the same for results that are duplicates of each
+    other
+
+    :param project:
+        A unicode string of the package name
+
+    :param commit_hash:
+        A unicode string of the git SHA1 hash of the commit
+
+    :param platform:
+        A unicode string of the platform the tests were run on
+
+    :param python_version:
+        A unicode string of the Python version the tests were run with
+
+    :param data:
+        A unicode string or byte string of the serialized coverage data
+
+    :return:
+        A unicode string of a SHA1 hash
+    """
+
+    hasher = hashlib.sha1()
+    for value in [project, commit_hash, platform, python_version]:
+        hasher.update(('%s\n' % value).encode('utf-8'))
+    hasher.update(data.encode('utf-8') if isinstance(data, str_cls) else bytes(data))
+    return hasher.hexdigest()
+
+
+def export_results(connection, archive_path, package_name=None, since_id=0):
+    """
+    Appends results from the coverage database to an archive. An archive is a
+    gzip file of JSON objects, one per line. Each export is appended as a new
+    gzip member, so an archive is never rewritten.
+
+    :param connection:
+        A sqlite3.Connection object for the coverage database
+
+    :param archive_path:
+        A unicode string of the path to the archive
+
+    :param package_name:
+        None to export the results for all packages, otherwise a unicode
+        string of the package to export the results for
+
+    :param since_id:
+        An integer - only results with a greater id are exported
+
+    :return:
+        A 2-element tuple of:
+        [0] An integer of the number of results exported
+        [1] An integer of the greatest id exported, or since_id
+    """
+
+    import gzip
+
+    sql = 'SELECT id, %s FROM coverage_results WHERE id > ?' % ', '.join(COVERAGE_COLUMNS)
+    params = [since_id]
+    if package_name:
+        sql += ' AND project = ?'
+        params.append(package_name)
+    sql += ' ORDER BY id'
+
+    cursor = connection.cursor()
+    cursor.execute(sql, params)
+
+    count = 0
+    max_id = since_id
+    archive = None
+    try:
+        for row in cursor:
+            if archive is None:
+                archive = gzip.open(archive_path, 'ab')
+                header = {'format': ARCHIVE_FORMAT, 'version': 1, 'platform': sys.platform}
+                archive.write((json.dumps(header) + '\n').encode('utf-8'))
+            record = {}
+            for column in COVERAGE_COLUMNS:
+                record[column] = row[column]
+            data = record['data']
+            if not isinstance(data, str_cls):
+                record['data'] = bytes(data).decode('utf-8')
+            # This is the same format the sqlite3 module stores timestamps in,
+            # so the string is inserted as-is when importing
+            record['commit_date'] = str_cls(record['commit_date'])
+            record['output'] = decompress_output(record['output'])
+            archive.write((json.dumps(record) + '\n').encode('utf-8'))
+            count += 1
+            max_id = row['id']
+    finally:
+        if archive is not None:
+            archive.close()
+        cursor.close()
+
+    return (count, max_id)
+
+
+def import_results(connection, archive_path, batch_size=1000):
+    """
+    Inserts the results from an archive into the coverage database, skipping
+    results that are already in the database
+
+    :param connection:
+        A sqlite3.Connection object for the coverage database
+
+    :param archive_path:
+        A unicode string of the path to the archive
+
+    :param batch_size:
+        The number of results to insert per transaction
+
+    :return:
+        A 2-element tuple of:
+        [0] An integer of the number of results imported
+        [1] An integer of the number of duplicate results skipped
+    """
+
+    import gzip
+
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT
+            project,
+            commit_hash,
+            platform,
+            python_version,
+            data
+        FROM
+            coverage_results
+    """)
+    seen = set()
+    for row in cursor:
+        seen.add(result_key(row['project'], row['commit_hash'], row['platform'], row['python_version'], row['data']))
+    cursor.close()
+
+    imported = 0
+    skipped = 0
+    batch = []
+    archive = gzip.open(archive_path, 'rb')
+    try:
+        for line in archive:
+            line = line.decode('utf-8').strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if 'format' in record:
+                if record['format'] != ARCHIVE_FORMAT:
+                    raise ValueError('%s is not a Package Coverage archive' % archive_path)
+                continue
+
+            key = result_key(
+                record['project'],
+                record['commit_hash'],
+                record['platform'],
+                record['python_version'],
+                record['data']
+            )
+            if key in seen:
+                skipped += 1
+                continue
+            seen.add(key)
+
+            batch.append(record)
+            if len(batch) >= batch_size:
+                insert_coverage_results(connection, batch)
+                imported += len(batch)
+                batch = []
+    finally:
+        archive.close()
+
+    if batch:
+        insert_coverage_results(connection, batch)
+        imported += len(batch)
+
+    return (imported, skipped)
+
+
+class ExportState():
+
+    """
+    Remembers the greatest result id exported from each database to each
+    archive, so that exporting to the same archive again only appends new
+    results
+    """
+
+    def __init__(self):
+        self.path = os.path.join(cache_dir(), 'exports.json')
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'rb') as f:
+                    self.entries = json.loads(f.read().decode('utf-8'))
+            except (ValueError):
+                self.entries = {}
+
+    def key(self, coverage_database, archive_path, package_name):
+        return '%s|%s|%s' % (
+            os.path.realpath(coverage_database),
+            os.path.realpath(archive_path),
+            package_name or ''
+        )
+
+    def last_id(self, coverage_database, archive_path, package_name):
+        """
+        :return:
+            An integer of the greatest id exported, or 0 if the archive does
+            not exist or nothing has been exported to it
+        """
+
+        if not os.path.exists(archive_path):
+            return 0
+        return self.entries.get(self.key(coverage_database, archive_path, package_name), 0)
+
+    def save(self, coverage_database, archive_path, package_name, last_id):
+        self.entries[self.key(coverage_database, archive_path, package_name)] = last_id
+        with open(self.path, 'wb') as f:
+            f.write(json.dumps(self.entries).encode('utf-8'))
+
+
+def export_archive(coverage_database, archive_path, package_name, queue):
+    """
+    Exports new results to an archive and writes a summary to the queue
+
+    RUNS IN A THREAD
+
+    :param coverage_database:
+        A unicode string of the path to the SQLite coverage database
+
+    :param archive_path:
+        A unicode string of the path to the archive
+
+    :param package_name:
+        None for all packages, otherwise a unicode string of the package name
+
+    :param queue:
+        A StringQueue object to write the summary to
+    """
+
+    import sqlite3
+
+    try:
+        state = ExportState()
+        since_id = state.last_id(coverage_database, archive_path, package_name)
+        connection = open_database(readable_database(coverage_database))
+        try:
+            count, max_id = export_results(connection, archive_path, package_name, since_id)
+        finally:
+            connection.close()
+        state.save(coverage_database, archive_path, package_name, max_id)
+        queue.write('Exported %d new results to %s' % (count, archive_path))
+
+    except (sqlite3.Error, IOError, OSError) as e:
+        queue.write('Error exporting results: %s' % e)
+
+    finally:
+        queue.write('\x04')
+
+
+def import_archive(coverage_database, archive_path, queue):
+    """
+    Imports the results from an archive and writes a summary to the queue
+
+    RUNS IN A THREAD
+
+    :param coverage_database:
+        A unicode string of the path to the SQLite coverage database
+
+    :param archive_path:
+        A unicode string of the path to the archive
+
+    :param queue:
+        A StringQueue object to write the summary to
+    """
+
+    import sqlite3
+
+    try:
+        connection = open_database(local_database(coverage_database))
+        try:
+            imported, skipped = import_results(connection, archive_path)
+        finally:
+            connection.close()
+        queue.write('Imported %d results from %s, skipped %d already in the database' % (
+            imported,
+            archive_path,
+            skipped
+        ))
+        report_scheduler.watch(coverage_database)
+
+    except (sqlite3.Error, IOError, OSError, ValueError) as e:
+        queue.write('Error importing results: %s' % e)
+
+    finally:
+        queue.write('\x04')
+
+
+def merge_commit_data(connection, package_name, package_dir, commit_hash, cancel_event=None, file_paths=None):
+    """
+    Loads all of the coverage data in the database for a commit and merges it
+    into a single coverage.CoverageData object
+
+    :param connection:
+        A sqlite3.Connection object for the coverage database
+
+    :param package_name:
+        A unicode string of the package to merge the data for
+
+    :param package_dir:
+        A unicode string of the path to the package's directory
+
+    :param commit_hash:
+        A unicode string of the git SHA1 hash of the commit
+
+    :param cancel_event:
+        None or a threading.Event object - if set while merging, the merge is
+        abandoned
+
+    :param file_paths:
+        None to merge the data for all files, otherwise a set of unicode
+        strings of the absolute paths of the files to merge the data for
+
+    :return:
+        None if cancelled, otherwise a 2-element tuple of:
+        (coverage.CoverageData object, unicode string commit summary)
+    """
+
+    import coverage
+    import coverage.files
+
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT
+            path_prefix,
+            data,
+            commit_summary
+        FROM
+            coverage_results
+        WHERE
+            project = ?
+            AND commit_hash = ?
+        ORDER BY
+            commit_date ASC
+    """, (package_name, commit_hash))
+
+    commit_summary = None
+    data = coverage.CoverageData()
+    try:
+        for row in cursor:
+            if cancel_event and cancel_event.is_set():
+                return None
+            if commit_summary is None:
+                commit_summary = row['commit_summary']
+            byte_string = StringIO()
+            byte_string.write(row['data'])
+            byte_string.seek(0)
+            temp_data = coverage.CoverageData()
+            temp_data.read_fileobj(byte_string)
+            aliases = coverage.files.PathAliases()
+            aliases.add(row['path_prefix'], package_dir + os.sep)
+            if file_paths is None:
+                data.update(temp_data, aliases)
+                continue
+            for measured_file in temp_data.measured_files():
+                mapped_file = aliases.map(measured_file)
+                if mapped_file not in file_paths:
+                    continue
+                if temp_data.has_arcs():
+                    data.add_arcs({mapped_file: dict.fromkeys(temp_data.arcs(measured_file) or [])})
+                else:
+                    data.add_lines({mapped_file: dict.fromkeys(temp_data.lines(measured_file) or [])})
+    finally:
+        cursor.close()
 
-    if sys.version_info >= (3,):
-        old_path = os.getcwd()
-    else:
-        old_path = os.getcwdu()
+    return (data, commit_summary)
 
-    reloader_path = os.path.join(package_dir, 'dev', 'reloader.py')
-    os.chdir(package_dir)
 
-    dev_module_name = '%s.dev' % package_name
-    tests_module_name = '%s.dev.tests' % package_name
-    reloader_module_name = '%s.dev.reloader' % package_name
+def report_fingerprint(connection, package_name, commit_hash):
+    """
+    Generates a string that changes whenever coverage results are added to,
+    or removed from, the database for a commit
 
-    if os.path.exists(reloader_path):
-        if reloader_module_name in sys.modules:
-            reload(sys.modules[reloader_module_name])
-        else:
-            reloader_module_info = imp.find_module('reloader', [os.path.join(package_dir, 'dev')])
-            imp.load_module(reloader_module_name, *reloader_module_info)
+    :param connection:
+        A sqlite3.Connection object for the coverage database
 
-    if tests_module_name in sys.modules:
-        tests_module = sys.modules[tests_module_name]
-        reload(tests_module)
+    :param package_name:
+        A unicode string of the package name
 
-    else:
-        dev_module_info = imp.find_module('dev', [package_dir])
-        imp.load_module(dev_module_name, *dev_module_info)
+    :param commit_hash:
+        A unicode string of the git SHA1 hash of the commit
 
-        tests_module_info = imp.find_module('tests', [os.path.join(package_dir, 'dev')])
-        tests_module = imp.load_module(tests_module_name, *tests_module_info)
+    :return:
+        A unicode string
+    """
 
-    os.chdir(old_path)
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT
+            COUNT(*) AS num_rows,
+            MAX(id) AS max_id
+        FROM
+            coverage_results
+        WHERE
+            project = ?
+            AND commit_hash = ?
+    """, (package_name, commit_hash))
+    row = cursor.fetchone()
+    cursor.close()
 
-    return (tests_module, panel)
+    return '%s-%s' % (row['num_rows'], row['max_id'])
 
 
-def display_results(headline, panel, panel_queue, db_results_file, on_done):
+def build_report(connection, package_name, package_dir, commit_hash, cancel_event=None, timer=None):
     """
-    Displays the results of a test run
+    Generates an HTML report of all of the coverage data in the database for a
+    commit. If a report was already generated from the same results, it is
+    reused.
 
-    :param headline:
-        A unicode string title to display in the output panel
+    :param connection:
+        A sqlite3.Connection object for the coverage database
 
-    :param panel:
-        A sublime.View to write the results to
+    :param package_name:
+        A unicode string of the package to generate the report for
 
-    :param panel_queue:
-        The StringQueue object to fetch test results from
+    :param package_dir:
+        A unicode string of the path to the package's directory
 
-    :param db_results_file:
-        None or a StringIO object so output can be saved in the coverage
-        database
+    :param commit_hash:
+        A unicode string of the git SHA1 hash of the commit
 
-    :param on_done:
-        A callback to execute when the results are done being printed
+    :param cancel_event:
+        None or a threading.Event object - if set before the HTML is written,
+        the report is abandoned
+
+    :param timer:
+        None or a PhaseTimer object to record the phases of building the
+        report with
+
+    :return:
+        None if cancelled, otherwise a unicode string of the path to the
+        index.html file of the report
     """
 
-    # We use a function here so that chars is not redefined in the while
-    # loop before the timeout get fired
-    if sys.version_info >= (3,):
-        def write_to_panel(chars):
-            sublime.set_timeout(lambda: panel.run_command('insert', {'characters': chars}), 10)
-    else:
-        def do_write(chars):
-            edit = panel.begin_edit('package_coverage_insert', [])
-            panel.insert(edit, panel.size(), chars)
-            panel.end_edit(edit)
+    import coverage
+
+    def phase(name):
+        if timer:
+            timer.phase(name)
+
+    coverage_reports_dir = os.path.join(package_dir, 'dev', 'coverage_reports')
+    report_dir = os.path.join(coverage_reports_dir, commit_hash)
+    html_path = os.path.join(report_dir, 'index.html')
+    fingerprint_path = os.path.join(report_dir, '.fingerprint')
+
+    # Reports are only built by one thread at a time so that a report being
+    # generated in the background is reused, rather than clobbered, when
+    # the user asks for the same commit
+    phase('wait for lock')
+    with report_lock:
+        phase('fingerprint')
+        fingerprint = report_fingerprint(connection, package_name, commit_hash)
+        if os.path.exists(html_path) and os.path.exists(fingerprint_path):
+            with open(fingerprint_path, 'rb') as f:
+                if f.read().decode('utf-8') == fingerprint:
+                    return html_path
+
+        phase('merge')
+        result = merge_commit_data(connection, package_name, package_dir, commit_hash, cancel_event)
+        if result is None:
+            return None
+        data, commit_summary = result
+
+        if cancel_event and cancel_event.is_set():
+            return None
 
-        def write_to_panel(chars):
-            sublime.set_timeout(lambda: do_write(chars), 10)
+        if not os.path.exists(coverage_reports_dir):
+            os.mkdir(coverage_reports_dir)
 
-    write_to_panel('%s\n\n  ' % headline)
+        if not os.path.exists(report_dir):
+            os.mkdir(report_dir)
 
-    while True:
-        chars = panel_queue.get()
-        wrapped_chars = chars.replace('\n', '\n  ')
+        data_file_path = os.path.join(report_dir, '.coverage')
+        data.write_file(data_file_path)
 
-        if chars == '':
-            time.sleep(0.05)
-            continue
+        phase('html report')
+        cov = coverage.Coverage(data_file=data_file_path)
+        cov.load()
+        title = '%s (%s %s) coverage report' % (package_name, commit_hash, commit_summary)
+        cov.html_report(directory=report_dir, title=title)
 
-        if chars[-1] == '\x04':
-            chars = chars[0:-1]
-            if db_results_file:
-                db_results_file.write(chars)
-            wrapped_chars = wrapped_chars[0:-1]
-            write_to_panel(wrapped_chars)
-            break
+        with open(fingerprint_path, 'wb') as f:
+            f.write(fingerprint.encode('utf-8'))
 
-        if db_results_file:
-            db_results_file.write(chars)
-        write_to_panel(wrapped_chars)
+    return html_path
 
-    on_done()
 
+def open_report(html_path):
+    """
+    Opens an HTML coverage report in the user's web browser
 
-def run_tests(tests_module, queue, name_pattern, on_done):
+    :param html_path:
+        A unicode string of the path to the index.html file of the report
     """
-    Executes the tests within a module and sends the output through the queue
-    for display via another thread
 
-    :param tests_module:
-        The module that contains unittest.TestCase classes to execute
+    import webbrowser
 
-    :param queue:
-        A StringQueue object to send the results to
+    if HEADLESS:
+        print(html_path)
+        return
 
-    :param name_pattern:
-        None or a re._pattern_type object for matching test names against
+    if sys.platform != 'win32':
+        html_path = 'file://' + html_path
+    webbrowser.open_new(html_path)
 
-    :param on_done:
-        A callback to execute when the tests are done being run
+
+def diff_coverage_report(connection, package_name, package_dir, old_commit, new_commit):
     """
+    Generates a text report of the coverage of the statements added or changed
+    between two commits, using the merged results for the newer commit. Only
+    the data for files touched by the diff is loaded.
 
-    test_classes = []
-    for name, obj in inspect.getmembers(tests_module):
-        if inspect.isclass(obj) and issubclass(obj, unittest.TestCase):
-            test_classes.append(obj)
+    :param connection:
+        A sqlite3.Connection object for the coverage database
 
-    suite = unittest.TestSuite()
-    loader = unittest.TestLoader()
-    for test_class in test_classes:
-        if name_pattern:
-            for name in loader.getTestCaseNames(test_class):
-                if name_pattern.search(name):
-                    suite.addTest(test_class(name))
-        else:
-            suite.addTest(loader.loadTestsFromTestCase(test_class))
-    verbosity = 2 if name_pattern else 1
-    unittest.TextTestRunner(stream=queue, verbosity=verbosity).run(suite)
+    :param package_name:
+        A unicode string of the package name
 
-    on_done()
+    :param package_dir:
+        A unicode string of the path to the package's directory
 
+    :param old_commit:
+        A unicode string of the git SHA1 hash of the base commit
 
-def git_commit_info(package_dir):
+    :param new_commit:
+        A unicode string of the git SHA1 hash of the commit with coverage
+        results to report on
+
+    :return:
+        A unicode string of the report
     """
-    Get the git SHA1 hash, commit date and summary for the current git commit
+
+    import coverage
+    import coverage.parser
+    import coverage.results
+
+    changed = git_changed_lines(package_dir, old_commit, new_commit)
+    file_paths = set(changed.keys())
+    data, _ = merge_commit_data(connection, package_name, package_dir, new_commit, file_paths=file_paths)
+
+    exclude_list = coverage.Coverage(config_file=False).get_exclude_list()
+    exclude = '|'.join(['(?:%s)' % regex for regex in exclude_list])
+
+    rows = []
+    total_statements = 0
+    total_missing = 0
+    for file_path in sorted(file_paths):
+        # The source is read from the newer commit since the working copy
+        # may be checked out at some other point in the history
+        relative_path = os.path.relpath(file_path, package_dir)
+        source = run_git(package_dir, ['show', '%s:./%s' % (new_commit, relative_path.replace(os.sep, '/'))])
+        parser = coverage.parser.PythonParser(text=source, exclude=exclude)
+        parser.parse_source()
+
+        statements = set([parser.first_line(line) for line in changed[file_path]]) & parser.statements
+        if not statements:
+            continue
+        executed = set(data.lines(file_path) or [])
+        missing = statements - executed
+
+        total_statements += len(statements)
+        total_missing += len(missing)
+        rows.append((
+            '.' + os.sep + os.path.join(package_name, relative_path),
+            len(statements),
+            len(missing),
+            coverage.results.format_lines(statements, missing)
+        ))
+
+    if not rows:
+        return 'No Python statements were added or changed between %s and %s\n' % (old_commit, new_commit)
+
+    name_width = max([len(row[0]) for row in rows] + [5])
+    header = '%s   Stmts   Miss  Cover   Missing' % 'Name'.ljust(name_width)
+    lines = [header, '-' * len(header)]
+    for name, num_statements, num_missing, missing_lines in rows:
+        percent = 100 * (num_statements - num_missing) // num_statements
+        lines.append('%s  %6d %6d %5d%%   %s' % (
+            name.ljust(name_width),
+            num_statements,
+            num_missing,
+            percent,
+            missing_lines
+        ))
+    lines.append('-' * len(header))
+    lines.append('%s  %6d %6d %5d%%' % (
+        'TOTAL'.ljust(name_width),
+        total_statements,
+        total_missing,
+        100 * (total_statements - total_missing) // total_statements
+    ))
+
+    return '\n'.join(lines) + '\n'
+
+
+def build_platform_matrix(connection, package_name, package_dir, commit_hash):
+    """
+    Computes which platform and Python version combinations covered each line
+    of a package at a commit. Each combination is assigned a bit, and every
+    line is mapped to an integer bitmask of the combinations that executed
+    it, so merging dozens of runs is a series of OR operations.
+
+    :param connection:
+        A sqlite3.Connection object for the coverage database
+
+    :param package_name:
+        A unicode string of the package name
 
     :param package_dir:
-        A unicode string of the filesystem path to the folder containing the
-        package
+        A unicode string of the path to the package's directory
+
+    :param commit_hash:
+        A unicode string of the git SHA1 hash of the commit
 
     :return:
-        A tuple containing:
-        [0] A unicode string of the short commit hash
-        [1] A datetime.datetime object of the commit date
-        [2] A unicode string of the commit message summary
+        A 2-element tuple of:
+        [0] A list of 2-element tuples of (platform, python version), where
+            the index of each is the bit number used in the masks
+        [1] A dict with unicode string keys of file paths and dict values
+            mapping integer line numbers to integer bitmasks
     """
 
-    startupinfo = None
-    if sys.platform == 'win32':
-        startupinfo = subprocess.STARTUPINFO()
-        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    import coverage
+    import coverage.files
 
-    _, env = shellenv.get_env(for_subprocess=True)
-    proc = subprocess.Popen(
-        ['git', 'log', '-n', '1', "--pretty=format:%h %at %s", 'HEAD'],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        env=env,
-        cwd=package_dir,
-        startupinfo=startupinfo
-    )
-    stdout, stderr = proc.communicate()
-    if stderr:
-        raise OSError(stderr.decode('utf-8').strip())
-    parts = stdout.decode('utf-8').strip().split(' ', 2)
-    return (parts[0], datetime.utcfromtimestamp(int(parts[1])), parts[2])
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT
+            platform,
+            python_version,
+            path_prefix,
+            data
+        FROM
+            coverage_results
+        WHERE
+            project = ?
+            AND commit_hash = ?
+        ORDER BY
+            platform ASC,
+            python_version ASC
+    """, (package_name, commit_hash))
+
+    combinations = []
+    bits = {}
+    matrix = {}
+    for row in cursor:
+        combination = (row['platform'], row['python_version'])
+        if combination not in bits:
+            bits[combination] = 1 << len(combinations)
+            combinations.append(combination)
+        bit = bits[combination]
+
+        byte_string = StringIO()
+        byte_string.write(row['data'])
+        byte_string.seek(0)
+        row_data = coverage.CoverageData()
+        row_data.read_fileobj(byte_string)
+        aliases = coverage.files.PathAliases()
+        aliases.add(row['path_prefix'], package_dir + os.sep)
+
+        for measured_file in row_data.measured_files():
+            file_masks = matrix.setdefault(aliases.map(measured_file), {})
+            for line in row_data.lines(measured_file) or []:
+                file_masks[line] = file_masks.get(line, 0) | bit
 
+    cursor.close()
 
-def is_git_clean(package_dir):
-    """
-    Detects if the git repository is currently all committed
+    return (combinations, matrix)
 
-    :param package_dir:
-        A unicode string of the filesystem path to the folder containing the
-        package
 
-    :return:
-        A boolean - if the repository is clean
+def write_matrix_report(report_dir, title, package_dir, combinations, matrix):
     """
+    Writes an HTML page listing, per file, the lines that were only covered on
+    some of the platform and Python version combinations
 
-    startupinfo = None
-    if sys.platform == 'win32':
-        startupinfo = subprocess.STARTUPINFO()
-        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    :param report_dir:
+        A unicode string of the directory to write platform_matrix.html to
 
-    _, env = shellenv.get_env(for_subprocess=True)
-    proc = subprocess.Popen(
-        ['git', 'status', '--porcelain'],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        env=env,
-        cwd=package_dir,
-        startupinfo=startupinfo
-    )
-    stdout, stderr = proc.communicate()
-    if stderr:
-        raise OSError(stderr.decode('utf-8').strip())
-    return len(stdout.decode('utf-8').strip()) == 0
+    :param title:
+        A unicode string of the title of the report
 
+    :param package_dir:
+        A unicode string of the path to the package's directory
 
-def open_database(coverage_database):
-    """
-    Opens and, if needed, initializes the coverage database for saving results
+    :param combinations:
+        A list of 2-element tuples of (platform, python version) - the first
+        element of the return value from build_platform_matrix()
 
-    :param coverage_database:
-        A unicode string of the path to the sqlite file to use as the database
+    :param matrix:
+        A dict of file paths to dicts of line bitmasks - the second element
+        of the return value from build_platform_matrix()
 
     :return:
-        A Python sqlite3.Connection object
+        A unicode string of the path to the HTML file
     """
 
-    connection = sqlite3.connect(coverage_database, detect_types=sqlite3.PARSE_DECLTYPES)
-    connection.row_factory = sqlite3.Row
+    all_mask = (1 << len(combinations)) - 1
+    headers = ''.join(['<th>%s<br>%s</th>' % (html_escape(p), html_escape(v)) for p, v in combinations])
+
+    sections = []
+    for file_path in sorted(matrix.keys()):
+        file_masks = matrix[file_path]
+        partial_lines = sorted([line for line, mask in file_masks.items() if mask != all_mask])
+
+        counts = [0] * len(combinations)
+        for mask in file_masks.values():
+            for index in range(len(combinations)):
+                if mask & (1 << index):
+                    counts[index] += 1
+
+        source_lines = []
+        if os.path.exists(file_path):
+            with open(file_path, 'rb') as f:
+                source_lines = f.read().decode('utf-8', 'replace').splitlines()
+
+        rows = []
+        for line in partial_lines:
+            mask = file_masks[line]
+            cells = ''.join(['<td>%s</td>' % ('&#x2713;' if mask & (1 << i) else '') for i in range(len(combinations))])
+            source = source_lines[line - 1] if line <= len(source_lines) else ''
+            rows.append('<tr><td>%d</td>%s<td><pre>%s</pre></td></tr>' % (line, cells, html_escape(source)))
+
+        relative_path = os.path.relpath(file_path, package_dir) if file_path.startswith(package_dir) else file_path
+        sections.extend([
+            '<h2>%s</h2>' % html_escape(relative_path),
+            '<p>%d lines executed, %d on only some platforms</p>' % (len(file_masks), len(partial_lines)),
+            '<table>',
+            '<tr><th>Line</th>%s<th>Source</th></tr>' % headers,
+            '<tr><td>Total</td>%s<td></td></tr>' % ''.join(['<td>%d</td>' % count for count in counts]),
+        ])
+        sections.extend(rows)
+        sections.append('</table>')
+
+    html = '\n'.join([
+        '<!DOCTYPE html>',
+        '<html>',
+        '<head>',
+        '<meta charset="utf-8">',
+        '<title>%s</title>' % html_escape(title),
+        '<style>',
+        'body { font-family: sans-serif; }',
+        'table { border-collapse: collapse; }',
+        'th, td { border: 1px solid #ccc; padding: 2px 6px; text-align: center; }',
+        'td pre { margin: 0; text-align: left; }',
+        '</style>',
+        '</head>',
+        '<body>',
+        '<h1>%s</h1>' % html_escape(title),
+    ] + sections + [
+        '</body>',
+        '</html>',
+        ''
+    ])
+
+    html_path = os.path.join(report_dir, 'platform_matrix.html')
+    with open(html_path, 'wb') as f:
+        f.write(html.encode('utf-8'))
+    return html_path
+
+
+def html_escape(string):
+    """
+    Escapes a string for inclusion in HTML
 
-    cursor = connection.cursor()
-    cursor.execute("""
-        SELECT
-            name
-        FROM
-            sqlite_master
-        WHERE
-            type = 'table'
-            AND name = 'coverage_results'
-    """)
-    if len(cursor.fetchall()) != 1:
-        if sys.version_info >= (3,):
-            sql_bytes = sublime.load_binary_resource('Packages/Package Coverage/coverage.sql')
-        else:
-            dirname = os.path.dirname(__file__)
-            with open(os.path.join(dirname, 'coverage.sql'), 'rb') as f:
-                sql_bytes = f.read()
-        sql = sql_bytes.decode('utf-8')
-        cursor.execute(sql)
-    cursor.close()
+    :param string:
+        A unicode string
 
-    return connection
+    :return:
+        A unicode string with &, <, > and " escaped
+    """
+
+    string = string.replace('&', '&amp;')
+    string = string.replace('<', '&lt;')
+    string = string.replace('>', '&gt;')
+    return string.replace('"', '&quot;')
 
 
 def find_testable_packages():
@@ -1148,3 +6989,352 @@ if sys.platform == 'win32':
         if short_path != path:
             return short_path
         return None
+
+
+report_lock = threading.Lock()
+shard_lock = threading.Lock()
+report_scheduler = ReportScheduler()
+coverage_overlay = CoverageOverlay()
+warm_workers = {}
+warm_workers_lock = threading.Lock()
+
+
+def plugin_loaded():
+    """
+    Starts pre-generating reports in the background, if enabled via the
+    "pregenerate_reports" setting, and starts the warm workers, if enabled via
+    the "warm_worker" setting
+    """
+
+    settings = sublime.load_settings('Package Coverage.sublime-settings')
+    report_scheduler.watch(settings.get('coverage_database'))
+    report_scheduler.start(settings.get('pregenerate_reports', 0), sublime.packages_path())
+    threading.Thread(target=start_warm_workers).start()
+
+
+def plugin_unloaded():
+    """
+    Stops the background report thread and the warm workers when the plugin
+    is reloaded
+    """
+
+    report_scheduler.stop()
+    stop_warm_workers()
+
+
+# Sublime Text 2 does not call plugin_loaded() and uses a different name for
+# the unload callback
+if sys.version_info < (3,) and not HEADLESS:
+    plugin_loaded()
+    unload_handler = plugin_unloaded
+
+
+def register_headless_package(package_name, package_dir):
+    """
+    Creates a module for a package so that relative imports within its tests
+    work when run from the command line, as Sublime Text would have loaded it
+
+    :param package_name:
+        A unicode string of the package name
+
+    :param package_dir:
+        A unicode string of the path to the package's directory
+    """
+
+    if package_name in sys.modules:
+        return
+    module = imp.new_module(package_name)
+    module.__path__ = [package_dir]
+    sys.modules[package_name] = module
+
+
+def measure_import_time(python_executable, runs=5):
+    """
+    Imports this file in new Python processes, as Sublime Text does when
+    loading the plugin, to check the cost of loading it
+
+    :param python_executable:
+        A unicode string of the path to the Python interpreter
+
+    :param runs:
+        The number of processes to import the file in - the fastest is used
+
+    :return:
+        A 3-element tuple of:
+        [0] A float of the fewest seconds taken to import the file
+        [1] A list of unicode strings of the DEFERRED_MODULES that were
+            imported as a side effect
+        [2] A list of unicode strings of the DEFERRED_MODULES that the
+            unittest module imports with this Python version, which are not
+            included in [1]
+    """
+
+    import subprocess
+
+    dirname = os.path.dirname(os.path.abspath(__file__))
+    script = dedent('''
+        import json, sys, time
+        sys.path[0:0] = [%r, %r]
+        import sublime, sublime_plugin
+        start = time.time()
+        import %s
+        elapsed = time.time() - start
+        loaded = [name for name in %r if name in sys.modules]
+        sys.stdout.write(json.dumps({'elapsed': elapsed, 'loaded': loaded}))
+    ''')
+    headless_dir = os.path.join(dirname, 'headless')
+    module_names = [str(name) for name in DEFERRED_MODULES]
+
+    def import_module(name):
+        # Sublime Text does not write bytecode for plugins, so neither do the
+        # processes, meaning the time includes compiling the file
+        proc = subprocess.Popen(
+            [python_executable, '-B', '-c', script % (str(dirname), str(headless_dir), name, module_names)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        stdout, stderr = proc.communicate()
+        if proc.returncode != 0:
+            raise OSError(stderr.decode('utf-8', 'replace'))
+        return json.loads(stdout.decode('utf-8'))
+
+    required = import_module('unittest')['loaded']
+
+    timings = []
+    loaded = []
+    for _ in range(runs):
+        result = import_module('package_coverage')
+        timings.append(result['elapsed'])
+        loaded = [name for name in result['loaded'] if name not in required]
+
+    return (min(timings), loaded, required)
+
+
+def wait_for_threads():
+    """
+    Blocks until all threads, other than the current one, have completed
+    """
+
+    current = threading.current_thread()
+    while True:
+        others = [t for t in threading.enumerate() if t is not current and not t.daemon]
+        if not others:
+            break
+        for thread in others:
+            thread.join()
+
+
+def main(args):
+    """
+    Runs Package Coverage from the command line, with output written to
+    stdout. The window commands are driven by scripted answers to the quick
+    and input panels they would normally display.
+
+    :param args:
+        A list of unicode strings of the command line arguments
+
+    :return:
+        An integer exit code
+    """
+
+    import argparse
+    import coverage
+
+    parser = argparse.ArgumentParser(
+        prog='python -m package_coverage',
+        description='Runs tests and reports coverage for Sublime Text packages'
+    )
+    parser.add_argument(
+        '--packages-path',
+        help='the Sublime Text Packages folder, defaults to the parent of this package'
+    )
+    parser.add_argument(
+        '--database',
+        help='the path to the SQLite coverage database, overrides the coverage_database setting'
+    )
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser('run', help='run the tests for a package')
+    run_parser.add_argument('package')
+    run_parser.add_argument('--coverage', action='store_true', help='measure coverage')
+    run_parser.add_argument('--html', action='store_true', help='generate an HTML coverage report')
+    run_parser.add_argument('--memory', action='store_true', help='measure the memory allocated by each test')
+    run_parser.add_argument('--name', metavar='REGEX', help='only run tests with names matching the regex')
+    run_parser.add_argument('--classes', help='comma-separated names of the test classes to run')
+    run_parser.add_argument('--tests', help='comma-separated names of the tests to run, as ClassName.test_name')
+    run_parser.add_argument(
+        '--minimize',
+        action='store_true',
+        help='save the smallest set of tests that covers the same lines as the full suite'
+    )
+    run_parser.add_argument('--smoke-suite', action='store_true', help='only run the tests saved by --minimize')
+    run_parser.add_argument('--seed', type=int, help='run the tests in a random order, seeded with this number')
+    run_parser.add_argument(
+        '--full-run',
+        action='store_true',
+        help='run every test, even if cache_test_results is enabled and the test is unchanged'
+    )
+    run_parser.add_argument(
+        '--data-file',
+        help='write the results as JSON to this file instead of saving them in the coverage database'
+    )
+
+    report_parser = subparsers.add_parser('report', help='generate an HTML report for a commit')
+    report_parser.add_argument('package')
+    report_parser.add_argument('commit')
+
+    serve_parser = subparsers.add_parser('serve', help='run tests for a package as requested on stdin')
+    serve_parser.add_argument('package')
+
+    merge_parser = subparsers.add_parser('merge', help='merge the coverage data for a commit')
+    merge_parser.add_argument('package')
+    merge_parser.add_argument('commit')
+    merge_parser.add_argument('--output', default='.coverage', help='the file to write the data to')
+
+    export_parser = subparsers.add_parser('export', help='append new results from the database to an archive')
+    export_parser.add_argument('--package', help='only export the results for this package')
+    export_parser.add_argument('--output', required=True, help='the archive to append the results to')
+
+    import_parser = subparsers.add_parser('import', help='add the results from an archive to the database')
+    import_parser.add_argument('archive')
+
+    startup_parser = subparsers.add_parser(
+        'startup',
+        help='check the cost of loading the plugin, failing if slow modules are imported'
+    )
+    startup_parser.add_argument('--runs', type=int, default=5, help='the number of times to import the plugin')
+    startup_parser.add_argument('--max-ms', type=float, help='fail if the fastest import takes longer than this')
+
+    options = parser.parse_args(args)
+    if not options.command:
+        parser.print_help()
+        return 2
+
+    if options.packages_path:
+        os.environ['PACKAGE_COVERAGE_PACKAGES_PATH'] = os.path.abspath(options.packages_path)
+
+    project_settings = {}
+    if options.database:
+        project_settings['Package Coverage'] = {'coverage_database': os.path.abspath(options.database)}
+
+    package_dir = None
+    if options.command not in set(['export', 'import', 'startup']):
+        package_dir = os.path.join(sublime.packages_path(), options.package)
+        register_headless_package(options.package, package_dir)
+
+    if options.command == 'run':
+        if options.data_file:
+            project_settings['Package Coverage'] = {'coverage_database': None}
+        answers = [options.package]
+        if options.name is not None:
+            answers.extend([REGEX_CAPTION, options.name])
+        window = sublime.Window(answers, project_settings)
+        command = PackageCoverageExecCommand(window)
+
+        def write_data_file(result, hung=False):
+            if not options.data_file:
+                return
+            with open(options.data_file, 'wb') as f:
+                f.write(json.dumps({
+                    'success': result is not None and result.wasSuccessful(),
+                    'record': command.coverage_record,
+                    'history': command.history.run if command.history else {},
+                    'test_cache': command.test_cache.run if command.test_cache else {},
+                    'hung': hung
+                }).encode('utf-8'))
+
+        # The thread running the tests can not be stopped, so the process
+        # exits immediately once the output has been displayed
+        def exit_hung():
+            write_data_file(None, True)
+            sys.stdout.flush()
+            os._exit(1)
+
+        command.on_hang = exit_hung
+        command.run(
+            do_coverage=options.coverage or options.html,
+            ui_thread=True,
+            html_report=options.html,
+            by_name=options.name is not None,
+            full_run=options.full_run,
+            class_names=options.classes.split(',') if options.classes else None,
+            save_history=not options.data_file,
+            measure_memory=options.memory,
+            seed=options.seed,
+            minimize=options.minimize,
+            smoke_suite=options.smoke_suite,
+            test_names=options.tests.split(',') if options.tests is not None else None
+        )
+        wait_for_threads()
+        result = getattr(command, 'result', None)
+        write_data_file(result)
+        if result is None or not result.wasSuccessful():
+            return 1
+
+    elif options.command == 'report':
+        window = sublime.Window([options.package, options.commit], project_settings)
+        PackageCoverageDisplayReportCommand(window).run()
+        wait_for_threads()
+
+    elif options.command == 'serve':
+        serve_package(options.package)
+
+    elif options.command == 'merge':
+        settings = sublime.load_settings('Package Coverage.sublime-settings')
+        window = sublime.Window([], project_settings)
+        coverage_database = get_setting(window, settings, 'coverage_database')
+        if not coverage_database:
+            sublime.error_message('No coverage database was specified')
+            return 1
+
+        connection = open_database(readable_database(coverage_database))
+        try:
+            data, _ = merge_commit_data(connection, options.package, package_dir, options.commit)
+        finally:
+            connection.close()
+
+        if not data.measured_files():
+            sublime.error_message('No coverage results for %s at commit %s' % (options.package, options.commit))
+            return 1
+
+        data.write_file(options.output)
+        cov = coverage.Coverage(data_file=options.output)
+        cov.load()
+        report, _ = format_coverage_report(cov, options.package, package_dir)
+        print(report)
+
+    elif options.command in set(['export', 'import']):
+        settings = sublime.load_settings('Package Coverage.sublime-settings')
+        window = sublime.Window([], project_settings)
+        coverage_database = get_setting(window, settings, 'coverage_database')
+        if not coverage_database:
+            sublime.error_message('No coverage database was specified')
+            return 1
+
+        queue = StringQueue()
+        if options.command == 'export':
+            export_archive(coverage_database, os.path.abspath(options.output), options.package, queue)
+        else:
+            import_archive(coverage_database, os.path.abspath(options.archive), queue)
+        output = queue.get().rstrip('\x04')
+        print(output)
+        if output.startswith('Error'):
+            return 1
+
+    elif options.command == 'startup':
+        elapsed, loaded, required = measure_import_time(sys.executable, options.runs)
+        print('Imported in %.1fms' % (elapsed * 1000))
+        if required:
+            print('Modules imported by unittest with this version of Python: %s' % ', '.join(required))
+        if loaded:
+            print('Modules that should only be imported when used: %s' % ', '.join(loaded))
+            return 1
+        if options.max_ms is not None and elapsed * 1000 > options.max_ms:
+            print('Import took longer than %.1fms' % options.max_ms)
+            return 1
+
+    return 1 if sublime.error_count else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))